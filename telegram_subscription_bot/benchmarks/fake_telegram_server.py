@@ -0,0 +1,354 @@
+# telegram_subscription_bot/benchmarks/fake_telegram_server.py
+"""
+Servidor local que imita la Bot API de Telegram para pruebas de carga.
+
+Implementa los métodos que usa el bot con la membresía de los canales en
+memoria, y permite configurar la latencia, las respuestas 429 (RetryAfter)
+y los errores aleatorios. El bot se apunta a él con TELEGRAM_API_SERVER:
+
+    python benchmarks/fake_telegram_server.py --port 8081 --latency lognormal:40:0.5 --flood-rate 0.01
+    TELEGRAM_API_SERVER=http://127.0.0.1:8081 python main.py
+
+Rutas de control (fuera de la API):
+    GET  /_fake/stats    llamadas por método, 429 y errores inyectados
+    POST /_fake/members  {"chat_id": ..., "user_id": ..., "status": "member"}
+    POST /_fake/updates  un update o una lista, entregados por getUpdates
+    POST /_fake/reset    vacía membresías, enlaces, updates y contadores
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from itertools import count
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger("fake_telegram")
+
+BOT_ID = 42
+NOT_MEMBER_STATUSES = ("left", "kicked")
+
+class LatencyModel:
+    """
+    Distribución de la latencia simulada, en milisegundos.
+
+    Formatos: "fixed:20", "uniform:5:50", "normal:30:10" (media, desviación)
+    y "lognormal:30:0.5" (mediana, sigma).
+    """
+
+    def __init__(self, spec: str = "fixed:0"):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(param) for param in params]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        if len(self.params) != (1 if kind == "fixed" else 2):
+            raise ValueError(f"Wrong number of parameters for {kind}: {spec}")
+
+    def sample(self) -> float:
+        """Latencia en segundos"""
+        if self.kind == "fixed":
+            milliseconds = self.params[0]
+        elif self.kind == "uniform":
+            milliseconds = random.uniform(*self.params)
+        elif self.kind == "normal":
+            milliseconds = random.gauss(*self.params)
+        else:
+            median, sigma = self.params
+            milliseconds = median * random.lognormvariate(0, sigma) if median > 0 else 0
+        return max(milliseconds, 0) / 1000
+
+class TelegramAPIError(Exception):
+    def __init__(self, error_code: int, description: str, parameters: Optional[dict] = None):
+        super().__init__(description)
+        self.error_code = error_code
+        self.description = description
+        self.parameters = parameters
+
+class FakeTelegramServer:
+    """Bot API simulada sobre aiohttp"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, latency: LatencyModel = None,
+                 flood_rate: float = 0.0, retry_after: int = 1, error_rate: float = 0.0,
+                 member_ratio: float = 0.0, seed: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency or LatencyModel()
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        # Fracción estable de usuarios que ya están en cualquier canal sin registro previo
+        self.member_ratio = member_ratio
+        if seed is not None:
+            random.seed(seed)
+
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        self.app.router.add_get("/_fake/stats", self.handle_stats)
+        self.app.router.add_post("/_fake/members", self.handle_members)
+        self.app.router.add_post("/_fake/updates", self.handle_updates)
+        self.app.router.add_post("/_fake/reset", self.handle_reset)
+        self._runner: Optional[web.AppRunner] = None
+
+        self.methods = {
+            "getMe": self.get_me,
+            "getChat": self.get_chat,
+            "getChatMember": self.get_chat_member,
+            "createChatInviteLink": self.create_chat_invite_link,
+            "revokeChatInviteLink": self.revoke_chat_invite_link,
+            "banChatMember": self.ban_chat_member,
+            "unbanChatMember": self.unban_chat_member,
+            "sendMessage": self.send_message,
+            "sendPhoto": self.send_message,
+            "sendVideo": self.send_message,
+            "sendDocument": self.send_message,
+            "copyMessage": self.copy_message,
+            "editMessageText": self.send_message,
+            "editMessageReplyMarkup": self.send_message,
+            "deleteMessage": self.ok,
+            "answerCallbackQuery": self.ok,
+            "setWebhook": self.ok,
+            "deleteWebhook": self.ok,
+            "getUpdates": self.get_updates,
+        }
+        self.reset()
+
+    def reset(self):
+        # chat_id -> user_id -> estado
+        self.members: Dict[str, Dict[int, str]] = defaultdict(dict)
+        self.invite_links: Dict[str, dict] = {}
+        self.updates = []
+        self._new_update = asyncio.Event()
+        self._ids = count(1)
+        self.stats = {"calls": defaultdict(int), "flood_waits": defaultdict(int), "errors": defaultdict(int)}
+
+    # --- Respuestas ---
+
+    @staticmethod
+    def _bot_user() -> dict:
+        return {"id": BOT_ID, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    @staticmethod
+    def _chat(chat_id) -> dict:
+        chat_id = int(chat_id)
+        if chat_id > 0:
+            return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}"}
+        return {"id": chat_id, "type": "channel", "title": f"Channel {chat_id}"}
+
+    def _status(self, chat_id, user_id: int) -> str:
+        status = self.members[str(chat_id)].get(user_id)
+        if status is None:
+            status = "member" if (user_id % 100) < self.member_ratio * 100 else "left"
+        return status
+
+    async def ok(self, params: dict) -> Any:
+        return True
+
+    async def get_me(self, params: dict) -> dict:
+        return self._bot_user()
+
+    async def get_chat(self, params: dict) -> dict:
+        return self._chat(params["chat_id"])
+
+    async def get_chat_member(self, params: dict) -> dict:
+        user_id = int(params["user_id"])
+        status = self._status(params["chat_id"], user_id)
+        member = {"status": status, "user": self._user(user_id)}
+        if status == "kicked":
+            member["until_date"] = 0
+        return member
+
+    async def create_chat_invite_link(self, params: dict) -> dict:
+        link = {
+            "invite_link": f"https://t.me/+fake{next(self._ids)}",
+            "creator": self._bot_user(),
+            "creates_join_request": False,
+            "is_primary": False,
+            "is_revoked": False,
+        }
+        for field in ("name", "expire_date", "member_limit"):
+            if field in params:
+                link[field] = params[field] if field == "name" else int(params[field])
+        self.invite_links[link["invite_link"]] = {**link, "chat_id": str(params["chat_id"])}
+        return link
+
+    async def revoke_chat_invite_link(self, params: dict) -> dict:
+        stored = self.invite_links.get(params["invite_link"])
+        if stored is None or stored["chat_id"] != str(params["chat_id"]):
+            raise TelegramAPIError(400, "Bad Request: INVITE_HASH_INVALID")
+        stored["is_revoked"] = True
+        return {key: value for key, value in stored.items() if key != "chat_id"}
+
+    async def ban_chat_member(self, params: dict) -> bool:
+        self.members[str(params["chat_id"])][int(params["user_id"])] = "kicked"
+        return True
+
+    async def unban_chat_member(self, params: dict) -> bool:
+        chat = self.members[str(params["chat_id"])]
+        user_id = int(params["user_id"])
+        if params.get("only_if_banned") in ("true", "True") and chat.get(user_id) != "kicked":
+            return True
+        chat[user_id] = "left"
+        return True
+
+    async def send_message(self, params: dict) -> dict:
+        chat_id = params.get("chat_id") or 0
+        return {
+            "message_id": int(params.get("message_id") or next(self._ids)),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "text": params.get("text") or "",
+        }
+
+    async def copy_message(self, params: dict) -> dict:
+        return {"message_id": next(self._ids)}
+
+    async def get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        # Confirmar los updates anteriores al offset
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout=min(int(params.get("timeout") or 0), 30))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self.updates[:limit]
+
+    # --- Inyección de fallos ---
+
+    def _inject_fault(self, method: str) -> None:
+        if method == "getUpdates":
+            return
+        roll = random.random()
+        if roll < self.flood_rate:
+            self.stats["flood_waits"][method] += 1
+            raise TelegramAPIError(
+                429, f"Too Many Requests: retry after {self.retry_after}",
+                {"retry_after": self.retry_after}
+            )
+        if roll < self.flood_rate + self.error_rate:
+            self.stats["errors"][method] += 1
+            raise TelegramAPIError(500, "Internal Server Error")
+
+    # --- Rutas ---
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method_name = request.match_info["method"]
+        # La Bot API no distingue mayúsculas en el nombre del método
+        handler_name = next((name for name in self.methods if name.lower() == method_name.lower()), None)
+        self.stats["calls"][handler_name or method_name] += 1
+        if handler_name is None:
+            return self._error(TelegramAPIError(404, "Not Found: method not found"))
+
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                post = await request.post()
+                params.update({key: value for key, value in post.items() if isinstance(value, str)})
+
+        if handler_name != "getUpdates":
+            await asyncio.sleep(self.latency.sample())
+        try:
+            self._inject_fault(handler_name)
+            result = await self.methods[handler_name](params)
+        except TelegramAPIError as e:
+            return self._error(e)
+        except (KeyError, ValueError) as e:
+            return self._error(TelegramAPIError(400, f"Bad Request: invalid parameter {e}"))
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(error: TelegramAPIError) -> web.Response:
+        body = {"ok": False, "error_code": error.error_code, "description": error.description}
+        if error.parameters:
+            body["parameters"] = error.parameters
+        return web.json_response(body, status=error.error_code)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "calls": dict(sorted(self.stats["calls"].items())),
+            "flood_waits": dict(self.stats["flood_waits"]),
+            "errors": dict(self.stats["errors"]),
+            "members": {chat_id: len(users) for chat_id, users in self.members.items()},
+            "invite_links": len(self.invite_links),
+            "pending_updates": len(self.updates),
+        })
+
+    async def handle_members(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        self.members[str(data["chat_id"])][int(data["user_id"])] = data.get("status", "member")
+        return web.json_response({"ok": True})
+
+    async def handle_updates(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        updates = data if isinstance(data, list) else [data]
+        self.updates.extend(updates)
+        self._new_update.set()
+        return web.json_response({"ok": True, "queued": len(updates)})
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"ok": True})
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info("Fake Telegram Bot API listening on %s", self.base_url)
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bot API de Telegram simulada")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", default="fixed:0", help="distribución de latencia en ms, p. ej. lognormal:30:0.5")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="fracción de llamadas que reciben un 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="segundos de retry_after en los 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de llamadas que fallan con 500")
+    parser.add_argument("--member-ratio", type=float, default=0.0, help="fracción de usuarios ya en los canales")
+    parser.add_argument("--seed", type=int, help="semilla para repetir la misma secuencia de fallos")
+    return parser.parse_args()
+
+async def serve(args):
+    server = FakeTelegramServer(
+        host=args.host, port=args.port, latency=LatencyModel(args.latency),
+        flood_rate=args.flood_rate, retry_after=args.retry_after, error_rate=args.error_rate,
+        member_ratio=args.member_ratio, seed=args.seed
+    )
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
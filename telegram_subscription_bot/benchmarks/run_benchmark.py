@@ -0,0 +1,398 @@
+# telegram_subscription_bot/benchmarks/run_benchmark.py
+"""
+Benchmark de extremo a extremo del procesamiento de updates.
+
+Construye el Dispatcher real (middlewares y routers de main.py) contra una
+sesión de bot simulada y una base de datos SQLite temporal, reproduce
+cargas sintéticas y guarda los resultados en JSON para comparar ejecuciones.
+
+    python benchmarks/run_benchmark.py --users 500 --output bench.json
+    python benchmarks/run_benchmark.py --baseline bench.json
+    python benchmarks/run_benchmark.py --api-server http://127.0.0.1:8081
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from itertools import count
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_ADMIN_ID = 900000001
+BENCH_BOT_TOKEN = "42:BENCHMARK"
+
+def configure_environment(db_path: str):
+    """La configuración se lee al importar config.py: hay que fijarla antes"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["BOT_TOKEN"] = BENCH_BOT_TOKEN
+    os.environ["ADMIN_IDS"] = str(BENCH_ADMIN_ID)
+    os.environ.setdefault("FREE_CHANNEL_ID", "-1001")
+    os.environ.setdefault("VIP_CHANNEL_ID", "-1002")
+    os.environ.setdefault("FSM_STORAGE", "database")
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+def summarize(records):
+    latencies = [record["latency"] for record in records]
+    queries = [record["queries"] for record in records]
+    sessions = [record["sessions"] for record in records]
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0) * 1000, 3),
+        "db_queries_per_update": round(sum(queries) / len(queries), 2) if queries else 0.0,
+        "db_sessions_per_update": round(sum(sessions) / len(sessions), 2) if sessions else 0.0,
+    }
+
+def build_mock_session(latency: float, member_ratio: float):
+    from aiogram.client.session.base import BaseSession
+
+    class MockSession(BaseSession):
+        """Sesión que responde como la Bot API sin salir a la red"""
+
+        def __init__(self):
+            super().__init__()
+            self.calls = {}
+            self._ids = count(1)
+
+        async def close(self):
+            pass
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        def _result(self, bot, method):
+            name = method.__api_method__
+            bot_user = {"id": bot.id, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+            if name == "getMe":
+                return bot_user
+            if name == "getChatMember":
+                # Una fracción estable de usuarios ya está en el canal
+                is_member = (method.user_id % 100) < member_ratio * 100
+                return {
+                    "status": "member" if is_member else "left",
+                    "user": {"id": method.user_id, "is_bot": False, "first_name": "User"}
+                }
+            if name == "createChatInviteLink":
+                return {
+                    "invite_link": f"https://t.me/+bench{next(self._ids)}",
+                    "creator": bot_user,
+                    "creates_join_request": False,
+                    "is_primary": False,
+                    "is_revoked": False
+                }
+            if name.startswith(("send", "edit")):
+                chat_id = getattr(method, "chat_id", None) or 0
+                return {
+                    "message_id": next(self._ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "channel"},
+                    "text": getattr(method, "text", None) or ""
+                }
+            return True
+
+        async def make_request(self, bot, method, timeout=None):
+            name = method.__api_method__
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if latency:
+                await asyncio.sleep(latency)
+            content = json.dumps({"ok": True, "result": self._result(bot, method)})
+            return self.check_response(bot, method, 200, content).result
+
+    return MockSession()
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def message(self, user_id, text):
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+                **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}
+                   if text.startswith("/") else {})
+            }
+        }
+
+    def callback(self, user_id, data):
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "menu"
+                }
+            }
+        }
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.factory = UpdateFactory()
+
+    async def setup(self):
+        from aiogram import Bot
+        from aiogram.enums import ParseMode
+        from sqlalchemy import event
+        from database.db import init_db, engine
+        from database.query_tracker import active_stats
+        from database.fsm_storage import DatabaseStorage
+        from aiogram.fsm.storage.memory import MemoryStorage
+        from services.subscription_service import SubscriptionService
+        from services.user_sync_service import user_sync
+        from main import build_dispatcher
+        from config import FSM_STORAGE
+
+        # main.py configura el logging al importarse: silenciar el registro por update
+        logging.getLogger().setLevel(logging.WARNING)
+
+        await init_db()
+        # Arrancar el escritor de perfiles fuera de cualquier update
+        await user_sync.start()
+        await SubscriptionService.load_plan_catalog()
+        self.plan = await SubscriptionService.create_subscription_plan("Benchmark", 30, 9.99)
+
+        if self.args.api_server:
+            # Bot API real o simulada (benchmarks/fake_telegram_server.py) a través de la red
+            from aiogram.client.session.aiohttp import AiohttpSession
+            from aiogram.client.telegram import TelegramAPIServer
+            self.session = AiohttpSession(api=TelegramAPIServer.from_base(self.args.api_server))
+        else:
+            self.session = build_mock_session(self.args.telegram_latency / 1000, self.args.member_ratio)
+        self.bot = Bot(token=BENCH_BOT_TOKEN, session=self.session, parse_mode=ParseMode.HTML)
+        if self.args.rate_limit:
+            from middlewares.request_scheduler import RequestSchedulerMiddleware
+            self.bot.session.middleware(RequestSchedulerMiddleware())
+
+        self.storage = DatabaseStorage() if FSM_STORAGE == "database" else MemoryStorage()
+        self.dp = build_dispatcher(self.storage)
+
+        self.unattributed_queries = 0
+
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def count_background_query(conn, cursor, statement, parameters, context, executemany):
+            # Escrituras en segundo plano (volcado de perfiles, estados FSM),
+            # incluidas las de tareas que heredaron el contexto de un update ya terminado
+            if active_stats() is None:
+                self.unattributed_queries += 1
+
+    async def teardown(self):
+        from database.db import close_db
+        from services.user_sync_service import user_sync
+
+        await self.storage.close()
+        await user_sync.stop()
+        await self.bot.session.close()
+        await close_db()
+
+    async def feed(self, raw_update, records):
+        from aiogram.types import Update
+        from database.query_tracker import track_queries
+
+        update = Update.model_validate(raw_update, context={"bot": self.bot})
+        record = {"handler": "unhandled", "queries": 0, "sessions": 0, "error": None}
+        started = time.perf_counter()
+        # El middleware de presupuesto comparte estas estadísticas y anota el handler
+        with track_queries() as stats:
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+        record["latency"] = time.perf_counter() - started
+        record["handler"] = stats.handler or "unhandled"
+        record["queries"] = stats.count
+        record["sessions"] = stats.sessions
+        records.append(record)
+
+    async def run_workload(self, name, sequences):
+        """Ejecuta secuencias de updates: cada secuencia en orden, varias a la vez"""
+        records = []
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        unattributed_before = self.unattributed_queries
+
+        async def run_sequence(sequence):
+            async with semaphore:
+                for raw_update in sequence:
+                    await self.feed(raw_update, records)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_sequence(sequence) for sequence in sequences))
+        duration = time.perf_counter() - started
+
+        handlers = {}
+        for record in records:
+            handlers.setdefault(record["handler"], []).append(record)
+
+        errors = [record["error"] for record in records if record["error"]]
+        result = {
+            "updates": len(records),
+            "duration_s": round(duration, 4),
+            "updates_per_sec": round(len(records) / duration, 2) if duration else 0.0,
+            "errors": len(errors),
+            "error_samples": sorted(set(errors))[:5],
+            "background_queries": self.unattributed_queries - unattributed_before,
+            **summarize(records),
+            "handlers": {
+                handler: summarize(items)
+                for handler, items in sorted(handlers.items())
+            }
+        }
+        logging.getLogger("benchmark").warning(
+            "%s: %s updates, %.1f updates/s, p95 %.1f ms, %.1f queries/update",
+            name, result["updates"], result["updates_per_sec"], result["p95_ms"], result["db_queries_per_update"]
+        )
+        return result
+
+    def user_ids(self, offset):
+        return range(offset + 1, offset + self.args.users + 1)
+
+    async def start_storm(self):
+        return [[self.factory.message(user_id, "/start")] for user_id in self.user_ids(100000)]
+
+    async def token_burst(self):
+        from services.token_service import TokenService
+
+        users = list(self.user_ids(200000))
+        tokens = await TokenService.generate_tokens(self.plan.id, len(users))
+        # Cada usuario canjea su token y un segundo intento repite uno ya usado
+        return [
+            [self.factory.message(user_id, f"/start {token}"), self.factory.message(user_id, f"/start {token}")]
+            for user_id, token in zip(users, tokens)
+        ]
+
+    async def menu_browsing(self):
+        # Usuarios ya registrados por la tormenta de /start
+        return [
+            [
+                self.factory.message(user_id, "/menu"),
+                self.factory.callback(user_id, "subscription_status"),
+                self.factory.callback(user_id, "help"),
+            ]
+            for user_id in self.user_ids(100000)
+        ]
+
+    async def admin_wizard(self):
+        # El administrador es uno solo: sus pasos se procesan en orden
+        sequence = []
+        for i in range(self.args.wizard_rounds):
+            sequence += [
+                self.factory.message(BENCH_ADMIN_ID, "/admin"),
+                self.factory.callback(BENCH_ADMIN_ID, "config_tariffs"),
+                self.factory.callback(BENCH_ADMIN_ID, "duration_1m"),
+                self.factory.message(BENCH_ADMIN_ID, "9.99"),
+                self.factory.message(BENCH_ADMIN_ID, f"Plan {i}"),
+                self.factory.callback(BENCH_ADMIN_ID, "confirm_tariff"),
+                self.factory.callback(BENCH_ADMIN_ID, "statistics"),
+            ]
+        return [sequence]
+
+    async def telegram_calls(self):
+        if not self.args.api_server:
+            return dict(sorted(self.session.calls.items()))
+        # El servidor simulado lleva la cuenta; otro servidor no la expone
+        import aiohttp
+        try:
+            async with aiohttp.ClientSession() as client:
+                async with client.get(self.args.api_server.rstrip("/") + "/_fake/stats") as response:
+                    return (await response.json())["calls"]
+        except Exception:
+            return {}
+
+    WORKLOADS = ("start_storm", "token_burst", "menu_browsing", "admin_wizard")
+
+    async def run(self):
+        await self.setup()
+        try:
+            results = {}
+            for name in self.args.workloads:
+                sequences = await getattr(self, name)()
+                results[name] = await self.run_workload(name, sequences)
+            return {
+                "meta": {
+                    "timestamp": datetime.datetime.utcnow().isoformat(),
+                    "python": sys.version.split()[0],
+                    "users": self.args.users,
+                    "concurrency": self.args.concurrency,
+                    "telegram_latency_ms": self.args.telegram_latency,
+                    "rate_limit": self.args.rate_limit,
+                    "api_server": self.args.api_server,
+                    "telegram_calls": await self.telegram_calls(),
+                },
+                "workloads": results
+            }
+        finally:
+            await self.teardown()
+
+def compare(results, baseline):
+    """Imprime la variación de cada carga respecto a una ejecución anterior"""
+    for name, current in results["workloads"].items():
+        previous = baseline.get("workloads", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("updates_per_sec", "p95_ms", "p99_ms", "db_queries_per_update", "db_sessions_per_update"):
+            before, after = previous.get(metric, 0), current.get(metric, 0)
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"{name:15} {metric:22} {before:>10} -> {after:>10} ({change:+.1f}%)")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de updates del bot")
+    parser.add_argument("--users", type=int, default=200, help="usuarios por carga")
+    parser.add_argument("--concurrency", type=int, default=50, help="secuencias de updates en paralelo")
+    parser.add_argument("--wizard-rounds", type=int, default=20, help="vueltas del asistente de tarifas")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="latencia simulada de la Bot API (ms)")
+    parser.add_argument("--member-ratio", type=float, default=0.5, help="fracción de usuarios en el canal gratuito")
+    parser.add_argument("--api-server", help="URL de una Bot API a la que enviar las peticiones en lugar de simularlas")
+    parser.add_argument("--rate-limit", action="store_true", help="aplicar los límites de envío de Telegram")
+    parser.add_argument("--workloads", nargs="+", choices=Benchmark.WORKLOADS, default=list(Benchmark.WORKLOADS))
+    parser.add_argument("--output", help="fichero JSON de resultados")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior para comparar")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    configure_environment(os.path.join(workdir, "bench.sqlite3"))
+
+    results = asyncio.run(Benchmark(args).run())
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -21,3 +21,133 @@ DEFAULT_CANCELLATION_MESSAGE = "Tu suscripción VIP ha sido cancelada."
 # Configuración del acceso libre al canal gratuito (True/False)
 FREE_CHANNEL_OPEN_ACCESS = os.getenv("FREE_CHANNEL_OPEN_ACCESS", "True").lower() == "true"
 
+
+# Caché de perfiles de usuario y escritura diferida en AccessMiddleware
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "3600"))  # segundos
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "5"))  # segundos
+USER_FLUSH_BATCH_SIZE = int(os.getenv("USER_FLUSH_BATCH_SIZE", "500"))
+
+# Pool de conexiones a la base de datos ("queue" o "null")
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue").lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # segundos
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))  # segundos, -1 = nunca
+
+# PRAGMAs aplicados a cada conexión SQLite
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negativo = KiB
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # milisegundos
+
+# Caché de membresía de canales (get_chat_member)
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "50000"))
+MEMBERSHIP_POSITIVE_TTL = int(os.getenv("MEMBERSHIP_POSITIVE_TTL", "600"))  # segundos
+MEMBERSHIP_NEGATIVE_TTL = int(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "30"))  # segundos
+
+# Reconciliación de miembros del canal gratuito
+RECONCILE_CHUNK_SIZE = int(os.getenv("RECONCILE_CHUNK_SIZE", "500"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "20"))
+RECONCILE_MAX_RETRIES = int(os.getenv("RECONCILE_MAX_RETRIES", "3"))
+
+# Límites de envío a Telegram (peticiones por segundo)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_PRIVATE_CHAT_RATE = float(os.getenv("TELEGRAM_PRIVATE_CHAT_RATE", "1"))
+TELEGRAM_GROUP_CHAT_RATE = float(os.getenv("TELEGRAM_GROUP_CHAT_RATE", str(20 / 60)))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "5"))
+# URL base de otro servidor de la Bot API (p. ej. benchmarks/fake_telegram_server.py); vacía = api.telegram.org
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER", "")
+
+# Difusiones masivas
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "200"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "25"))
+BROADCAST_EXPIRING_DAYS = int(os.getenv("BROADCAST_EXPIRING_DAYS", "3"))
+
+# Generación de enlaces por lotes
+TOKEN_BATCH_MAX = int(os.getenv("TOKEN_BATCH_MAX", "10000"))
+TOKEN_BATCH_CHUNK_SIZE = int(os.getenv("TOKEN_BATCH_CHUNK_SIZE", "1000"))
+
+# Pool de enlaces de invitación VIP de un solo uso
+INVITE_POOL_SIZE = int(os.getenv("INVITE_POOL_SIZE", "20"))
+INVITE_LINK_TTL = int(os.getenv("INVITE_LINK_TTL", str(2 * 24 * 3600)))  # segundos
+INVITE_LINK_MIN_REMAINING = int(os.getenv("INVITE_LINK_MIN_REMAINING", "3600"))  # segundos
+INVITE_CLAIM_GRACE = int(os.getenv("INVITE_CLAIM_GRACE", str(24 * 3600)))  # segundos
+INVITE_POOL_REFILL_INTERVAL = int(os.getenv("INVITE_POOL_REFILL_INTERVAL", "60"))  # segundos
+INVITE_REVOKE_BATCH_SIZE = int(os.getenv("INVITE_REVOKE_BATCH_SIZE", "50"))
+
+# Catálogo de planes en memoria (segundos hasta recargar desde la base de datos)
+PLAN_CATALOG_TTL = int(os.getenv("PLAN_CATALOG_TTL", "300"))
+
+# Motor de expiración de suscripciones
+EXPIRY_LOAD_HORIZON = int(os.getenv("EXPIRY_LOAD_HORIZON", str(24 * 3600)))  # segundos
+EXPIRY_LOAD_CHUNK_SIZE = int(os.getenv("EXPIRY_LOAD_CHUNK_SIZE", "5000"))
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "200"))
+EXPIRY_NOTIFY_USERS = os.getenv("EXPIRY_NOTIFY_USERS", "True").lower() == "true"
+EXPIRY_RETRY_DELAY = float(os.getenv("EXPIRY_RETRY_DELAY", "5"))  # segundos, se duplica en cada fallo
+EXPIRY_RETRY_MAX_DELAY = float(os.getenv("EXPIRY_RETRY_MAX_DELAY", "300"))  # segundos
+
+# Envío de mensajes programados
+DISPATCH_MAX_SLEEP = int(os.getenv("DISPATCH_MAX_SLEEP", "60"))  # segundos
+DISPATCH_BATCH_SIZE = int(os.getenv("DISPATCH_BATCH_SIZE", "50"))
+# Política ante envíos perdidos: "once" (uno y seguir), "all" (todos) o "skip" (ninguno)
+DISPATCH_CATCHUP_POLICY = os.getenv("DISPATCH_CATCHUP_POLICY", "once").lower()
+DISPATCH_MISFIRE_GRACE = int(os.getenv("DISPATCH_MISFIRE_GRACE", "300"))  # segundos
+
+# Almacenamiento de estados FSM: "database" (persistente) o "memory"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "database").lower()
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL = int(os.getenv("FSM_CACHE_TTL", "60"))  # segundos
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(24 * 3600)))  # segundos sin uso antes de descartar
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))  # segundos; 0 escribe al momento
+FSM_FLUSH_MAX_RETRY_DELAY = float(os.getenv("FSM_FLUSH_MAX_RETRY_DELAY", "30"))  # segundos
+# Varios procesos del bot comparten la base de datos: escritura inmediata y lecturas sin caché
+FSM_SHARED = os.getenv("FSM_SHARED", "False").lower() == "true"
+FSM_CLEANUP_INTERVAL = int(os.getenv("FSM_CLEANUP_INTERVAL", "3600"))  # segundos
+
+# Recepción de updates: "polling" o "webhook"
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # URL pública; vacía para pruebas locales sin registrar el webhook
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_STATS_PATH = os.getenv("WEBHOOK_STATS_PATH", "/webhook/stats")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+# Updates que se sacan de la cola a la vez; el ejecutor decide cuáles corren
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "64"))
+
+# Ejecución de updates: en orden por usuario y en paralelo entre usuarios
+EXECUTOR_MAX_IN_FLIGHT = int(os.getenv("EXECUTOR_MAX_IN_FLIGHT", "16"))
+EXECUTOR_PARTITION_IN_FLIGHT = int(os.getenv("EXECUTOR_PARTITION_IN_FLIGHT", "1"))
+
+# Estadísticas: contadores incrementales con reconciliación periódica
+STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", str(6 * 3600)))  # segundos
+STATS_EXPIRING_INTERVAL = int(os.getenv("STATS_EXPIRING_INTERVAL", "600"))  # segundos
+
+# Gestión de usuarios VIP
+VIP_PAGE_SIZE = int(os.getenv("VIP_PAGE_SIZE", "10"))
+
+# Presupuesto de consultas SQL por update
+QUERY_BUDGET_DEFAULT = int(os.getenv("QUERY_BUDGET_DEFAULT", "10"))
+# Límites por handler, p. ej. "start_command=8,process_name=4"
+QUERY_BUDGETS = {
+    name.strip(): int(limit)
+    for name, limit in (
+        item.split("=", 1) for item in os.getenv("QUERY_BUDGETS", "").split(",") if "=" in item
+    )
+}
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "False").lower() == "true"  # fallar en pruebas
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "3"))  # sentencias idénticas en un update
+
+# Métricas en formato Prometheus servidas en local
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+
+# Unidad de trabajo: una sesión y una transacción por update, compartida por middleware, handlers y servicios.
+# Con SQLite el bloqueo de escritura dura todo el update, así que conviene sobre todo con PostgreSQL
+UNIT_OF_WORK = os.getenv("UNIT_OF_WORK", "False").lower() == "true"
@@ -1,3 +1,8 @@
 # telegram_subscription_bot/database/__init__.py
 from . import models
-from . import db
\ No newline at end of file
+from . import db
+from . import migrations
+from . import fsm_storage
+from . import query_tracker
+from . import unit_of_work
+from . import vip_status
\ No newline at end of file
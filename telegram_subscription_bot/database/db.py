@@ -1,22 +1,176 @@
 # telegram_subscription_bot/database/db.py
+import time
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import NullPool, StaticPool, AsyncAdaptedQueuePool
 from contextlib import asynccontextmanager
 
 from database.models import Base
-from config import DATABASE_URL
+from database.migrations import run_migrations
+from database.query_tracker import record_statement, record_session
+from utils.metrics import registry, FAST_BUCKETS
+from config import (
+    DATABASE_URL, DB_POOL_MODE, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT, DB_POOL_RECYCLE, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS,
+    SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_BUSY_TIMEOUT
+)
 
 # Convertir SQLite URL a formato async
 if DATABASE_URL.startswith('sqlite'):
     DATABASE_URL = DATABASE_URL.replace('sqlite', 'sqlite+aiosqlite', 1)
 
-engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+IS_SQLITE = DATABASE_URL.startswith('sqlite')
+IS_SQLITE_MEMORY = IS_SQLITE and (':memory:' in DATABASE_URL or DATABASE_URL.endswith('://'))
+
+class PoolStats:
+    """Estadísticas de uso del pool de conexiones"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def as_dict(self):
+        return {
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "timeouts": self.timeouts,
+            "wait_total": self.wait_total,
+            "wait_max": self.wait_max,
+            "wait_avg": self.wait_total / self.checkouts if self.checkouts else 0.0,
+        }
+
+pool_stats = PoolStats()
+
+DB_QUERY_SECONDS = registry.histogram(
+    "db_query_duration_seconds", "Duración de las sentencias SQL", ("operation",), FAST_BUCKETS
+)
+DB_POOL_CHECKOUTS = registry.counter("db_pool_checkouts_total", "Conexiones sacadas del pool")
+DB_POOL_CONNECTS = registry.counter("db_pool_connects_total", "Conexiones nuevas abiertas contra la base")
+DB_POOL_TIMEOUTS = registry.counter("db_pool_timeouts_total", "Esperas de conexión que terminaron en error")
+DB_POOL_WAIT_SECONDS = registry.counter("db_pool_wait_seconds_total", "Tiempo total esperando una conexión libre")
+DB_POOL_IN_USE = registry.gauge("db_pool_connections_in_use", "Conexiones prestadas en este momento")
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Pool con cola que mide el tiempo de espera de cada checkout"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            pool_stats.timeouts += 1
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start)
+
+def _engine_options():
+    if DB_POOL_MODE == "null":
+        return {"poolclass": NullPool}
+    if IS_SQLITE_MEMORY:
+        # Una base en memoria solo existe dentro de su única conexión
+        return {"poolclass": StaticPool}
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": not IS_SQLITE,
+    }
+
+engine = create_async_engine(DATABASE_URL, **_engine_options())
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+@event.listens_for(engine.sync_engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats.connects += 1
+    if not IS_SQLITE:
+        return
+
+    cursor = dbapi_connection.cursor()
+    if not IS_SQLITE_MEMORY:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.close()
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.checkouts += 1
+    pool_stats.in_use += 1
+    pool_stats.max_in_use = max(pool_stats.max_in_use, pool_stats.in_use)
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_stats.checkins += 1
+    pool_stats.in_use = max(pool_stats.in_use - 1, 0)
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Atribuir la sentencia y su duración al update en curso
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    record_statement(statement, duration)
+    words = statement.split(None, 1)
+    DB_QUERY_SECONDS.observe(duration, operation=words[0].upper() if words else "UNKNOWN")
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def _on_statement_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+@event.listens_for(Session, "after_begin")
+def _after_begin(session, transaction, connection):
+    # Solo cuentan las sesiones que llegan a usar una conexión
+    record_session(session)
+
+def get_pool_stats():
+    """Retorna las estadísticas del pool junto con su estado actual"""
+    stats = pool_stats.as_dict()
+    stats["pool_class"] = type(engine.pool).__name__
+    stats["status"] = engine.pool.status()
+    return stats
+
+async def _collect_pool_metrics():
+    DB_POOL_CHECKOUTS.set(pool_stats.checkouts)
+    DB_POOL_CONNECTS.set(pool_stats.connects)
+    DB_POOL_TIMEOUTS.set(pool_stats.timeouts)
+    DB_POOL_WAIT_SECONDS.set(pool_stats.wait_total)
+    DB_POOL_IN_USE.set(pool_stats.in_use)
+
+registry.add_collector(_collect_pool_metrics)
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    # Llevar las bases existentes a la última versión del esquema
+    await run_migrations(engine)
+
+async def close_db():
+    await engine.dispose()
 
 @asynccontextmanager
 async def get_session():
@@ -24,4 +178,8 @@ async def get_session():
     try:
         yield session
     finally:
-        await session.close()
\ No newline at end of file
+        await session.close()
+
+def on_commit(session, callback):
+    """Ejecuta callback cuando se confirme la transacción en curso de la sesión"""
+    event.listen(session.sync_session, "after_commit", lambda _: callback(), once=True)
@@ -0,0 +1,225 @@
+# telegram_subscription_bot/database/fsm_storage.py
+import asyncio
+import datetime
+import json
+import logging
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import select, delete, func
+
+from database.db import get_session, IS_SQLITE
+from database.models import FSMRecord
+from utils.cache import TTLCache
+from config import (
+    FSM_CACHE_SIZE, FSM_CACHE_TTL, FSM_STATE_TTL, FSM_FLUSH_INTERVAL, FSM_CLEANUP_INTERVAL,
+    FSM_FLUSH_MAX_RETRY_DELAY, FSM_SHARED
+)
+
+if IS_SQLITE:
+    from sqlalchemy.dialects.sqlite import insert
+else:
+    from sqlalchemy.dialects.postgresql import insert
+
+logger = logging.getLogger(__name__)
+
+# Claves pendientes por consulta al contar estados
+COUNT_CHUNK_SIZE = 500
+
+class DatabaseStorage(BaseStorage):
+    """
+    Almacenamiento FSM persistente en la base de datos del bot.
+
+    Las lecturas se sirven desde una caché acotada; las escrituras actualizan
+    la caché al momento y se guardan por lotes cada flush_interval segundos.
+    Los estados sin tocar durante state_ttl se descartan. Si varios procesos
+    comparten la base de datos hay que usar shared (FSM_SHARED): cada
+    escritura se guarda al momento y las lecturas no pasan por la caché, para
+    que ningún proceso lea un estado ajeno desactualizado.
+    """
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL,
+                 state_ttl: int = FSM_STATE_TTL, flush_interval: float = FSM_FLUSH_INTERVAL,
+                 cleanup_interval: int = FSM_CLEANUP_INTERVAL, shared: bool = FSM_SHARED):
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.state_ttl = datetime.timedelta(seconds=state_ttl)
+        self.shared = shared
+        # Entre procesos la escritura diferida dejaría a los demás leyendo estados viejos
+        self.flush_interval = 0 if shared else flush_interval
+        self.cleanup_interval = cleanup_interval
+        # Escrituras pendientes de guardar: clave -> (estado, datos)
+        self._pending: Dict[str, tuple] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._cleanup_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or 0}:{key.destiny}"
+
+    async def _load(self, key: str) -> tuple:
+        entry = self._pending.get(key)
+        if entry is not None:
+            return entry
+
+        entry = None if self.shared else self.cache.get(key)
+        if entry is not None:
+            return entry
+
+        async with get_session() as session:
+            result = await session.execute(
+                select(FSMRecord.state, FSMRecord.data, FSMRecord.updated_at).where(FSMRecord.key == key)
+            )
+            row = result.first()
+
+        if row is None or row.updated_at < datetime.datetime.utcnow() - self.state_ttl:
+            # Sin estado o abandonado hace demasiado tiempo
+            entry = (None, {})
+        else:
+            entry = (row.state, json.loads(row.data) if row.data else {})
+        self.cache.set(key, entry)
+        return entry
+
+    async def _store(self, key: str, entry: tuple) -> None:
+        self.cache.set(key, entry)
+        self._pending[key] = entry
+        if self.flush_interval <= 0:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key(key)
+        _, data = await self._load(storage_key)
+        await self._store(storage_key, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self._key(key)
+        state, _ = await self._load(storage_key)
+        await self._store(storage_key, (state, data.copy()))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self._key(key))
+        return data.copy()
+
+    async def _delayed_flush(self) -> None:
+        delay = self.flush_interval
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.flush()
+                return
+            except Exception:
+                # El lote volvió a _pending: reintentar sin esperar a otra escritura
+                logger.exception("Error persisting FSM states")
+                delay = min(delay * 2, FSM_FLUSH_MAX_RETRY_DELAY)
+
+    async def flush(self) -> int:
+        """Guarda en una sola transacción todas las escrituras pendientes"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            return await self._write_batch()
+
+    async def _write_batch(self) -> int:
+        batch, self._pending = self._pending, {}
+        now = datetime.datetime.utcnow()
+        empty = [key for key, (state, data) in batch.items() if state is None and not data]
+        rows = [
+            {"key": key, "state": state, "data": json.dumps(data), "updated_at": now}
+            for key, (state, data) in batch.items()
+            if state is not None or data
+        ]
+
+        try:
+            async with get_session() as session:
+                if empty:
+                    # Un estado vacío equivale a no tener fila
+                    await session.execute(delete(FSMRecord).where(FSMRecord.key.in_(empty)))
+                if rows:
+                    stmt = insert(FSMRecord)
+                    await session.execute(
+                        stmt.on_conflict_do_update(
+                            index_elements=[FSMRecord.key],
+                            set_={
+                                "state": stmt.excluded.state,
+                                "data": stmt.excluded.data,
+                                "updated_at": stmt.excluded.updated_at
+                            }
+                        ),
+                        rows
+                    )
+                await session.commit()
+        except Exception:
+            # Devolver el lote sin pisar escrituras más recientes
+            for key, entry in batch.items():
+                self._pending.setdefault(key, entry)
+            raise
+        return len(batch)
+
+    async def cleanup(self) -> int:
+        """Borra los estados que nadie ha tocado en state_ttl"""
+        threshold = datetime.datetime.utcnow() - self.state_ttl
+        async with get_session() as session:
+            result = await session.execute(delete(FSMRecord).where(FSMRecord.updated_at < threshold))
+            await session.commit()
+        return result.rowcount
+
+    async def count_states(self) -> Dict[str, int]:
+        """
+        Usuarios en cada estado. Cuenta la tabla y le aplica las escrituras
+        pendientes sin guardarlas, para no adelantar el flush por lotes.
+        """
+        pending = dict(self._pending)
+        keys = list(pending)
+        threshold = datetime.datetime.utcnow() - self.state_ttl
+        fresh = (FSMRecord.state != None, FSMRecord.updated_at >= threshold)
+        async with get_session() as session:
+            result = await session.execute(
+                select(FSMRecord.state, func.count(FSMRecord.key)).where(*fresh).group_by(FSMRecord.state)
+            )
+            counts = Counter(dict(result.all()))
+            
+            # Las filas que lo pendiente va a sobrescribir no cuentan
+            for i in range(0, len(keys), COUNT_CHUNK_SIZE):
+                result = await session.execute(
+                    select(FSMRecord.state).where(FSMRecord.key.in_(keys[i:i + COUNT_CHUNK_SIZE]), *fresh)
+                )
+                counts.subtract(result.scalars().all())
+        
+        counts.update(state for state, _ in pending.values() if state is not None)
+        return {state: count for state, count in counts.items() if count > 0}
+
+    async def start(self) -> None:
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._run_cleanup())
+
+    async def _run_cleanup(self) -> None:
+        while True:
+            try:
+                removed = await self.cleanup()
+                if removed:
+                    logger.info("Removed %s stale FSM states", removed)
+            except Exception:
+                logger.exception("Error cleaning up FSM states")
+            await asyncio.sleep(self.cleanup_interval)
+
+    async def close(self) -> None:
+        if self._cleanup_task:
+            self._cleanup_task.cancel()
+            try:
+                await self._cleanup_task
+            except asyncio.CancelledError:
+                pass
+            self._cleanup_task = None
+        if self._flush_task:
+            # Dejar terminar el guardado en curso antes del último flush
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
@@ -0,0 +1,107 @@
+# telegram_subscription_bot/database/migrations.py
+import datetime
+import logging
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, select, insert, update, func, inspect, text
+from sqlalchemy.schema import CreateIndex
+
+from database.models import User, Subscription, Token, ScheduledMessage
+from database.vip_status import refresh_vip_status
+
+logger = logging.getLogger(__name__)
+
+# Tabla propia para no mezclar el control de versiones con los modelos
+_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, default=datetime.datetime.utcnow),
+)
+
+# Lista ordenada de (versión, descripción, función que recibe una conexión síncrona)
+MIGRATIONS = []
+
+def migration(version: int, description: str):
+    """Registra una migración de esquema. Debe ser idempotente."""
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return fn
+    return decorator
+
+def _index(model, name):
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+def _create_index(conn, model, name):
+    # IF NOT EXISTS en lugar de checkfirst: los índices de expresiones no se pueden inspeccionar
+    conn.execute(CreateIndex(_index(model, name), if_not_exists=True))
+
+def _add_column(conn, model, name):
+    """Añade a una tabla existente una columna del modelo si todavía no está"""
+    table = model.__table__
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    if name in existing:
+        return False
+    column = table.c[name]
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+    return True
+
+@migration(1, "Índices para suscripciones, canal gratuito y tokens sin usar")
+def _add_hot_path_indexes(conn):
+    for model, name in (
+        (Subscription, "ix_subscriptions_user_active_end"),
+        (Subscription, "ix_subscriptions_active_end_date"),
+        (User, "ix_users_free_channel"),
+        (Token, "ix_tokens_unused_plan"),
+    ):
+        _create_index(conn, model, name)
+
+@migration(2, "Próximo envío precalculado para mensajes programados")
+def _add_scheduled_message_next_run(conn):
+    added = _add_column(conn, ScheduledMessage, "next_run_at")
+    _add_column(conn, ScheduledMessage, "last_run_at")
+    if _add_column(conn, ScheduledMessage, "is_active"):
+        conn.execute(update(ScheduledMessage.__table__).values(is_active=True))
+    if added:
+        # Las filas existentes se envían en su fecha programada
+        conn.execute(
+            update(ScheduledMessage.__table__)
+            .where(ScheduledMessage.__table__.c.next_run_at == None)
+            .values(next_run_at=ScheduledMessage.__table__.c.scheduled_time)
+        )
+    _create_index(conn, ScheduledMessage, "ix_scheduled_messages_due")
+
+@migration(3, "Índices para el listado y la búsqueda de usuarios VIP")
+def _add_vip_management_indexes(conn):
+    _create_index(conn, Subscription, "ix_subscriptions_active_id")
+    _create_index(conn, User, "ix_users_username_lower")
+
+@migration(4, "Estado VIP desnormalizado en usuarios")
+def _add_user_vip_status(conn):
+    _add_column(conn, User, "vip_plan_id")
+    _add_column(conn, User, "vip_until")
+    _create_index(conn, User, "ix_users_vip_until")
+    # Rellenar desde el historial de suscripciones
+    result = conn.execute(refresh_vip_status())
+    logger.info("Backfilled VIP status for %s users", result.rowcount)
+
+def apply_migrations(conn):
+    """Aplica sobre una conexión síncrona las migraciones pendientes"""
+    schema_version.create(conn, checkfirst=True)
+    current = conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+    for version, description, fn in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Applying migration %s: %s", version, description)
+        fn(conn)
+        conn.execute(insert(schema_version).values(
+            version=version,
+            description=description,
+            applied_at=datetime.datetime.utcnow()
+        ))
+
+async def run_migrations(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(apply_migrations)
@@ -1,5 +1,6 @@
 # telegram_subscription_bot/database/models.py
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text, Index
+from sqlalchemy import text as sql_text, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import datetime
@@ -17,7 +18,27 @@ class User(Base):
     is_admin = Column(Boolean, default=False)
     is_in_free_channel = Column(Boolean, default=False)
     join_date = Column(DateTime, default=datetime.datetime.utcnow)
+    # Estado VIP desnormalizado: plan vigente y fin del acceso (None con plan = permanente)
+    vip_plan_id = Column(Integer, ForeignKey("subscription_plans.id"), nullable=True)
+    vip_until = Column(DateTime, nullable=True)
     subscriptions = relationship("Subscription", back_populates="user")
+    
+    __table_args__ = (
+        # Miembros del canal gratuito, recorridos en orden de id
+        Index(
+            "ix_users_free_channel", "id",
+            sqlite_where=sql_text("is_in_free_channel = 1"),
+            postgresql_where=sql_text("is_in_free_channel"),
+        ),
+        # Búsqueda de usuarios por nombre de usuario sin distinguir mayúsculas
+        Index("ix_users_username_lower", func.lower(username)),
+        # Usuarios VIP por fecha de fin: vencimientos y segmentos de difusión
+        Index(
+            "ix_users_vip_until", "vip_until",
+            sqlite_where=sql_text("vip_plan_id IS NOT NULL"),
+            postgresql_where=sql_text("vip_plan_id IS NOT NULL"),
+        ),
+    )
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
@@ -31,6 +52,23 @@ class Subscription(Base):
     plan_id = Column(Integer, ForeignKey("subscription_plans.id"))
     plan = relationship("SubscriptionPlan")
     
+    __table_args__ = (
+        # get_active_subscription: suscripción activa de un usuario
+        Index("ix_subscriptions_user_active_end", "user_id", "is_active", "end_date"),
+        # get_expiring_subscriptions / deactivate_expired_subscriptions: rango sobre end_date
+        Index(
+            "ix_subscriptions_active_end_date", "end_date",
+            sqlite_where=sql_text("is_active = 1 AND end_date IS NOT NULL"),
+            postgresql_where=sql_text("is_active AND end_date IS NOT NULL"),
+        ),
+        # Listado paginado de suscripciones activas por id
+        Index(
+            "ix_subscriptions_active_id", "id",
+            sqlite_where=sql_text("is_active = 1"),
+            postgresql_where=sql_text("is_active"),
+        ),
+    )
+    
 class SubscriptionPlan(Base):
     __tablename__ = "subscription_plans"
     
@@ -51,6 +89,15 @@ class Token(Base):
     is_used = Column(Boolean, default=False)
     used_by = Column(Integer, nullable=True)
     
+    __table_args__ = (
+        # Tokens pendientes de uso por plan
+        Index(
+            "ix_tokens_unused_plan", "plan_id",
+            sqlite_where=sql_text("is_used = 0"),
+            postgresql_where=sql_text("NOT is_used"),
+        ),
+    )
+    
 class ScheduledMessage(Base):
     __tablename__ = "scheduled_messages"
     
@@ -64,5 +111,70 @@ class ScheduledMessage(Base):
     buttons_json = Column(Text, nullable=True)
     scheduled_time = Column(DateTime, nullable=False)
     is_recurring = Column(Boolean, default=False)
-    recurring_pattern = Column(String, nullable=True)  # daily, weekly, etc.
-    created_by = Column(Integer, ForeignKey("users.id"))
\ No newline at end of file
+    recurring_pattern = Column(String, nullable=True)  # daily, weekly, etc. o expresión cron
+    created_by = Column(Integer, ForeignKey("users.id"))
+    next_run_at = Column(DateTime, nullable=True)  # Próximo envío precalculado
+    last_run_at = Column(DateTime, nullable=True)
+    is_active = Column(Boolean, default=True)
+    
+    __table_args__ = (
+        # Mensajes pendientes ordenados por próximo envío
+        Index(
+            "ix_scheduled_messages_due", "next_run_at",
+            sqlite_where=sql_text("is_active = 1"),
+            postgresql_where=sql_text("is_active"),
+        ),
+    )
+class BroadcastJob(Base):
+    __tablename__ = "broadcast_jobs"
+    
+    id = Column(Integer, primary_key=True)
+    segment = Column(String, nullable=False)  # all, vip, expiring, free
+    text = Column(Text, nullable=True)
+    media_type = Column(String, nullable=True)
+    media_id = Column(String, nullable=True)
+    is_protected = Column(Boolean, default=False)
+    status = Column(String, default="pending")  # pending, running, completed, cancelled
+    last_user_id = Column(Integer, default=0)  # Cursor: último users.id procesado
+    sent_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    blocked_count = Column(Integer, default=0)
+    created_by = Column(Integer, nullable=True)  # telegram_id del administrador
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class InviteLink(Base):
+    __tablename__ = "invite_links"
+    
+    id = Column(Integer, primary_key=True)
+    channel_id = Column(String, nullable=False)
+    invite_link = Column(String, unique=True, nullable=False)
+    expire_date = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    claimed_by = Column(Integer, nullable=True)  # telegram_id del usuario
+    claimed_at = Column(DateTime, nullable=True)
+    is_revoked = Column(Boolean, default=False)
+    
+    __table_args__ = (
+        # Enlaces disponibles por canal, ordenados por caducidad
+        Index(
+            "ix_invite_links_available", "channel_id", "expire_date",
+            sqlite_where=sql_text("claimed_by IS NULL AND is_revoked = 0"),
+            postgresql_where=sql_text("claimed_by IS NULL AND NOT is_revoked"),
+        ),
+    )
+
+class FSMRecord(Base):
+    __tablename__ = "fsm_states"
+    
+    key = Column(String, primary_key=True)  # bot:chat:user:thread:destiny
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True)  # JSON
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class Statistic(Base):
+    __tablename__ = "statistics"
+    
+    key = Column(String, primary_key=True)  # users_total, vip_active:<plan_id>, ...
+    value = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
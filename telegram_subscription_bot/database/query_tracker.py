@@ -0,0 +1,77 @@
+# telegram_subscription_bot/database/query_tracker.py
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+class QueryStats:
+    """Sentencias SQL, duraciones y sesiones atribuidas a un update"""
+
+    __slots__ = ("statements", "sessions", "handler", "budget", "closed")
+
+    def __init__(self):
+        self.statements: List[Tuple[str, float]] = []
+        self.sessions = 0
+        self.handler: Optional[str] = None
+        self.budget: Optional[int] = None
+        self.closed = False
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def total_time(self) -> float:
+        return sum(duration for _, duration in self.statements)
+
+    def repeated(self, threshold: int = 2) -> List[Tuple[str, int]]:
+        """Sentencias idénticas ejecutadas al menos threshold veces (posible N+1)"""
+        counts = Counter(statement for statement, _ in self.statements)
+        return [(statement, count) for statement, count in counts.most_common() if count >= threshold]
+
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+
+def active_stats() -> Optional[QueryStats]:
+    """
+    Estadísticas del update en curso, si las hay.
+
+    Las tareas lanzadas durante un update heredan el contexto; al cerrarse
+    el update sus consultas ya no se le atribuyen.
+    """
+    stats = current_query_stats.get()
+    if stats is None or stats.closed:
+        return None
+    return stats
+
+def record_statement(statement: str, duration: float) -> None:
+    stats = active_stats()
+    if stats is not None:
+        stats.statements.append((statement, duration))
+
+def record_session(session) -> None:
+    stats = active_stats()
+    if stats is not None and session.info.get("query_stats") is not stats:
+        # Una misma sesión puede abrir varias transacciones: se cuenta una vez
+        session.info["query_stats"] = stats
+        stats.sessions += 1
+
+@contextmanager
+def track_queries():
+    """
+    Atribuye al bloque las consultas ejecutadas en su contexto.
+
+    Dentro de otro bloque activo se reutilizan sus estadísticas, de modo que
+    quien alimenta el dispatcher ve lo mismo que el middleware.
+    """
+    stats = active_stats()
+    if stats is not None:
+        yield stats
+        return
+
+    stats = QueryStats()
+    token = current_query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        stats.closed = True
+        current_query_stats.reset(token)
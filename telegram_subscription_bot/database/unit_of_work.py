@@ -0,0 +1,38 @@
+# telegram_subscription_bot/database/unit_of_work.py
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import User
+
+_UNLOADED = object()
+
+class UnitOfWork:
+    """
+    Sesión compartida por todo un update.
+
+    Los servicios reciben uow.session y no la confirman; quien abre la
+    unidad de trabajo la confirma al terminar el handler. El usuario del
+    update se carga como mucho una vez, y solo si alguien lo pide.
+    """
+
+    def __init__(self, session: AsyncSession, telegram_id: Optional[int] = None):
+        self.session = session
+        self.telegram_id = telegram_id
+        self._user = _UNLOADED
+
+    async def get_user(self) -> Optional[User]:
+        if self._user is _UNLOADED:
+            if self.telegram_id is None:
+                self._user = None
+            else:
+                result = await self.session.execute(select(User).where(User.telegram_id == self.telegram_id))
+                self._user = result.scalar_one_or_none()
+        return self._user
+
+    async def commit(self) -> None:
+        await self.session.commit()
+
+    async def rollback(self) -> None:
+        await self.session.rollback()
@@ -0,0 +1,47 @@
+# telegram_subscription_bot/database/vip_status.py
+import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import select, update, and_, or_
+
+from database.models import User, Subscription
+
+users = User.__table__
+subscriptions = Subscription.__table__
+
+def is_vip(now: datetime.datetime):
+    """Condición sobre users: VIP en este momento según las columnas desnormalizadas"""
+    return and_(users.c.vip_plan_id != None, or_(users.c.vip_until == None, users.c.vip_until > now))
+
+def _current_subscription(column, now: datetime.datetime):
+    # Suscripción vigente del usuario: la permanente o la que vence más tarde
+    return (
+        select(column)
+        .where(
+            subscriptions.c.user_id == users.c.id,
+            subscriptions.c.is_active == True,
+            or_(subscriptions.c.end_date == None, subscriptions.c.end_date > now)
+        )
+        .order_by(subscriptions.c.end_date.is_(None).desc(), subscriptions.c.end_date.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+def refresh_vip_status(now: Optional[datetime.datetime] = None, user_ids: Optional[Iterable[int]] = None):
+    """
+    UPDATE que recalcula vip_plan_id y vip_until desde las suscripciones.
+
+    Sin user_ids repasa toda la tabla; solo escribe las filas que no
+    coinciden, así que el número de filas afectadas es el de reparadas.
+    """
+    now = now or datetime.datetime.utcnow()
+    plan_id = _current_subscription(subscriptions.c.plan_id, now)
+    end_date = _current_subscription(subscriptions.c.end_date, now)
+    stmt = (
+        update(users)
+        .where(or_(users.c.vip_plan_id.is_distinct_from(plan_id), users.c.vip_until.is_distinct_from(end_date)))
+        .values(vip_plan_id=plan_id, vip_until=end_date)
+    )
+    if user_ids is not None:
+        stmt = stmt.where(users.c.id.in_(list(user_ids)))
+    return stmt
@@ -1,6 +1,10 @@
 # telegram_subscription_bot/handlers/admin_handlers.py
+import csv
+import datetime
+import html
+import io
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -9,15 +13,19 @@ from sqlalchemy import select
 from database.db import get_session
 from database.models import User, SubscriptionPlan
 from services.token_service import TokenService
-from services.subscription_service import SubscriptionService
-from services.scheduler_service import SchedulerService
+from services.subscription_service import SubscriptionService, AlreadyPermanentError
 from services.channel_service import ChannelService
+from services.message_service import MessageService
+from services.broadcast_service import BroadcastService, SEGMENTS
+from services.message_dispatcher_service import MessageDispatcherService
 from keyboards.admin_keyboards import (
     get_admin_main_menu, get_subscription_plans_keyboard,
     get_tariff_duration_keyboard, get_confirm_tariff_keyboard,
-    get_channel_config_keyboard
+    get_channel_config_keyboard, get_broadcast_segment_keyboard,
+    get_confirm_broadcast_keyboard, get_vip_list_keyboard, get_vip_user_keyboard
 )
-from config import ADMIN_IDS, FREE_CHANNEL_ID, VIP_CHANNEL_ID
+from utils.helpers import format_plan_duration, format_datetime
+from config import ADMIN_IDS, FREE_CHANNEL_ID, VIP_CHANNEL_ID, TOKEN_BATCH_MAX
 
 router = Router()
 
@@ -32,6 +40,11 @@ class TariffConfig(StatesGroup):
 class GenerateLink(StatesGroup):
     selecting_plan = State()
 
+# FSM para generar enlaces en lote
+class GenerateBatch(StatesGroup):
+    selecting_plan = State()
+    entering_count = State()
+
 # FSM para enviar mensaje
 class SendMessage(StatesGroup):
     selecting_channel = State()
@@ -43,6 +56,18 @@ class SendMessage(StatesGroup):
     entering_button_text = State()
     entering_button_url = State()
     scheduling = State()
+    entering_schedule_time = State()
+    selecting_recurrence = State()
+
+# FSM para buscar usuarios VIP
+class VipSearch(StatesGroup):
+    entering_query = State()
+
+# FSM para difusiones a usuarios
+class Broadcast(StatesGroup):
+    selecting_segment = State()
+    entering_content = State()
+    confirming = State()
 
 # Filtro para administradores
 def admin_filter(message: Message):
@@ -121,18 +146,7 @@ async def process_name(message: Message, state: FSMContext):
     duration_days = data["duration_days"]
     price = data["price"]
     
-    if duration_days == -1:
-        duration_text = "Permanente"
-    elif duration_days == 1:
-        duration_text = "1 día"
-    elif duration_days == 7:
-        duration_text = "1 semana"
-    elif duration_days == 14:
-        duration_text = "2 semanas"
-    elif duration_days == 30:
-        duration_text = "1 mes"
-    else:
-        duration_text = f"{duration_days} días"
+    duration_text = format_plan_duration(duration_days)
     
     await message.answer(
         f"Resumen de la tarifa:\n\n"
@@ -207,15 +221,10 @@ async def generate_link_for_plan(callback: CallbackQuery, state: FSMContext, bot
         return
     
     # Crear enlace con el token
-    bot_info = await bot.get_me()
-    bot_username = bot_info.username
-    
-    link = f"https://t.me/{bot_username}?start={token.token}"
+    link = await TokenService.build_link(bot, token.token)
     
     # Obtener información del plan
-    async with get_session() as session:
-        result = await session.execute(select(SubscriptionPlan).where(SubscriptionPlan.id == plan_id))
-        plan = result.scalar_one_or_none()
+    plan = await SubscriptionService.get_plan(plan_id)
     
     await callback.message.answer(
         f"✅ Enlace generado exitosamente para el plan '{plan.name}':\n\n"
@@ -225,15 +234,189 @@ async def generate_link_for_plan(callback: CallbackQuery, state: FSMContext, bot
     
     await state.clear()
 
-# Gestión de usuarios VIP manualmente
-@router.callback_query(F.data == "manage_vip_users")
-async def manage_vip_users(callback: CallbackQuery):
+# Generación de enlaces en lote
+@router.callback_query(F.data == "generate_batch", StateFilter(None), admin_filter)
+async def generate_batch_start(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    # Aquí implementarías la lógica para gestionar usuarios VIP manualmente
-    # Por ejemplo, mostrar una lista de usuarios, agregar o quitar usuarios, etc.
+    
+    plans = await SubscriptionService.get_subscription_plans()
+    
+    if not plans:
+        await callback.message.answer("No hay planes de suscripción configurados. Primero debes crear al menos uno.")
+        return
+    
     await callback.message.answer(
-        "Funcionalidad de gestión de usuarios VIP en desarrollo."
+        "Selecciona el plan para generar los enlaces:",
+        reply_markup=get_subscription_plans_keyboard(plans)
     )
+    await state.set_state(GenerateBatch.selecting_plan)
+
+@router.callback_query(StateFilter(GenerateBatch.selecting_plan))
+async def generate_batch_plan(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    
+    if callback.data == "cancel":
+        await state.clear()
+        await callback.message.answer("Generación de enlaces cancelada.")
+        return
+    
+    plan_id = int(callback.data.split("_")[1])
+    await state.update_data(plan_id=plan_id)
+    
+    await callback.message.answer(f"¿Cuántos enlaces quieres generar? (máximo {TOKEN_BATCH_MAX})")
+    await state.set_state(GenerateBatch.entering_count)
+
+@router.message(StateFilter(GenerateBatch.entering_count))
+async def generate_batch_count(message: Message, state: FSMContext, bot: Bot):
+    try:
+        count = int(message.text.strip())
+    except (ValueError, AttributeError):
+        await message.answer("Por favor, ingresa un número válido:")
+        return
+    
+    if count < 1 or count > TOKEN_BATCH_MAX:
+        await message.answer(f"La cantidad debe estar entre 1 y {TOKEN_BATCH_MAX}. Intenta nuevamente:")
+        return
+    
+    data = await state.get_data()
+    plan_id = data["plan_id"]
+    tokens = await TokenService.generate_tokens(plan_id, count)
+    
+    if not tokens:
+        await message.answer("Error al generar los tokens. Inténtalo de nuevo.")
+        await state.clear()
+        return
+    
+    # Exportar el lote como CSV
+    bot_username = await TokenService.get_bot_username(bot)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["token", "link", "plan_id"])
+    for token_value in tokens:
+        writer.writerow([token_value, f"https://t.me/{bot_username}?start={token_value}", plan_id])
+    
+    await message.answer_document(
+        BufferedInputFile(buffer.getvalue().encode("utf-8"), filename=f"tokens_plan_{plan_id}.csv"),
+        caption=f"✅ {len(tokens)} enlaces generados. Cada uno se puede usar una sola vez."
+    )
+    await state.clear()
+
+# Gestión de usuarios VIP manualmente
+async def format_vip_list(rows, title):
+    plans = {plan.id: plan for plan in await SubscriptionService.get_subscription_plans()}
+    lines = [title, ""]
+    for row in rows:
+        name = f"@{row.username}" if row.username else html.escape(row.first_name or "-")
+        plan = plans.get(row.plan_id)
+        plan_name = plan.name if plan else f"Plan {row.plan_id}"
+        expires = format_datetime(row.end_date) if row.end_date else "permanente"
+        lines.append(f"• {name} ({row.telegram_id}) — {plan_name} — {expires}")
+    if not rows:
+        lines.append("No hay suscripciones VIP activas.")
+    return "\n".join(lines)
+
+async def show_vip_page(callback: CallbackQuery, after_id=0, before_id=None):
+    rows, has_more = await SubscriptionService.list_active_subscribers(after_id=after_id, before_id=before_id)
+    
+    if before_id is not None:
+        if not rows:
+            # Ya no hay nada antes: volver a la primera página
+            return await show_vip_page(callback)
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after_id > 0, has_more
+    
+    await callback.message.edit_text(
+        await format_vip_list(rows, "👥 Usuarios VIP activos"),
+        reply_markup=get_vip_list_keyboard(rows, has_prev, has_next)
+    )
+
+@router.callback_query(F.data == "manage_vip_users", admin_filter)
+async def manage_vip_users(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    await state.clear()
+    await show_vip_page(callback)
+
+@router.callback_query(F.data.startswith("vip_page:"), admin_filter)
+async def vip_page(callback: CallbackQuery):
+    await callback.answer()
+    _, direction, cursor = callback.data.split(":")
+    if direction == "p":
+        await show_vip_page(callback, before_id=int(cursor))
+    else:
+        await show_vip_page(callback, after_id=int(cursor))
+
+@router.callback_query(F.data == "vip_search", admin_filter)
+async def vip_search_start(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    await state.set_state(VipSearch.entering_query)
+    await callback.message.answer("Envía el @usuario o el ID de Telegram a buscar:")
+
+@router.message(StateFilter(VipSearch.entering_query))
+async def vip_search(message: Message, state: FSMContext):
+    await state.clear()
+    rows = await SubscriptionService.search_subscribers(message.text or "")
+    
+    await message.answer(
+        await format_vip_list(rows, f"🔍 Resultados para {html.escape(message.text or '')}"),
+        reply_markup=get_vip_list_keyboard(rows, False, False)
+    )
+
+async def show_vip_user(message: Message, subscription_id: int, notice: str = None):
+    row = await SubscriptionService.get_subscriber(subscription_id)
+    if row is None:
+        await message.edit_text(
+            (notice + "\n\n" if notice else "") + "La suscripción ya no está activa.",
+            reply_markup=get_vip_list_keyboard([], True, False)
+        )
+        return
+    
+    plan = await SubscriptionService.get_plan(row.plan_id)
+    text = (
+        (notice + "\n\n" if notice else "")
+        + f"👤 {'@' + row.username if row.username else html.escape(row.first_name or '-')}\n"
+        f"🆔 {row.telegram_id}\n"
+        f"📋 Plan: {plan.name if plan else row.plan_id}\n"
+        f"📅 Vence: {format_datetime(row.end_date) if row.end_date else 'Permanente'}"
+    )
+    await message.edit_text(text, reply_markup=get_vip_user_keyboard(row.id))
+
+@router.callback_query(F.data.startswith("vip_user:"), admin_filter)
+async def vip_user(callback: CallbackQuery):
+    await callback.answer()
+    await show_vip_user(callback.message, int(callback.data.split(":")[1]))
+
+@router.callback_query(F.data.startswith("vip_ext:"), admin_filter)
+async def vip_extend(callback: CallbackQuery):
+    _, subscription_id, days = callback.data.split(":")
+    try:
+        subscription = await SubscriptionService.extend_subscription(int(subscription_id), int(days))
+    except AlreadyPermanentError:
+        await callback.answer("♾️ La suscripción es permanente: no se ha modificado")
+    else:
+        await callback.answer("✅ Suscripción extendida" if subscription else "La suscripción ya no está activa")
+    await show_vip_user(callback.message, int(subscription_id))
+
+@router.callback_query(F.data.startswith("vip_rev:"), admin_filter)
+async def vip_revoke(callback: CallbackQuery, bot: Bot):
+    subscription_id = int(callback.data.split(":")[1])
+    revoked, telegram_id = await SubscriptionService.revoke_subscription(subscription_id)
+    
+    if telegram_id is not None:
+        # Sin otra suscripción vigente: fuera del canal VIP
+        await ChannelService.kick_user_from_channel(bot, telegram_id, VIP_CHANNEL_ID)
+    
+    await callback.answer("🚫 Suscripción revocada" if revoked else "La suscripción ya no está activa")
+    await show_vip_user(callback.message, subscription_id, notice="🚫 Suscripción revocada" if revoked else None)
+
+@router.callback_query(F.data.startswith("vip_kick:"), admin_filter)
+async def vip_kick(callback: CallbackQuery, bot: Bot):
+    subscription_id = int(callback.data.split(":")[1])
+    row = await SubscriptionService.get_subscriber(subscription_id)
+    
+    kicked = row is not None and await ChannelService.kick_user_from_channel(bot, row.telegram_id, VIP_CHANNEL_ID)
+    await callback.answer("👢 Usuario expulsado del canal" if kicked else "No se pudo expulsar al usuario")
+    await show_vip_user(callback.message, subscription_id)
 
 # Configuración de canales
 @router.callback_query(F.data == "channel_config")
@@ -244,6 +427,34 @@ async def channel_config(callback: CallbackQuery):
         reply_markup=get_channel_config_keyboard()
     )
 
+# Verificación del canal gratuito contra Telegram, en segundo plano
+@router.callback_query(F.data == "reconcile_free_channel", admin_filter)
+async def reconcile_free_channel(callback: CallbackQuery, bot: Bot):
+    progress = await callback.message.answer("🔄 Verificando miembros del canal gratuito...")
+    
+    async def report(stats):
+        if stats.get("failed"):
+            text = "❌ La verificación del canal gratuito falló. Revisa los registros."
+        else:
+            text = (
+                f"{'✅ Verificación completada' if stats.get('done') else '🔄 Verificando'}\n\n"
+                f"Revisados: {stats['checked']}\n"
+                f"Ya no están en el canal: {stats['left']}\n"
+                f"Errores: {stats['errors']}"
+            )
+        try:
+            await progress.edit_text(text)
+        except Exception:
+            # Un texto idéntico o un mensaje borrado no detiene la verificación
+            pass
+    
+    started = ChannelService.start_free_channel_reconciliation(bot, progress_callback=report)
+    if started:
+        await callback.answer()
+    else:
+        await progress.delete()
+        await callback.answer("Ya hay una verificación en curso", show_alert=True)
+
 # Función para gestionar la configuración de canales
 @router.callback_query(F.data.startswith("channel_"))
 async def process_channel_config(callback: CallbackQuery, bot: Bot):
@@ -474,7 +685,7 @@ async def process_protection_selection(callback: CallbackQuery, state: FSMContex
     )
     await state.set_state(SendMessage.scheduling)
 
-@router.callback_query(StateFilter(SendMessage.scheduling))
+@router.callback_query(StateFilter(SendMessage.scheduling), F.data.in_({"buttons_yes", "buttons_no", "cancel"}))
 async def process_buttons_selection(callback: CallbackQuery, state: FSMContext, bot: Bot):
     await callback.answer()
     
@@ -526,12 +737,11 @@ async def process_scheduling(callback: CallbackQuery, state: FSMContext, bot: Bo
     data = await state.get_data()
     
     if schedule_type == "later":
-        # Aquí implementarías la lógica para programar el mensaje
-        # Por simplicidad, en este ejemplo vamos a omitir esa parte
         await callback.message.answer(
-            "La programación de mensajes no está implementada en este ejemplo. Enviando mensaje ahora."
+            "Escribe la fecha y hora de envío (UTC) con el formato DD/MM/AAAA HH:MM:"
         )
-        schedule_type = "now"
+        await state.set_state(SendMessage.entering_schedule_time)
+        return
     
     if schedule_type == "now":
         # Enviar mensaje inmediatamente
@@ -542,36 +752,171 @@ async def process_scheduling(callback: CallbackQuery, state: FSMContext, bot: Bo
         is_protected = data.get("is_protected", False)
         
         try:
-            if media_type == "none" or not media_id:
-                await bot.send_message(
-                    chat_id=channel_id,
-                    text=text,
-                    protect_content=is_protected
-                )
-            elif media_type == "photo":
-                await bot.send_photo(
-                    chat_id=channel_id,
-                    photo=media_id,
-                    caption=text,
-                    protect_content=is_protected
-                )
-            elif media_type == "video":
-                await bot.send_video(
-                    chat_id=channel_id,
-                    video=media_id,
-                    caption=text,
-                    protect_content=is_protected
-                )
-            elif media_type == "document":
-                await bot.send_document(
-                    chat_id=channel_id,
-                    document=media_id,
-                    caption=text,
-                    protect_content=is_protected
-                )
+            await MessageService.send_content(
+                bot, channel_id,
+                text=text,
+                media_type=media_type,
+                media_id=media_id,
+                is_protected=is_protected
+            )
             
             await callback.message.answer("✅ Mensaje enviado exitosamente.")
         except Exception as e:
             await callback.message.answer(f"❌ Error al enviar mensaje: {str(e)}")
     
-    await state.clear()
\ No newline at end of file
+    await state.clear()
+
+@router.message(StateFilter(SendMessage.entering_schedule_time))
+async def process_schedule_time(message: Message, state: FSMContext):
+    try:
+        scheduled_time = datetime.datetime.strptime(message.text.strip(), "%d/%m/%Y %H:%M")
+    except (ValueError, AttributeError):
+        await message.answer("Formato no válido. Usa DD/MM/AAAA HH:MM, por ejemplo 25/12/2024 18:30:")
+        return
+    
+    if scheduled_time <= datetime.datetime.utcnow():
+        await message.answer("La fecha debe estar en el futuro. Intenta nuevamente:")
+        return
+    
+    await state.update_data(scheduled_time=scheduled_time.isoformat())
+    
+    keyboard = [
+        [("Una sola vez", "recurrence_none")],
+        [("Diariamente", "recurrence_daily")],
+        [("Semanalmente", "recurrence_weekly")],
+        [("Mensualmente", "recurrence_monthly")],
+        [("Cancelar", "cancel")]
+    ]
+    
+    from aiogram.utils.keyboard import InlineKeyboardBuilder
+    kb = InlineKeyboardBuilder()
+    
+    for row in keyboard:
+        for text, data in row:
+            kb.button(text=text, callback_data=data)
+        kb.adjust(1)
+    
+    await message.answer(
+        "¿Con qué frecuencia quieres enviar este mensaje?",
+        reply_markup=kb.as_markup()
+    )
+    await state.set_state(SendMessage.selecting_recurrence)
+
+@router.callback_query(StateFilter(SendMessage.selecting_recurrence))
+async def process_recurrence(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    
+    if callback.data == "cancel":
+        await state.clear()
+        await callback.message.answer("Envío de mensaje cancelado.")
+        return
+    
+    recurrence = callback.data.split("_")[1]
+    data = await state.get_data()
+    scheduled_time = datetime.datetime.fromisoformat(data["scheduled_time"])
+    
+    scheduled = await MessageDispatcherService.schedule_message(
+        channel_id=data.get("channel_id"),
+        scheduled_time=scheduled_time,
+        text=data.get("text"),
+        media_type=data.get("media_type"),
+        media_id=data.get("media_id"),
+        is_protected=data.get("is_protected", False),
+        recurring_pattern=None if recurrence == "none" else recurrence,
+        created_by=callback.from_user.id
+    )
+    
+    notice = (
+        f"✅ Mensaje #{scheduled.id} programado para el {format_datetime(scheduled_time)} (UTC)"
+        + ("." if recurrence == "none" else f", con repetición {scheduled.recurring_pattern}.")
+    )
+    if data.get("has_buttons"):
+        # Los botones aún no se pueden configurar: avisar de que no se enviarán
+        notice += "\n\n⚠️ El mensaje se programó sin botones; la configuración de botones no está disponible."
+    
+    await callback.message.answer(notice)
+    await state.clear()
+
+# Difusión a usuarios
+@router.callback_query(F.data == "broadcast", StateFilter(None), admin_filter)
+async def broadcast_start(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    await callback.message.answer(
+        "Selecciona a quién quieres enviar la difusión:",
+        reply_markup=get_broadcast_segment_keyboard(SEGMENTS)
+    )
+    await state.set_state(Broadcast.selecting_segment)
+
+@router.callback_query(StateFilter(Broadcast.selecting_segment))
+async def process_broadcast_segment(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    
+    if callback.data == "cancel":
+        await state.clear()
+        await callback.message.answer("Difusión cancelada.")
+        return
+    
+    segment = callback.data.split("_", 1)[1]
+    if segment not in SEGMENTS:
+        await callback.message.answer("Segmento no válido.")
+        await state.clear()
+        return
+    
+    await state.update_data(segment=segment)
+    await callback.message.answer(
+        f"Segmento: {SEGMENTS[segment]}\n\n"
+        f"Envía el mensaje a difundir (texto, o imagen/video/documento con descripción):"
+    )
+    await state.set_state(Broadcast.entering_content)
+
+@router.message(StateFilter(Broadcast.entering_content))
+async def process_broadcast_content(message: Message, state: FSMContext):
+    if message.photo:
+        media_type, media_id = "photo", message.photo[-1].file_id
+    elif message.video:
+        media_type, media_id = "video", message.video.file_id
+    elif message.document:
+        media_type, media_id = "document", message.document.file_id
+    else:
+        media_type, media_id = "none", None
+    
+    text = message.text or message.caption
+    if not text and not media_id:
+        await message.answer("El mensaje no puede estar vacío. Intenta nuevamente:")
+        return
+    
+    await state.update_data(text=text, media_type=media_type, media_id=media_id)
+    data = await state.get_data()
+    
+    await message.answer(
+        f"Resumen de la difusión:\n\n"
+        f"👥 Destinatarios: {SEGMENTS[data['segment']]}\n"
+        f"📎 Contenido: {'texto' if media_type == 'none' else media_type}\n\n"
+        f"¿Confirmas el envío?",
+        reply_markup=get_confirm_broadcast_keyboard()
+    )
+    await state.set_state(Broadcast.confirming)
+
+@router.callback_query(StateFilter(Broadcast.confirming))
+async def confirm_broadcast(callback: CallbackQuery, state: FSMContext, bot: Bot):
+    await callback.answer()
+    
+    if callback.data != "confirm_broadcast":
+        await state.clear()
+        await callback.message.answer("Difusión cancelada.")
+        return
+    
+    data = await state.get_data()
+    job = await BroadcastService.create_job(
+        segment=data["segment"],
+        text=data.get("text"),
+        media_type=data.get("media_type"),
+        media_id=data.get("media_id"),
+        created_by=callback.from_user.id
+    )
+    BroadcastService.start_job(bot, job.id)
+    
+    await callback.message.answer(
+        f"📣 Difusión #{job.id} iniciada. Te avisaré cuando termine."
+    )
+    await state.clear()
@@ -0,0 +1,6 @@
+# telegram_subscription_bot/handlers/channel_handlers.py
+from aiogram import Router
+
+# Router de los eventos de canales; aún no registra handlers, así que no
+# añade tipos de update a allowed_updates
+router = Router()
@@ -3,8 +3,14 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 
+from handlers.admin_handlers import admin_filter
 from services.subscription_service import SubscriptionService
 from services.channel_service import ChannelService
+from services.stats_service import (
+    StatsService, USERS_TOTAL, FREE_MEMBERS, TOKENS_GENERATED, TOKENS_USED,
+    EXPIRING_24H, EXPIRING_7D, vip_active_key
+)
+from utils.helpers import format_datetime
 from config import VIP_CHANNEL_ID
 
 router = Router()
@@ -19,14 +25,34 @@ async def back_to_admin(callback: CallbackQuery):
         reply_markup=get_admin_main_menu()
     )
 
-@router.callback_query(F.data == "statistics")
+@router.callback_query(F.data == "statistics", admin_filter)
 async def show_statistics(callback: CallbackQuery):
     await callback.answer()
     
-    # Aquí implementarías la lógica para mostrar estadísticas
-    # Por ejemplo, número de usuarios, suscripciones activas, etc.
+    # Los contadores ya están calculados: una sola lectura de la tabla statistics
+    counters, updated_at = await StatsService.get_all()
+    plans = await SubscriptionService.get_subscription_plans()
     
-    await callback.message.answer(
+    vip_lines = [
+        f"  • {plan.name}: {counters.get(vip_active_key(plan.id), 0)}"
+        for plan in plans
+    ]
+    vip_total = sum(counters.get(vip_active_key(plan.id), 0) for plan in plans)
+    
+    text = (
         "📊 Estadísticas\n\n"
-        "Funcionalidad de estadísticas en desarrollo."
+        f"👥 Usuarios totales: {counters.get(USERS_TOTAL, 0)}\n"
+        f"🆓 Miembros del canal gratuito: {counters.get(FREE_MEMBERS, 0)}\n\n"
+        f"💎 Suscripciones VIP activas: {vip_total}\n"
+        + ("\n".join(vip_lines) + "\n" if vip_lines else "")
+        + "\n"
+        f"⏳ Vencen en 24 horas: {counters.get(EXPIRING_24H, 0)}\n"
+        f"📅 Vencen en 7 días: {counters.get(EXPIRING_7D, 0)}\n\n"
+        f"🔑 Tokens generados: {counters.get(TOKENS_GENERATED, 0)}\n"
+        f"✅ Tokens usados: {counters.get(TOKENS_USED, 0)}"
     )
+    
+    if updated_at:
+        text += f"\n\n🕒 Actualizado: {format_datetime(updated_at)} UTC"
+    
+    await callback.message.answer(text)
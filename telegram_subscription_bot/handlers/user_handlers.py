@@ -7,16 +7,24 @@ from sqlalchemy import select
 
 from database.db import get_session
 from database.models import User
+from database.unit_of_work import UnitOfWork
 from services.token_service import TokenService
-from services.subscription_service import SubscriptionService
+from services.subscription_service import SubscriptionService, AlreadyPermanentError
 from services.channel_service import ChannelService
+from services.invite_link_service import InviteLinkService
 from keyboards.user_keyboards import get_user_main_menu
+from middlewares.query_budget import query_budget
 from config import FREE_CHANNEL_ID, VIP_CHANNEL_ID, FREE_CHANNEL_OPEN_ACCESS
 
 router = Router()
 
+# El canje de un token con su enlace de invitación es el camino más caro
 @router.message(CommandStart())
-async def start_command(message: Message, bot: Bot):
+@query_budget(12)
+async def start_command(message: Message, bot: Bot, uow: UnitOfWork = None):
+    # Con unidad de trabajo todos los servicios comparten la sesión del update
+    session = uow.session if uow else None
+    
     # Comprobar si hay un token en el comando start
     args = message.text.split()
     token_value = args[1] if len(args) > 1 else None
@@ -27,19 +35,23 @@ async def start_command(message: Message, bot: Bot):
     
     # Verificar el token si existe
     if token_value:
-        # Validar token
-        token = await TokenService.validate_token(token_value)
+        # Canjear token y activar la suscripción en una sola transacción
+        user = await uow.get_user() if uow else None
+        try:
+            token_valid, subscription = await TokenService.redeem_token(token_value, message.from_user.id, session, user)
+        except AlreadyPermanentError:
+            # El token no se consume y queda disponible para otra persona
+            await message.answer(
+                f"{welcome_message}\n\n"
+                f"♾️ Ya tienes una suscripción VIP permanente, así que el enlace no se ha utilizado."
+            )
+            return
         
-        if token:
-            # Token válido, activar suscripción
-            subscription = await SubscriptionService.subscribe_user(message.from_user.id, token.plan_id)
-            
+        if token_valid:
             if subscription:
-                # Marcar token como usado
-                await TokenService.use_token(token_value, message.from_user.id)
-                
-                # Generar invitación al canal VIP
-                invite_link = await ChannelService.create_channel_invite(bot, VIP_CHANNEL_ID)
+                # Tomar un enlace de un solo uso del pool del canal VIP
+                invite_link = await InviteLinkService.claim_link(bot, VIP_CHANNEL_ID, message.from_user.id, session)
+                ChannelService.invalidate_membership(message.from_user.id, VIP_CHANNEL_ID)
                 
                 if invite_link:
                     await message.answer(
@@ -71,7 +83,7 @@ async def start_command(message: Message, bot: Bot):
         is_in_free_channel = await ChannelService.check_user_in_channel(bot, message.from_user.id, FREE_CHANNEL_ID)
         
         # Actualizar estado en la base de datos
-        await ChannelService.update_free_channel_status(message.from_user.id, is_in_free_channel)
+        await ChannelService.update_free_channel_status(message.from_user.id, is_in_free_channel, session)
         
         if is_in_free_channel or FREE_CHANNEL_OPEN_ACCESS:
             # Si ya está en el canal o el acceso es libre, mostrar menú principal
@@ -83,6 +95,8 @@ async def start_command(message: Message, bot: Bot):
         else:
             # Si no está en el canal y se requiere estar en él, enviar invitación
             invite_link = await ChannelService.create_channel_invite(bot, FREE_CHANNEL_ID)
+            # Volver a consultar la membresía cuando el usuario pulse /start otra vez
+            ChannelService.invalidate_membership(message.from_user.id, FREE_CHANNEL_ID)
             
             if invite_link:
                 await message.answer(
@@ -98,12 +112,14 @@ async def start_command(message: Message, bot: Bot):
                 )
 
 @router.message(Command("menu"))
-async def menu_command(message: Message, bot: Bot):
+async def menu_command(message: Message, bot: Bot, uow: UnitOfWork = None):
     # Verificar si el usuario está en el canal gratuito
     is_in_free_channel = await ChannelService.check_user_in_channel(bot, message.from_user.id, FREE_CHANNEL_ID)
     
     # Actualizar estado en la base de datos
-    await ChannelService.update_free_channel_status(message.from_user.id, is_in_free_channel)
+    await ChannelService.update_free_channel_status(
+        message.from_user.id, is_in_free_channel, uow.session if uow else None
+    )
     
     if is_in_free_channel or FREE_CHANNEL_OPEN_ACCESS:
         # Mostrar menú principal
@@ -114,6 +130,7 @@ async def menu_command(message: Message, bot: Bot):
     else:
         # Si no está en el canal y se requiere estar en él, enviar invitación
         invite_link = await ChannelService.create_channel_invite(bot, FREE_CHANNEL_ID)
+        ChannelService.invalidate_membership(message.from_user.id, FREE_CHANNEL_ID)
         
         if invite_link:
             await message.answer(
@@ -123,40 +140,34 @@ async def menu_command(message: Message, bot: Bot):
             )
 
 @router.callback_query(F.data == "subscription_status")
-async def subscription_status(callback: CallbackQuery, bot: Bot):
+@query_budget(3)
+async def subscription_status(callback: CallbackQuery, bot: Bot, uow: UnitOfWork = None):
     await callback.answer()
     
-    # Verificar estado de suscripción
-    subscription = await SubscriptionService.get_active_subscription(callback.from_user.id)
+    # Estado VIP desnormalizado: una sola fila de users
+    status = await SubscriptionService.get_subscription_status(
+        callback.from_user.id, uow.session if uow else None
+    )
     
-    if subscription:
+    if status and status.is_active:
         # Tiene suscripción activa
-        async with get_session() as session:
-            # Obtener detalles del plan
-            from database.models import SubscriptionPlan
-            result = await session.execute(select(SubscriptionPlan).where(SubscriptionPlan.id == subscription.plan_id))
-            plan = result.scalar_one_or_none()
-            
-            if subscription.end_date:
-                # Suscripción con fecha de expiración
-                import datetime
-                days_left = (subscription.end_date - datetime.datetime.utcnow()).days
-                
-                await callback.message.answer(
-                    f"🔰 Estado de tu Suscripción VIP\n\n"
-                    f"Plan: {plan.name}\n"
-                    f"Estado: Activa ✅\n"
-                    f"Días restantes: {days_left if days_left > 0 else 'Menos de un día'}\n"
-                    f"Fecha de expiración: {subscription.end_date.strftime('%d/%m/%Y')}"
-                )
-            else:
-                # Suscripción permanente
-                await callback.message.answer(
-                    f"🔰 Estado de tu Suscripción VIP\n\n"
-                    f"Plan: {plan.name}\n"
-                    f"Estado: Activa ✅\n"
-                    f"Duración: Permanente ♾️"
-                )
+        if status.end_date:
+            # Suscripción con fecha de expiración
+            await callback.message.answer(
+                f"🔰 Estado de tu Suscripción VIP\n\n"
+                f"Plan: {status.plan_name}\n"
+                f"Estado: Activa ✅\n"
+                f"Días restantes: {status.days_left if status.days_left > 0 else 'Menos de un día'}\n"
+                f"Fecha de expiración: {status.end_date.strftime('%d/%m/%Y')}"
+            )
+        else:
+            # Suscripción permanente
+            await callback.message.answer(
+                f"🔰 Estado de tu Suscripción VIP\n\n"
+                f"Plan: {status.plan_name}\n"
+                f"Estado: Activa ✅\n"
+                f"Duración: Permanente ♾️"
+            )
     else:
         # No tiene suscripción activa
         await callback.message.answer(
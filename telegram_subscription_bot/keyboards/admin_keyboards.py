@@ -1,6 +1,6 @@
 # telegram_subscription_bot/keyboards/admin_keyboards.py
+from functools import lru_cache
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from database.models import SubscriptionPlan
 
 def get_admin_main_menu():
     """Retorna el teclado principal para administradores"""
@@ -9,9 +9,11 @@ def get_admin_main_menu():
     buttons = [
         ("📝 Configurar Tarifas", "config_tariffs"),
         ("🔗 Generar Enlace", "generate_link"),
+        ("📦 Generar Enlaces en Lote", "generate_batch"),
         ("👥 Gestionar Usuarios VIP", "manage_vip_users"),
         ("📢 Configurar Canales", "channel_config"),
         ("✉️ Enviar Mensaje", "send_message"),
+        ("📣 Difusión a Usuarios", "broadcast"),
         ("📊 Estadísticas", "statistics")
     ]
     
@@ -50,26 +52,12 @@ def get_confirm_tariff_keyboard():
     builder.adjust(2)  # Dos columnas
     return builder.as_markup()
 
-def get_subscription_plans_keyboard(plans):
-    """Retorna el teclado con los planes de suscripción disponibles"""
+@lru_cache(maxsize=16)
+def _build_subscription_plans_keyboard(plans):
     builder = InlineKeyboardBuilder()
     
     for plan in plans:
-        # Determinar texto de duración
-        if plan.is_permanent:
-            duration_text = "Permanente"
-        elif plan.duration_days == 1:
-            duration_text = "1 día"
-        elif plan.duration_days == 7:
-            duration_text = "1 semana"
-        elif plan.duration_days == 14:
-            duration_text = "2 semanas"
-        elif plan.duration_days == 30:
-            duration_text = "1 mes"
-        else:
-            duration_text = f"{plan.duration_days} días"
-        
-        button_text = f"{plan.name} ({duration_text}) - ${plan.price}"
+        button_text = f"{plan.name} ({plan.duration_text}) - ${plan.price}"
         builder.button(text=button_text, callback_data=f"plan_{plan.id}")
     
     builder.button(text="❌ Cancelar", callback_data="cancel")
@@ -77,6 +65,11 @@ def get_subscription_plans_keyboard(plans):
     builder.adjust(1)  # Una columna
     return builder.as_markup()
 
+def get_subscription_plans_keyboard(plans):
+    """Retorna el teclado con los planes de suscripción disponibles"""
+    # El catálogo es una tupla inmutable: se construye una vez por versión
+    return _build_subscription_plans_keyboard(tuple(plans))
+
 def get_channel_config_keyboard():
     """Retorna el teclado para configuración de canales"""
     builder = InlineKeyboardBuilder()
@@ -84,6 +77,7 @@ def get_channel_config_keyboard():
     buttons = [
         ("📢 Configurar Canal Gratuito", "channel_free"),
         ("🔒 Configurar Canal VIP", "channel_vip"),
+        ("🔄 Verificar Miembros del Canal Gratuito", "reconcile_free_channel"),
         ("🔙 Volver", "back_to_admin")
     ]
     
@@ -91,4 +85,67 @@ def get_channel_config_keyboard():
         builder.button(text=text, callback_data=callback_data)
     
     builder.adjust(1)  # Una columna
-    return builder.as_markup()
\ No newline at end of file
+    return builder.as_markup()
+
+def get_broadcast_segment_keyboard(segments):
+    """Retorna el teclado para elegir el segmento de una difusión"""
+    builder = InlineKeyboardBuilder()
+    
+    for segment, label in segments.items():
+        builder.button(text=label, callback_data=f"segment_{segment}")
+    
+    builder.button(text="❌ Cancelar", callback_data="cancel")
+    
+    builder.adjust(1)  # Una columna
+    return builder.as_markup()
+
+def get_confirm_broadcast_keyboard():
+    """Retorna el teclado para confirmar una difusión"""
+    builder = InlineKeyboardBuilder()
+    
+    builder.button(text="✅ Enviar", callback_data="confirm_broadcast")
+    builder.button(text="❌ Cancelar", callback_data="cancel")
+    
+    builder.adjust(2)  # Dos columnas
+    return builder.as_markup()
+
+def get_vip_list_keyboard(rows, has_prev, has_next):
+    """Retorna el teclado de una página de usuarios VIP"""
+    builder = InlineKeyboardBuilder()
+    
+    for row in rows:
+        name = f"@{row.username}" if row.username else (row.first_name or str(row.telegram_id))
+        builder.button(text=name, callback_data=f"vip_user:{row.id}")
+    
+    navigation = []
+    if rows and has_prev:
+        builder.button(text="⬅️ Anterior", callback_data=f"vip_page:p:{rows[0].id}")
+        navigation.append(1)
+    if rows and has_next:
+        builder.button(text="Siguiente ➡️", callback_data=f"vip_page:n:{rows[-1].id}")
+        navigation.append(1)
+    
+    builder.button(text="🔍 Buscar", callback_data="vip_search")
+    builder.button(text="🔙 Volver", callback_data="back_to_admin")
+    
+    builder.adjust(*([1] * len(rows)), *([len(navigation)] if navigation else []), 2)
+    return builder.as_markup()
+
+def get_vip_user_keyboard(subscription_id):
+    """Retorna el teclado de acciones sobre una suscripción VIP"""
+    builder = InlineKeyboardBuilder()
+    
+    buttons = [
+        ("➕ 7 días", f"vip_ext:{subscription_id}:7"),
+        ("➕ 30 días", f"vip_ext:{subscription_id}:30"),
+        ("🚫 Revocar", f"vip_rev:{subscription_id}"),
+        ("👢 Expulsar del canal", f"vip_kick:{subscription_id}"),
+        # Volver a la página que empieza en esta suscripción
+        ("🔙 Volver", f"vip_page:n:{subscription_id - 1}")
+    ]
+    
+    for text, callback_data in buttons:
+        builder.button(text=text, callback_data=callback_data)
+    
+    builder.adjust(2, 1, 1, 1)
+    return builder.as_markup()
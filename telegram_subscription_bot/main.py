@@ -2,14 +2,33 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN
-from database.db import init_db
+from config import (
+    BOT_TOKEN, FSM_STORAGE, RUN_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS,
+    METRICS_ENABLED, TELEGRAM_API_SERVER, UNIT_OF_WORK
+)
+from database.db import init_db, close_db
+from database.fsm_storage import DatabaseStorage
 from handlers import admin_handlers, user_handlers, subscription_handlers, channel_handlers
 from middlewares.access_middleware import AccessMiddleware
+from middlewares.request_scheduler import RequestSchedulerMiddleware
+from middlewares.update_executor import UpdateExecutorMiddleware
+from middlewares.query_budget import QueryBudgetMiddleware
+from middlewares.metrics_middleware import HandlerMetricsMiddleware
+from middlewares.unit_of_work import UnitOfWorkMiddleware
 from services.scheduler_service import SchedulerService
+from services.subscription_service import SubscriptionService
+from services.user_sync_service import user_sync
+from services.broadcast_service import BroadcastService
+from services.invite_link_service import InviteLinkService
+from services.message_dispatcher_service import MessageDispatcherService
+from services.webhook_service import UpdateQueue, WebhookServer
+from services.stats_service import StatsService
+from services.metrics_service import MetricsService
 
 # Configuración de logging
 logging.basicConfig(
@@ -17,38 +36,120 @@ logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 
-async def main():
-    # Inicializar la base de datos
-    await init_db()
-    
-    # Inicializar el bot y el dispatcher
-    bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-    storage = MemoryStorage()
+def build_dispatcher(storage) -> Dispatcher:
+    """Crea el dispatcher con sus middlewares y routers"""
     dp = Dispatcher(storage=storage)
     
     # Registrar middlewares
+    # Los updates de un mismo usuario se procesan en orden; los de usuarios distintos, en paralelo
+    UpdateExecutorMiddleware().setup(dp)
+    # Consultas SQL por update, con aviso al superar el presupuesto del handler
+    QueryBudgetMiddleware().setup(dp)
+    HandlerMetricsMiddleware().setup(dp)
     dp.message.middleware(AccessMiddleware())
     dp.callback_query.middleware(AccessMiddleware())
+    if UNIT_OF_WORK:
+        # Una sesión y una transacción por update, compartida con los servicios
+        dp.message.middleware(UnitOfWorkMiddleware())
+        dp.callback_query.middleware(UnitOfWorkMiddleware())
     
     # Incluir routers
     dp.include_router(admin_handlers.router)
     dp.include_router(subscription_handlers.router)
     dp.include_router(channel_handlers.router)
     dp.include_router(user_handlers.router)  # Siempre al final para capturar mensajes no manejados
+    return dp
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Recibe los updates por webhook y los procesa desde una cola interna"""
+    update_queue = UpdateQueue(dp, bot)
+    server = WebhookServer(bot, update_queue)
+    
+    await dp.emit_startup(bot=bot, **dp.workflow_data)
+    await update_queue.start()
+    await server.start()
+    
+    # Sin URL pública el servidor solo recibe updates sintéticos de pruebas locales
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        await update_queue.stop()
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+
+async def main():
+    # Inicializar la base de datos
+    await init_db()
+    
+    # Cargar el catálogo de planes en memoria
+    await SubscriptionService.load_plan_catalog()
+    
+    # Inicializar el bot y el dispatcher
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_SERVER)) if TELEGRAM_API_SERVER else None
+    bot = Bot(token=BOT_TOKEN, session=session, parse_mode=ParseMode.HTML)
+    # Todas las peticiones salientes respetan los límites de Telegram
+    request_scheduler = RequestSchedulerMiddleware()
+    bot.session.middleware(request_scheduler)
+    # Estados FSM persistentes (compartidos entre procesos con FSM_SHARED); el dispatcher los guarda al cerrar
+    if FSM_STORAGE == "memory":
+        storage = MemoryStorage()
+    else:
+        storage = DatabaseStorage()
+        await storage.start()
+    dp = build_dispatcher(storage)
     
     # Inicializar el servicio de programación
     scheduler_service = SchedulerService(bot)
     await scheduler_service.start()
     
-    # Eliminar webhook por si acaso
-    await bot.delete_webhook(drop_pending_updates=True)
+    # Envío de mensajes programados
+    message_dispatcher = MessageDispatcherService(bot)
+    await message_dispatcher.start()
+    
+    # Mantener el pool de enlaces de invitación VIP
+    await InviteLinkService.start(bot)
+    
+    # Contadores de estadísticas: vencimientos próximos y reconciliación periódica
+    await StatsService.start()
+    
+    # Métricas de handlers, base de datos y llamadas a Telegram
+    metrics_service = MetricsService(storage) if METRICS_ENABLED else None
+    if metrics_service:
+        await metrics_service.start()
+    
+    # Reanudar difusiones interrumpidas por un reinicio
+    await BroadcastService.resume_jobs(bot)
     
-    # Iniciar polling
     try:
-        await dp.start_polling(bot)
+        if RUN_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            # Eliminar webhook por si acaso
+            await bot.delete_webhook(drop_pending_updates=True)
+            
+            # Iniciar polling
+            await dp.start_polling(bot)
     finally:
-        await bot.session.close()
         await scheduler_service.stop()
+        await message_dispatcher.stop()
+        await BroadcastService.stop()
+        await InviteLinkService.stop()
+        await StatsService.stop()
+        if metrics_service:
+            await metrics_service.stop()
+        await request_scheduler.scheduler.close()
+        await bot.session.close()
+        # Guardar los perfiles de usuario pendientes
+        await user_sync.stop()
+        await close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -1,2 +1,7 @@
 # telegram_subscription_bot/middlewares/__init__.py
-from . import access_middleware
\ No newline at end of file
+from . import access_middleware
+from . import request_scheduler
+from . import update_executor
+from . import query_budget
+from . import metrics_middleware
+from . import unit_of_work
\ No newline at end of file
@@ -2,13 +2,15 @@
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
-from sqlalchemy import select
 
-from database.db import get_session
-from database.models import User
+from services.user_sync_service import UserSyncService, user_sync
 from config import ADMIN_IDS
 
 class AccessMiddleware(BaseMiddleware):
+    def __init__(self, user_sync_service: UserSyncService = None):
+        # Todas las instancias comparten la misma caché salvo que se indique otra
+        self.user_sync = user_sync_service or user_sync
+    
     async def __call__(
         self,
         handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
@@ -30,29 +32,14 @@ class AccessMiddleware(BaseMiddleware):
             # Tipo de evento no soportado
             return await handler(event, data)
         
-        # Registrar o actualizar usuario en la base de datos
-        async with get_session() as session:
-            result = await session.execute(select(User).where(User.telegram_id == user_id))
-            user = result.scalar_one_or_none()
-            
-            if not user:
-                # Crear nuevo usuario
-                user = User(
-                    telegram_id=user_id,
-                    username=username,
-                    first_name=first_name,
-                    last_name=last_name,
-                    is_admin=user_id in ADMIN_IDS
-                )
-                session.add(user)
-            else:
-                # Actualizar datos del usuario
-                user.username = username
-                user.first_name = first_name
-                user.last_name = last_name
-                user.is_admin = user_id in ADMIN_IDS
-            
-            await session.commit()
+        # Registrar o actualizar usuario (solo toca la base de datos si el perfil cambió)
+        await self.user_sync.sync_user(
+            user_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name,
+            is_admin=user_id in ADMIN_IDS
+        )
         
         # Continuar con el manejador
         return await handler(event, data)
\ No newline at end of file
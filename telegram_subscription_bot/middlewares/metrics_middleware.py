@@ -0,0 +1,49 @@
+# telegram_subscription_bot/middlewares/metrics_middleware.py
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+
+from utils.metrics import registry
+
+HANDLER_SECONDS = registry.histogram(
+    "handler_duration_seconds", "Duración de cada handler", ("router", "handler")
+)
+HANDLER_ERRORS = registry.counter(
+    "handler_errors_total", "Handlers que terminaron con una excepción", ("router", "handler", "error")
+)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Middleware interno que mide la duración de cada handler por router y callback"""
+
+    def setup(self, dp: Dispatcher) -> None:
+        """Registra la medición en cada tipo de evento del dispatcher y sus routers"""
+        for name, observer in dp.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware(self)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        if handler_object is None:
+            return await handler(event, data)
+
+        callback = handler_object.callback
+        # Los routers no tienen nombre: se identifican por su módulo
+        labels = {
+            "router": getattr(callback, "__module__", "").rsplit(".", 1)[-1],
+            "handler": getattr(callback, "__name__", repr(callback))
+        }
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(error=type(e).__name__, **labels)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, **labels)
@@ -0,0 +1,104 @@
+# telegram_subscription_bot/middlewares/query_budget.py
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+
+from database.query_tracker import QueryStats, active_stats, track_queries
+from config import QUERY_BUDGET_DEFAULT, QUERY_BUDGETS, QUERY_BUDGET_STRICT, QUERY_REPEAT_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(Exception):
+    """Un update ejecutó más consultas de las que permite su handler"""
+
+def query_budget(limit: int):
+    """Fija el presupuesto de consultas de un handler"""
+    def decorator(callback):
+        callback.query_budget = limit
+        return callback
+    return decorator
+
+class HandlerTagMiddleware(BaseMiddleware):
+    """Middleware interno que anota el handler elegido y su presupuesto"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        stats = active_stats()
+        handler_object = data.get("handler")
+        if stats is not None and handler_object is not None:
+            callback = handler_object.callback
+            stats.handler = getattr(callback, "__name__", repr(callback))
+            stats.budget = getattr(callback, "query_budget", None)
+        return await handler(event, data)
+
+class QueryBudgetMiddleware(BaseMiddleware):
+    """
+    Middleware externo de update que mide las consultas SQL de cada update.
+
+    Avisa cuando se supera el presupuesto del handler y cuando una misma
+    sentencia se repite dentro del update; en modo estricto el exceso de
+    presupuesto lanza QueryBudgetExceeded.
+    """
+
+    def __init__(self, default_budget: int = QUERY_BUDGET_DEFAULT, budgets: Optional[Dict[str, int]] = None,
+                 strict: bool = QUERY_BUDGET_STRICT, repeat_threshold: int = QUERY_REPEAT_THRESHOLD):
+        self.default_budget = default_budget
+        self.budgets = QUERY_BUDGETS if budgets is None else budgets
+        self.strict = strict
+        self.repeat_threshold = repeat_threshold
+        self.stats = {"updates": 0, "queries": 0, "over_budget": 0, "repeated": 0}
+
+    def setup(self, dp: Dispatcher) -> None:
+        """Registra la medición en el update y la anotación del handler en cada tipo de evento"""
+        dp.update.outer_middleware(self)
+        tagger = HandlerTagMiddleware()
+        for name, observer in dp.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware(tagger)
+
+    def budget_for(self, stats: QueryStats) -> int:
+        if stats.budget is not None:
+            return stats.budget
+        return self.budgets.get(stats.handler, self.default_budget)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        with track_queries() as stats:
+            result = await handler(event, data)
+        self.check(stats, getattr(event, "update_id", None))
+        return result
+
+    def check(self, stats: QueryStats, update_id=None) -> None:
+        self.stats["updates"] += 1
+        self.stats["queries"] += stats.count
+        handler = stats.handler or "unhandled"
+
+        for statement, count in stats.repeated(self.repeat_threshold):
+            self.stats["repeated"] += 1
+            logger.warning(
+                "Update %s (%s) repeated the same statement %s times: %s",
+                update_id, handler, count, " ".join(statement.split())[:200]
+            )
+
+        budget = self.budget_for(stats)
+        if stats.count <= budget:
+            return
+
+        self.stats["over_budget"] += 1
+        message = (
+            f"Update {update_id} ({handler}) ran {stats.count} queries in {stats.sessions} sessions, "
+            f"{stats.total_time * 1000:.1f} ms; budget is {budget}"
+        )
+        if self.strict:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -0,0 +1,232 @@
+# telegram_subscription_bot/middlewares/request_scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from utils.cache import TTLCache
+from utils.metrics import registry
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_PRIVATE_CHAT_RATE, TELEGRAM_GROUP_CHAT_RATE,
+    TELEGRAM_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Carriles de prioridad: un número menor se atiende antes
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+request_priority: ContextVar[int] = ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+
+# Métodos que no cuentan para los límites (getUpdates es el long polling)
+UNTHROTTLED_METHODS = {"getUpdates", "getMe", "deleteWebhook", "setWebhook", "answerCallbackQuery"}
+# Prefijos de métodos que publican en un chat y cuentan para su límite propio
+CHAT_LIMITED_PREFIXES = ("send", "copy", "forward", "edit")
+
+TELEGRAM_REQUEST_SECONDS = registry.histogram(
+    "telegram_request_duration_seconds", "Duración de las llamadas a la API de Telegram", ("method",)
+)
+TELEGRAM_QUEUE_SECONDS = registry.histogram(
+    "telegram_queue_wait_seconds", "Espera en el planificador antes de cada llamada", ("method",)
+)
+TELEGRAM_ERRORS = registry.counter(
+    "telegram_request_errors_total", "Llamadas a la API de Telegram que fallaron", ("method", "error")
+)
+TELEGRAM_FLOOD_WAITS = registry.counter(
+    "telegram_flood_waits_total", "Respuestas 429 (RetryAfter) de la API de Telegram", ("method",)
+)
+
+@contextmanager
+def background_priority():
+    """Envía las peticiones del bloque por el carril de baja prioridad"""
+    token = request_priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+class TokenBucket:
+    """Cubo de fichas con reserva: cada petición reserva su turno y espera hasta él"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Consume una ficha y retorna los segundos a esperar para usarla"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Bloquea el cubo durante los segundos indicados"""
+        self.reserve_until(time.monotonic() + seconds)
+
+    def reserve_until(self, when: float) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.tokens, -(when - now) * self.rate)
+        self.updated = now
+
+class OutboundScheduler:
+    """
+    Planificador de peticiones salientes a Telegram.
+
+    Cada petición espera primero al cubo de su chat y después entra en una
+    cola global por prioridad que se despacha al ritmo del cubo global.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE,
+                 private_chat_rate: float = TELEGRAM_PRIVATE_CHAT_RATE,
+                 group_chat_rate: float = TELEGRAM_GROUP_CHAT_RATE):
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.chat_buckets = TTLCache(maxsize=100000, ttl=600)
+        self.paused_until = 0.0
+        self.stats = {"granted": 0, "throttled": 0, "retried": 0, "retry_after_seconds": 0.0}
+        self._queue = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            # Los ids negativos son grupos y canales
+            is_group = key.startswith("-") or key.startswith("@")
+            rate = self.group_chat_rate if is_group else self.private_chat_rate
+            # Telegram tolera ráfagas cortas por encima del ritmo medio
+            bucket = TokenBucket(rate, capacity=max(1, rate * 3))
+        # Renovar la entrada para que un chat activo no se expulse
+        self.chat_buckets.set(key, bucket)
+        return bucket
+
+    async def acquire(self, chat_id: Any = None, priority: Optional[int] = None) -> None:
+        if priority is None:
+            priority = request_priority.get()
+
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay > 0:
+                self.stats["throttled"] += 1
+                await asyncio.sleep(delay)
+
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    def pause(self, seconds: float, chat_id: Any = None) -> None:
+        """Aplica una pausa impuesta por Telegram a un chat o a todo el bot"""
+        self.stats["retry_after_seconds"] += seconds
+        if chat_id is not None:
+            self._chat_bucket(chat_id).pause(seconds)
+        else:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def queue_size(self) -> int:
+        return len(self._queue)
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            delay = self.global_bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            # Tras la espera puede haber llegado algo más prioritario
+            while self._queue:
+                _, _, future = heapq.heappop(self._queue)
+                if not future.done():
+                    future.set_result(None)
+                    self.stats["granted"] += 1
+                    break
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for _, _, future in self._queue:
+            if not future.done():
+                future.cancel()
+        self._queue.clear()
+
+class RequestSchedulerMiddleware(BaseRequestMiddleware):
+    """Middleware de sesión que pasa todas las peticiones por el planificador"""
+
+    def __init__(self, scheduler: OutboundScheduler = None, max_retries: int = TELEGRAM_MAX_RETRIES):
+        self.scheduler = scheduler or OutboundScheduler()
+        self.max_retries = max_retries
+
+    async def __call__(self, make_request, bot, method):
+        if method.__api_method__ in UNTHROTTLED_METHODS:
+            return await self._timed_request(make_request, bot, method)
+
+        chat_id = None
+        if method.__api_method__.startswith(CHAT_LIMITED_PREFIXES):
+            chat_id = getattr(method, "chat_id", None)
+        
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            await self.scheduler.acquire(chat_id)
+            TELEGRAM_QUEUE_SECONDS.observe(time.perf_counter() - started, method=method.__api_method__)
+            try:
+                return await self._timed_request(make_request, bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.scheduler.stats["retried"] += 1
+                logger.warning(
+                    "Flood control on %s (chat %s), retrying in %s s",
+                    method.__api_method__, chat_id, e.retry_after
+                )
+                # Sin chat el límite es global; se vuelve a encolar tras la pausa
+                self.scheduler.pause(e.retry_after, chat_id)
+
+    @staticmethod
+    async def _timed_request(make_request, bot, method):
+        api_method = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            if isinstance(e, TelegramRetryAfter):
+                TELEGRAM_FLOOD_WAITS.inc(method=api_method)
+            TELEGRAM_ERRORS.inc(method=api_method, error=type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, method=api_method)
@@ -0,0 +1,35 @@
+# telegram_subscription_bot/middlewares/unit_of_work.py
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from database.db import get_session
+from database.unit_of_work import UnitOfWork
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    Middleware interno que abre una unidad de trabajo por update.
+
+    Los handlers la reciben como uow; se confirma si el handler termina bien
+    y se deshace si lanza una excepción. Va después de AccessMiddleware para
+    que el usuario ya exista en la base de datos.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        async with get_session() as session:
+            uow = UnitOfWork(session, user.id if user else None)
+            data["uow"] = uow
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await uow.rollback()
+                raise
+            await uow.commit()
+            return result
@@ -0,0 +1,167 @@
+# telegram_subscription_bot/middlewares/update_executor.py
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import EXECUTOR_MAX_IN_FLIGHT, EXECUTOR_PARTITION_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+# Clave de feed_update con la que se avisa de que el update ya tiene su turno
+SLOT_HELD_KEY = "update_slot_held"
+
+def partition_key(user, chat) -> Optional[Hashable]:
+    """Partición de un update: su usuario, o su chat si no tiene usuario"""
+    if user is not None:
+        return ("user", user.id)
+    if chat is not None:
+        return ("chat", chat.id)
+    return None
+
+def update_partition_key(update: Update) -> Optional[Hashable]:
+    chat, user, _ = UserContextMiddleware.resolve_event_context(update)
+    return partition_key(user, chat)
+
+class _Partition:
+    __slots__ = ("waiters", "running")
+
+    def __init__(self):
+        self.waiters = deque()
+        self.running = 0
+
+class UpdateExecutor:
+    """
+    Turnos de ejecución de updates particionados por usuario.
+
+    Los updates de una misma partición entran en orden de llegada y, con el
+    límite por partición en 1, de uno en uno; los de particiones distintas
+    corren en paralelo hasta el límite global.
+    """
+
+    def __init__(self, max_in_flight: int = EXECUTOR_MAX_IN_FLIGHT,
+                 partition_in_flight: int = EXECUTOR_PARTITION_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.partition_in_flight = partition_in_flight
+        self.stats = {"executed": 0, "partition_waits": 0, "global_waits": 0}
+        self._partitions: Dict[Hashable, _Partition] = {}
+        self._global: Optional[asyncio.Semaphore] = None
+
+    @property
+    def in_flight(self) -> int:
+        return sum(partition.running for partition in self._partitions.values())
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(partition.waiters) for partition in self._partitions.values())
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "partitions": len(self._partitions),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting
+        }
+
+    async def _acquire_partition(self, key: Hashable) -> _Partition:
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = self._partitions[key] = _Partition()
+
+        if partition.running < self.partition_in_flight and not partition.waiters:
+            partition.running += 1
+            return partition
+
+        self.stats["partition_waits"] += 1
+        waiter = asyncio.get_running_loop().create_future()
+        partition.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # El turno ya se había concedido: cederlo al siguiente
+                self._release_partition(key, partition)
+            else:
+                partition.waiters.remove(waiter)
+                self._discard_if_idle(key, partition)
+            raise
+        return partition
+
+    def _release_partition(self, key: Hashable, partition: _Partition) -> None:
+        partition.running -= 1
+        # El turno pasa directamente al siguiente en la cola de la partición
+        while partition.waiters and partition.running < self.partition_in_flight:
+            waiter = partition.waiters.popleft()
+            if not waiter.done():
+                partition.running += 1
+                waiter.set_result(None)
+        self._discard_if_idle(key, partition)
+
+    def _discard_if_idle(self, key: Hashable, partition: _Partition) -> None:
+        if not partition.running and not partition.waiters and self._partitions.get(key) is partition:
+            del self._partitions[key]
+
+    @asynccontextmanager
+    async def slot(self, key: Optional[Hashable]):
+        """Espera el turno de la partición y un hueco global"""
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_in_flight)
+
+        partition = None
+        if key is not None:
+            partition = await self._acquire_partition(key)
+        try:
+            if self._global.locked():
+                self.stats["global_waits"] += 1
+            async with self._global:
+                self.stats["executed"] += 1
+                yield
+        finally:
+            if partition is not None:
+                self._release_partition(key, partition)
+
+class UpdateExecutorMiddleware(BaseMiddleware):
+    """
+    Middleware externo de update que ordena la ejecución por usuario.
+
+    Los updates sin usuario se particionan por chat y, si tampoco tienen
+    chat, solo cuentan para el límite global. Hay que registrarlo con setup
+    para que el turno se tome antes de leer el estado FSM.
+    """
+
+    def __init__(self, executor: UpdateExecutor = None):
+        self.executor = executor or UpdateExecutor()
+
+    def setup(self, dp: Dispatcher) -> None:
+        """
+        Registra el middleware entre UserContextMiddleware y el de FSM.
+
+        FSMContextMiddleware lee raw_state antes de llamar al handler: si el
+        turno se tomara después, un update en cola se enrutaría con el estado
+        anterior a la transición del update previo del mismo usuario.
+        """
+        manager = dp.update.outer_middleware
+        manager.unregister(dp.fsm)
+        manager.register(self)
+        manager.register(dp.fsm)
+        # Para quien reparte updates por su cuenta, como la cola del webhook
+        dp["update_executor"] = self.executor
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if data.get(SLOT_HELD_KEY):
+            # Quien llamó a feed_update ya tomó el turno de este update
+            return await handler(event, data)
+
+        key = partition_key(data.get("event_from_user"), data.get("event_chat"))
+        async with self.executor.slot(key):
+            return await handler(event, data)
@@ -2,4 +2,12 @@
 from . import subscription_service
 from . import channel_service
 from . import token_service
-from . import scheduler_service
\ No newline at end of file
+from . import scheduler_service
+from . import user_sync_service
+from . import message_service
+from . import broadcast_service
+from . import invite_link_service
+from . import message_dispatcher_service
+from . import webhook_service
+from . import stats_service
+from . import metrics_service
\ No newline at end of file
@@ -0,0 +1,219 @@
+# telegram_subscription_bot/services/broadcast_service.py
+import asyncio
+import datetime
+import logging
+from sqlalchemy import select, update, and_, true
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+
+from database.db import get_session
+from database.models import User, BroadcastJob
+from database.vip_status import is_vip
+from middlewares.request_scheduler import background_priority
+from services.message_service import MessageService
+from config import BROADCAST_CHUNK_SIZE, BROADCAST_CONCURRENCY, BROADCAST_EXPIRING_DAYS
+
+logger = logging.getLogger(__name__)
+
+SEGMENTS = {
+    "all": "Todos los usuarios",
+    "vip": "Suscriptores VIP activos",
+    "expiring": f"VIP que vencen en {BROADCAST_EXPIRING_DAYS} días",
+    "free": "Miembros del canal gratuito",
+}
+
+class BroadcastService:
+    # Tareas en curso por id de difusión
+    _tasks = {}
+
+    @staticmethod
+    def segment_condition(segment: str):
+        """Condición SQL sobre User para cada segmento"""
+        now = datetime.datetime.utcnow()
+        if segment == "all":
+            return true()
+        if segment == "free":
+            return User.is_in_free_channel == True
+        if segment == "vip":
+            return is_vip(now)
+        if segment == "expiring":
+            # Rango sobre el índice parcial de vip_until
+            return and_(
+                User.vip_plan_id != None,
+                User.vip_until > now,
+                User.vip_until <= now + datetime.timedelta(days=BROADCAST_EXPIRING_DAYS)
+            )
+        raise ValueError(f"Unknown segment: {segment}")
+
+    @staticmethod
+    async def create_job(segment, text, media_type=None, media_id=None, is_protected=False, created_by=None):
+        BroadcastService.segment_condition(segment)  # Validar el segmento
+        async with get_session() as session:
+            job = BroadcastJob(
+                segment=segment,
+                text=text,
+                media_type=media_type,
+                media_id=media_id,
+                is_protected=is_protected,
+                status="pending",
+                last_user_id=0,
+                sent_count=0,
+                failed_count=0,
+                blocked_count=0,
+                created_by=created_by
+            )
+            session.add(job)
+            await session.commit()
+            return job
+
+    @staticmethod
+    def start_job(bot: Bot, job_id: int):
+        task = BroadcastService._tasks.get(job_id)
+        if task is None or task.done():
+            task = asyncio.create_task(BroadcastService.run_job(bot, job_id))
+            BroadcastService._tasks[job_id] = task
+        return task
+
+    @staticmethod
+    async def resume_jobs(bot: Bot):
+        """Reanuda las difusiones que quedaron a medias tras un reinicio"""
+        async with get_session() as session:
+            result = await session.execute(
+                select(BroadcastJob.id).where(BroadcastJob.status.in_(["pending", "running"]))
+            )
+            job_ids = result.scalars().all()
+
+        for job_id in job_ids:
+            logger.info("Resuming broadcast %s", job_id)
+            BroadcastService.start_job(bot, job_id)
+        return job_ids
+
+    @staticmethod
+    async def cancel_job(job_id: int):
+        async with get_session() as session:
+            await session.execute(
+                update(BroadcastJob)
+                .where(BroadcastJob.id == job_id, BroadcastJob.status.in_(["pending", "running"]))
+                .values(status="cancelled", finished_at=datetime.datetime.utcnow())
+            )
+            await session.commit()
+
+        task = BroadcastService._tasks.pop(job_id, None)
+        if task:
+            task.cancel()
+
+    @staticmethod
+    async def get_job(job_id: int):
+        async with get_session() as session:
+            result = await session.execute(select(BroadcastJob).where(BroadcastJob.id == job_id))
+            return result.scalar_one_or_none()
+
+    @staticmethod
+    async def stop():
+        tasks = list(BroadcastService._tasks.values())
+        BroadcastService._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        # El progreso ya está guardado; las tareas se reanudan al arrancar
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    async def run_job(bot: Bot, job_id: int, chunk_size: int = BROADCAST_CHUNK_SIZE,
+                      concurrency: int = BROADCAST_CONCURRENCY):
+        """
+        Envía la difusión por bloques de destinatarios ordenados por users.id.
+
+        El cursor y los contadores se guardan al terminar cada bloque, de modo
+        que tras una caída solo se repite, como mucho, el bloque en curso.
+        """
+        job = await BroadcastService.get_job(job_id)
+        if job is None or job.status not in ("pending", "running"):
+            return job
+
+        condition = BroadcastService.segment_condition(job.segment)
+        semaphore = asyncio.Semaphore(concurrency)
+        last_user_id = job.last_user_id or 0
+
+        async with get_session() as session:
+            await session.execute(
+                update(BroadcastJob).where(BroadcastJob.id == job_id).values(status="running")
+            )
+            await session.commit()
+
+        async def deliver(telegram_id):
+            async with semaphore:
+                try:
+                    with background_priority():
+                        await MessageService.send_content(
+                            bot, telegram_id,
+                            text=job.text,
+                            media_type=job.media_type,
+                            media_id=job.media_id,
+                            is_protected=job.is_protected
+                        )
+                    return "sent"
+                except TelegramForbiddenError:
+                    # El usuario bloqueó el bot
+                    return "blocked"
+                except TelegramAPIError as e:
+                    logger.warning("Broadcast %s to %s failed: %s", job_id, telegram_id, e)
+                    return "failed"
+
+        while True:
+            async with get_session() as session:
+                result = await session.execute(
+                    select(User.id, User.telegram_id)
+                    .where(User.id > last_user_id, condition)
+                    .order_by(User.id)
+                    .limit(chunk_size)
+                )
+                rows = result.all()
+
+            if not rows:
+                break
+
+            outcomes = await asyncio.gather(*(deliver(row.telegram_id) for row in rows))
+            last_user_id = rows[-1].id
+
+            async with get_session() as session:
+                await session.execute(
+                    update(BroadcastJob)
+                    .where(BroadcastJob.id == job_id)
+                    .values(
+                        last_user_id=last_user_id,
+                        sent_count=BroadcastJob.sent_count + outcomes.count("sent"),
+                        failed_count=BroadcastJob.failed_count + outcomes.count("failed"),
+                        blocked_count=BroadcastJob.blocked_count + outcomes.count("blocked")
+                    )
+                )
+                await session.commit()
+
+        async with get_session() as session:
+            await session.execute(
+                update(BroadcastJob)
+                .where(BroadcastJob.id == job_id, BroadcastJob.status == "running")
+                .values(status="completed", finished_at=datetime.datetime.utcnow())
+            )
+            await session.commit()
+
+        BroadcastService._tasks.pop(job_id, None)
+        job = await BroadcastService.get_job(job_id)
+        logger.info(
+            "Broadcast %s finished: %s sent, %s blocked, %s failed",
+            job_id, job.sent_count, job.blocked_count, job.failed_count
+        )
+
+        if job.created_by:
+            try:
+                await bot.send_message(
+                    chat_id=job.created_by,
+                    text=(
+                        f"📣 Difusión #{job.id} finalizada\n\n"
+                        f"✅ Enviados: {job.sent_count}\n"
+                        f"🚫 Bloqueados: {job.blocked_count}\n"
+                        f"❌ Fallidos: {job.failed_count}"
+                    )
+                )
+            except Exception as e:
+                logger.warning("Could not notify broadcast owner: %s", e)
+        return job
@@ -1,31 +1,112 @@
 # telegram_subscription_bot/services/channel_service.py
-from sqlalchemy import select, update
-from database.db import get_session
+import asyncio
+import logging
+import time
+from sqlalchemy import select, update, or_
+from database.db import get_session, on_commit
 from database.models import User
 from aiogram import Bot
-from config import FREE_CHANNEL_ID, VIP_CHANNEL_ID
+from aiogram.exceptions import TelegramRetryAfter
+from middlewares.request_scheduler import background_priority
+from services.stats_service import StatsService, FREE_MEMBERS
+from utils.cache import TTLCache
+from config import (
+    FREE_CHANNEL_ID, VIP_CHANNEL_ID, MEMBERSHIP_CACHE_SIZE,
+    MEMBERSHIP_POSITIVE_TTL, MEMBERSHIP_NEGATIVE_TTL,
+    RECONCILE_CHUNK_SIZE, RECONCILE_CONCURRENCY, RECONCILE_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
 
 class ChannelService:
+    # Membresía por (channel_id, user_id); las respuestas negativas caducan antes
+    membership_cache = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_POSITIVE_TTL)
+    # Último valor de is_in_free_channel guardado por telegram_id
+    free_status_cache = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_POSITIVE_TTL)
+    # Reconciliación del canal gratuito lanzada desde el panel, como mucho una a la vez
+    _reconcile_task = None
+    
     @staticmethod
-    async def check_user_in_channel(bot: Bot, user_id: int, channel_id: str):
+    async def check_user_in_channel(bot: Bot, user_id: int, channel_id: str, use_cache: bool = True):
+        key = (str(channel_id), user_id)
+        if use_cache:
+            cached = ChannelService.membership_cache.get(key)
+            if cached is not None:
+                return cached
+        
         try:
-            chat_member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-            return chat_member.status not in ['left', 'kicked', 'banned']
+            return await ChannelService.fetch_membership(bot, user_id, channel_id)
         except Exception as e:
-            print(f"Error checking channel membership: {e}")
+            # Los errores no se guardan en caché
+            logger.warning("Error checking channel membership: %s", e)
             return False
     
     @staticmethod
-    async def update_free_channel_status(user_id: int, is_in_channel: bool):
-        async with get_session() as session:
-            user_result = await session.execute(select(User).where(User.telegram_id == user_id))
-            user = user_result.scalar_one_or_none()
-            
-            if user:
-                user.is_in_free_channel = is_in_channel
-                await session.commit()
-                return True
+    async def fetch_membership(bot: Bot, user_id: int, channel_id: str):
+        """Consulta la membresía a Telegram sin caché ni captura de errores"""
+        chat_member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+        is_member = chat_member.status not in ['left', 'kicked', 'banned']
+        ChannelService.set_membership(user_id, channel_id, is_member)
+        return is_member
+    
+    @staticmethod
+    def set_membership(user_id: int, channel_id: str, is_member: bool):
+        ttl = MEMBERSHIP_POSITIVE_TTL if is_member else MEMBERSHIP_NEGATIVE_TTL
+        ChannelService.membership_cache.set((str(channel_id), user_id), is_member, ttl=ttl)
+    
+    @staticmethod
+    def invalidate_membership(user_id: int, channel_id: str = None):
+        """Olvida la membresía cacheada de un usuario (en un canal o en ambos)"""
+        channels = [channel_id] if channel_id is not None else [FREE_CHANNEL_ID, VIP_CHANNEL_ID]
+        for channel in channels:
+            ChannelService.membership_cache.pop((str(channel), user_id))
+    
+    @staticmethod
+    async def update_free_channel_status(user_id: int, is_in_channel: bool, session=None):
+        """
+        Guarda is_in_free_channel solo si cambió. Retorna True si se escribió.
+        
+        Con una sesión recibida escribe en ella sin confirmarla.
+        """
+        if ChannelService.free_status_cache.get(user_id) == is_in_channel:
             return False
+        
+        if session is None:
+            async with get_session() as session:
+                written = await ChannelService.update_free_channel_status(user_id, is_in_channel, session)
+                await session.commit()
+            return written
+        
+        if is_in_channel:
+            changed = or_(User.is_in_free_channel == None, User.is_in_free_channel == False)
+        else:
+            changed = User.is_in_free_channel == True
+        
+        result = await session.execute(
+            update(User)
+            .where(User.telegram_id == user_id, changed)
+            .values(is_in_free_channel=is_in_channel)
+        )
+        await StatsService.increment(
+            session, FREE_MEMBERS, result.rowcount if is_in_channel else -result.rowcount
+        )
+        
+        if result.rowcount > 0:
+            stored = True
+        else:
+            # Sin cambios: cachear solo si la fila existe y ya tiene ese valor; si
+            # aún no se ha registrado al usuario, la inserción pondrá el valor por defecto
+            current = await session.execute(
+                select(User.is_in_free_channel).where(User.telegram_id == user_id)
+            )
+            row = current.first()
+            stored = row is not None and bool(row.is_in_free_channel) == is_in_channel
+        
+        if stored:
+            on_commit(session, lambda: ChannelService.free_status_cache.set(user_id, is_in_channel))
+        else:
+            ChannelService.free_status_cache.pop(user_id)
+        return result.rowcount > 0
     
     @staticmethod
     async def create_channel_invite(bot: Bot, channel_id: str):
@@ -38,7 +119,7 @@ class ChannelService:
             )
             return invite_link.invite_link
         except Exception as e:
-            print(f"Error creating channel invite: {e}")
+            logger.warning("Error creating channel invite: %s", e)
             return None
     
     @staticmethod
@@ -47,30 +128,118 @@ class ChannelService:
             await bot.ban_chat_member(chat_id=channel_id, user_id=user_id)
             # Inmediatamente desbanear para que pueda volver a unirse en el futuro
             await bot.unban_chat_member(chat_id=channel_id, user_id=user_id, only_if_banned=True)
+            ChannelService.set_membership(user_id, channel_id, False)
             return True
         except Exception as e:
-            print(f"Error kicking user from channel: {e}")
+            logger.warning("Error kicking user from channel: %s", e)
             return False
     
     @staticmethod
-    async def get_free_channel_users(bot: Bot):
-        try:
+    async def reconcile_free_channel(bot: Bot, chunk_size: int = RECONCILE_CHUNK_SIZE,
+                                     concurrency: int = RECONCILE_CONCURRENCY, progress_callback=None):
+        """
+        Verifica contra Telegram a los usuarios marcados en el canal gratuito.
+
+        Recorre la tabla por bloques paginados por id, consulta la membresía
+        en paralelo con un límite de concurrencia (pausando todas las
+        consultas ante un RetryAfter) y marca con un UPDATE por bloque a
+        quienes ya no están. Retorna un resumen con el progreso final.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        resume_at = 0.0  # Pausa global impuesta por Telegram
+        stats = {"checked": 0, "left": 0, "errors": 0, "chunks": 0}
+        started = time.monotonic()
+        
+        async def check(telegram_id):
+            nonlocal resume_at
+            async with semaphore:
+                for _ in range(RECONCILE_MAX_RETRIES + 1):
+                    delay = resume_at - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    try:
+                        with background_priority():
+                            return await ChannelService.fetch_membership(bot, telegram_id, FREE_CHANNEL_ID)
+                    except TelegramRetryAfter as e:
+                        resume_at = max(resume_at, time.monotonic() + e.retry_after)
+                    except Exception as e:
+                        logger.warning("Error checking membership of %s: %s", telegram_id, e)
+                        break
+                # En caso de duda no se modifica el estado
+                return None
+        
+        last_id = 0
+        while True:
             async with get_session() as session:
-                query = select(User).where(User.is_in_free_channel == True)
-                result = await session.execute(query)
-                users = result.scalars().all()
-                
-                # Verificar realmente quiénes siguen en el canal
-                verified_users = []
-                for user in users:
-                    is_in_channel = await ChannelService.check_user_in_channel(bot, user.telegram_id, FREE_CHANNEL_ID)
-                    if not is_in_channel:
-                        user.is_in_free_channel = False
-                    else:
-                        verified_users.append(user)
-                
-                await session.commit()
-                return verified_users
-        except Exception as e:
-            print(f"Error getting free channel users: {e}")
-            return []
\ No newline at end of file
+                result = await session.execute(
+                    select(User.id, User.telegram_id)
+                    .where(User.is_in_free_channel == True, User.id > last_id)
+                    .order_by(User.id)
+                    .limit(chunk_size)
+                )
+                rows = result.all()
+            
+            if not rows:
+                break
+            last_id = rows[-1].id
+            
+            results = await asyncio.gather(*(check(row.telegram_id) for row in rows))
+            left_ids = []
+            for row, is_member in zip(rows, results):
+                if is_member is None:
+                    stats["errors"] += 1
+                    continue
+                ChannelService.free_status_cache.set(row.telegram_id, is_member)
+                if not is_member:
+                    left_ids.append(row.telegram_id)
+            
+            if left_ids:
+                async with get_session() as session:
+                    result = await session.execute(
+                        update(User)
+                        .where(User.telegram_id.in_(left_ids), User.is_in_free_channel == True)
+                        .values(is_in_free_channel=False)
+                    )
+                    await StatsService.increment(session, FREE_MEMBERS, -result.rowcount)
+                    await session.commit()
+            
+            stats["checked"] += len(rows)
+            stats["left"] += len(left_ids)
+            stats["chunks"] += 1
+            elapsed = time.monotonic() - started
+            stats["elapsed"] = elapsed
+            stats["rate"] = stats["checked"] / elapsed if elapsed else 0.0
+            
+            logger.info(
+                "Free channel reconciliation: %s checked, %s left, %s errors (%.1f users/s)",
+                stats["checked"], stats["left"], stats["errors"], stats["rate"]
+            )
+            if progress_callback:
+                await progress_callback(dict(stats))
+        
+        stats["elapsed"] = time.monotonic() - started
+        stats["rate"] = stats["checked"] / stats["elapsed"] if stats["elapsed"] else 0.0
+        return stats
+    
+    @staticmethod
+    def start_free_channel_reconciliation(bot: Bot, progress_callback=None):
+        """
+        Lanza reconcile_free_channel en segundo plano. Retorna False si ya
+        hay una en curso. Al terminar llama a progress_callback con el
+        resumen final y done=True.
+        """
+        task = ChannelService._reconcile_task
+        if task is not None and not task.done():
+            return False
+        
+        async def run():
+            try:
+                stats = await ChannelService.reconcile_free_channel(bot, progress_callback=progress_callback)
+            except Exception:
+                logger.exception("Free channel reconciliation failed")
+                stats = {"failed": True}
+            if progress_callback:
+                await progress_callback(dict(stats, done=True))
+        
+        ChannelService._reconcile_task = asyncio.create_task(run())
+        return True
@@ -0,0 +1,246 @@
+# telegram_subscription_bot/services/invite_link_service.py
+import asyncio
+import datetime
+import logging
+from sqlalchemy import select, update, func, or_, and_
+from aiogram import Bot
+
+from database.db import get_session
+from database.models import InviteLink
+from middlewares.request_scheduler import background_priority
+from config import (
+    VIP_CHANNEL_ID, INVITE_POOL_SIZE, INVITE_LINK_TTL, INVITE_LINK_MIN_REMAINING,
+    INVITE_CLAIM_GRACE, INVITE_POOL_REFILL_INTERVAL, INVITE_REVOKE_BATCH_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+class InviteLinkService:
+    """Pool de enlaces de invitación de un solo uso, rellenado en segundo plano"""
+
+    _task = None
+    _refill_event = None
+
+    @staticmethod
+    async def create_link(bot: Bot, channel_id: str):
+        """Crea en Telegram un enlace de un solo uso con caducidad"""
+        expire_date = datetime.datetime.utcnow() + datetime.timedelta(seconds=INVITE_LINK_TTL)
+        invite_link = await bot.create_chat_invite_link(
+            chat_id=channel_id,
+            name="VIP",
+            expire_date=expire_date.replace(tzinfo=datetime.timezone.utc),
+            member_limit=1
+        )
+        return invite_link.invite_link, expire_date
+
+    @staticmethod
+    async def claim_link(bot: Bot, channel_id: str, user_id: int, session=None):
+        """
+        Asigna al usuario un enlace libre del pool.
+
+        Si el pool está vacío crea uno al momento para no dejar al usuario
+        sin acceso, y pide un relleno en segundo plano. Con una sesión
+        recibida el reclamo queda en su transacción, sin confirmarlo.
+        """
+        now = datetime.datetime.utcnow()
+        if session is None:
+            async with get_session() as own_session:
+                link = await InviteLinkService._claim_from_pool(own_session, channel_id, user_id, now)
+                await own_session.commit()
+        else:
+            link = await InviteLinkService._claim_from_pool(session, channel_id, user_id, now)
+
+        InviteLinkService.request_refill()
+        if link:
+            return link
+
+        # Pool vacío: crear el enlace en el camino crítico como último recurso
+        try:
+            link, expire_date = await InviteLinkService.create_link(bot, channel_id)
+        except Exception as e:
+            logger.warning("Error creating channel invite: %s", e)
+            return None
+
+        invite = InviteLink(
+            channel_id=str(channel_id),
+            invite_link=link,
+            expire_date=expire_date,
+            claimed_by=user_id,
+            claimed_at=now
+        )
+        if session is None:
+            async with get_session() as own_session:
+                own_session.add(invite)
+                await own_session.commit()
+        else:
+            session.add(invite)
+        return link
+
+    @staticmethod
+    async def _claim_from_pool(session, channel_id: str, user_id: int, now: datetime.datetime):
+        min_expire = now + datetime.timedelta(seconds=INVITE_LINK_MIN_REMAINING)
+        update_returning = session.get_bind().dialect.update_returning
+        for _ in range(3):
+            candidate = (
+                select(InviteLink.id, InviteLink.invite_link)
+                .where(
+                    InviteLink.channel_id == str(channel_id),
+                    InviteLink.claimed_by == None,
+                    InviteLink.is_revoked == False,
+                    InviteLink.expire_date > min_expire
+                )
+                .order_by(InviteLink.expire_date)
+                .limit(1)
+            )
+            if update_returning:
+                result = await session.execute(
+                    update(InviteLink)
+                    .where(
+                        InviteLink.id == candidate.with_only_columns(InviteLink.id).scalar_subquery(),
+                        InviteLink.claimed_by == None
+                    )
+                    .values(claimed_by=user_id, claimed_at=now)
+                    .returning(InviteLink.invite_link)
+                )
+                link = result.scalar_one_or_none()
+            else:
+                # Sin RETURNING: leer el candidato y reclamarlo solo si sigue libre
+                result = await session.execute(candidate)
+                row = result.one_or_none()
+                link = None
+                if row is not None:
+                    claimed = await session.execute(
+                        update(InviteLink)
+                        .where(InviteLink.id == row.id, InviteLink.claimed_by == None)
+                        .values(claimed_by=user_id, claimed_at=now)
+                    )
+                    if claimed.rowcount == 1:
+                        link = row.invite_link
+            if link:
+                return link
+
+            # Sin candidato o reclamado por otro a la vez: comprobar si queda alguno
+            remaining = await session.execute(
+                select(func.count(InviteLink.id)).where(
+                    InviteLink.channel_id == str(channel_id),
+                    InviteLink.claimed_by == None,
+                    InviteLink.is_revoked == False,
+                    InviteLink.expire_date > min_expire
+                )
+            )
+            if not remaining.scalar():
+                return None
+        return None
+
+    @staticmethod
+    async def refill(bot: Bot, channel_id: str, target: int = INVITE_POOL_SIZE):
+        """Completa el pool del canal hasta target enlaces disponibles"""
+        min_expire = datetime.datetime.utcnow() + datetime.timedelta(seconds=INVITE_LINK_MIN_REMAINING)
+        async with get_session() as session:
+            result = await session.execute(
+                select(func.count(InviteLink.id)).where(
+                    InviteLink.channel_id == str(channel_id),
+                    InviteLink.claimed_by == None,
+                    InviteLink.is_revoked == False,
+                    InviteLink.expire_date > min_expire
+                )
+            )
+            missing = target - result.scalar()
+
+        created = []
+        with background_priority():
+            for _ in range(max(missing, 0)):
+                try:
+                    created.append(await InviteLinkService.create_link(bot, channel_id))
+                except Exception as e:
+                    logger.warning("Could not create pooled invite link for %s: %s", channel_id, e)
+                    break
+
+        if created:
+            async with get_session() as session:
+                session.add_all([
+                    InviteLink(channel_id=str(channel_id), invite_link=link, expire_date=expire_date)
+                    for link, expire_date in created
+                ])
+                await session.commit()
+        return len(created)
+
+    @staticmethod
+    async def revoke_stale(bot: Bot, batch_size: int = INVITE_REVOKE_BATCH_SIZE):
+        """Revoca por lotes los enlaces caducados o reclamados hace tiempo"""
+        now = datetime.datetime.utcnow()
+        claimed_before = now - datetime.timedelta(seconds=INVITE_CLAIM_GRACE)
+        # Los enlaces libres que ya no duran lo suficiente tampoco se van a repartir
+        min_expire = now + datetime.timedelta(seconds=INVITE_LINK_MIN_REMAINING)
+
+        async with get_session() as session:
+            result = await session.execute(
+                select(InviteLink.id, InviteLink.channel_id, InviteLink.invite_link, InviteLink.expire_date)
+                .where(
+                    InviteLink.is_revoked == False,
+                    or_(
+                        InviteLink.expire_date <= now,
+                        InviteLink.claimed_at <= claimed_before,
+                        and_(InviteLink.claimed_by == None, InviteLink.expire_date <= min_expire)
+                    )
+                )
+                .limit(batch_size)
+            )
+            rows = result.all()
+
+        revoked_ids = []
+        with background_priority():
+            for row in rows:
+                if row.expire_date > now:
+                    try:
+                        await bot.revoke_chat_invite_link(chat_id=row.channel_id, invite_link=row.invite_link)
+                    except Exception as e:
+                        logger.warning("Could not revoke invite link %s: %s", row.id, e)
+                # Los caducados ya no sirven; basta con marcarlos
+                revoked_ids.append(row.id)
+
+        if revoked_ids:
+            async with get_session() as session:
+                await session.execute(
+                    update(InviteLink).where(InviteLink.id.in_(revoked_ids)).values(is_revoked=True)
+                )
+                await session.commit()
+        return len(revoked_ids)
+
+    @staticmethod
+    def request_refill():
+        if InviteLinkService._refill_event is not None:
+            InviteLinkService._refill_event.set()
+
+    @staticmethod
+    async def start(bot: Bot, channel_ids=None):
+        channel_ids = channel_ids or [VIP_CHANNEL_ID]
+        InviteLinkService._refill_event = asyncio.Event()
+        InviteLinkService._task = asyncio.create_task(InviteLinkService._run(bot, channel_ids))
+
+    @staticmethod
+    async def stop():
+        task, InviteLinkService._task = InviteLinkService._task, None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    @staticmethod
+    async def _run(bot: Bot, channel_ids):
+        event = InviteLinkService._refill_event
+        while True:
+            try:
+                await InviteLinkService.revoke_stale(bot)
+                for channel_id in channel_ids:
+                    await InviteLinkService.refill(bot, channel_id)
+            except Exception:
+                logger.exception("Invite link pool maintenance failed")
+
+            try:
+                await asyncio.wait_for(event.wait(), timeout=INVITE_POOL_REFILL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
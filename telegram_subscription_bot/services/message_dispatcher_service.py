@@ -0,0 +1,211 @@
+# telegram_subscription_bot/services/message_dispatcher_service.py
+import asyncio
+import datetime
+import json
+import logging
+from sqlalchemy import select, update, func
+from aiogram import Bot
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from database.db import get_session
+from database.models import User, ScheduledMessage
+from middlewares.request_scheduler import background_priority
+from services.message_service import MessageService
+from utils.helpers import parse_buttons_json, recurrence_to_crontab, next_cron_fire_time
+from utils.metrics import registry
+from config import (
+    DISPATCH_MAX_SLEEP, DISPATCH_BATCH_SIZE, DISPATCH_CATCHUP_POLICY, DISPATCH_MISFIRE_GRACE
+)
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_LAG_SECONDS = registry.histogram(
+    "scheduler_message_lag_seconds", "Retraso entre la hora programada y el envío del mensaje"
+)
+
+class MessageDispatcherService:
+    """
+    Envía los mensajes programados cuando llega su next_run_at.
+
+    Cada vuelta selecciona los mensajes vencidos con una consulta sobre el
+    índice parcial de next_run_at, y para los recurrentes precalcula el
+    siguiente disparo a partir de su expresión cron.
+    """
+
+    # Instancia en ejecución, para despertarla al programar un mensaje
+    _instance = None
+
+    def __init__(self, bot: Bot, catchup_policy: str = DISPATCH_CATCHUP_POLICY,
+                 misfire_grace: int = DISPATCH_MISFIRE_GRACE, batch_size: int = DISPATCH_BATCH_SIZE):
+        self.bot = bot
+        self.catchup_policy = catchup_policy
+        self.misfire_grace = datetime.timedelta(seconds=misfire_grace)
+        self.batch_size = batch_size
+        self._wakeup = None
+        self._task = None
+
+    @staticmethod
+    async def schedule_message(channel_id, scheduled_time, text=None, media_type=None, media_id=None,
+                               is_protected=False, buttons=None, recurring_pattern=None, created_by=None):
+        """Guarda un mensaje programado; created_by es el telegram_id del administrador"""
+        async with get_session() as session:
+            creator_id = None
+            if created_by is not None:
+                result = await session.execute(select(User.id).where(User.telegram_id == created_by))
+                creator_id = result.scalar_one_or_none()
+
+            message = ScheduledMessage(
+                channel_id=str(channel_id),
+                text=text,
+                media_type=media_type,
+                media_id=media_id,
+                is_protected=is_protected,
+                has_buttons=bool(buttons),
+                buttons_json=json.dumps(buttons) if buttons else None,
+                scheduled_time=scheduled_time,
+                is_recurring=bool(recurring_pattern),
+                recurring_pattern=recurrence_to_crontab(recurring_pattern, scheduled_time) if recurring_pattern else None,
+                created_by=creator_id,
+                next_run_at=scheduled_time,
+                is_active=True
+            )
+            session.add(message)
+            await session.commit()
+
+        MessageDispatcherService.notify()
+        return message
+
+    @staticmethod
+    async def cancel_message(message_id: int):
+        async with get_session() as session:
+            await session.execute(
+                update(ScheduledMessage).where(ScheduledMessage.id == message_id).values(is_active=False)
+            )
+            await session.commit()
+
+    @staticmethod
+    def notify():
+        instance = MessageDispatcherService._instance
+        if instance is not None and instance._wakeup is not None:
+            instance._wakeup.set()
+
+    async def start(self):
+        MessageDispatcherService._instance = self
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if MessageDispatcherService._instance is self:
+            MessageDispatcherService._instance = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _next_run(self, message, now: datetime.datetime):
+        """Calcula el siguiente next_run_at según la política de recuperación"""
+        if not message.is_recurring or not message.recurring_pattern:
+            return None
+        if self.catchup_policy == "all":
+            # Cada disparo perdido se envía en vueltas sucesivas
+            return next_cron_fire_time(message.recurring_pattern, message.next_run_at)
+        return next_cron_fire_time(message.recurring_pattern, now)
+
+    async def _run(self):
+        while True:
+            try:
+                if await self.dispatch_due() >= self.batch_size:
+                    # Puede haber más vencidos: seguir sin dormir
+                    continue
+                timeout = await self._seconds_until_next()
+            except Exception:
+                logger.exception("Error dispatching scheduled messages")
+                timeout = DISPATCH_MAX_SLEEP
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _seconds_until_next(self):
+        async with get_session() as session:
+            result = await session.execute(
+                select(func.min(ScheduledMessage.next_run_at)).where(ScheduledMessage.is_active == True)
+            )
+            next_run_at = result.scalar()
+
+        if next_run_at is None:
+            return DISPATCH_MAX_SLEEP
+        seconds = (next_run_at - datetime.datetime.utcnow()).total_seconds()
+        return min(max(seconds, 0), DISPATCH_MAX_SLEEP)
+
+    async def dispatch_due(self):
+        """Envía un lote de mensajes vencidos y retorna cuántos se procesaron"""
+        now = datetime.datetime.utcnow()
+
+        async with get_session() as session:
+            result = await session.execute(
+                select(ScheduledMessage)
+                .where(ScheduledMessage.is_active == True, ScheduledMessage.next_run_at <= now)
+                .order_by(ScheduledMessage.next_run_at)
+                .limit(self.batch_size)
+            )
+            messages = result.scalars().all()
+
+        for message in messages:
+            next_run_at = self._next_run(message, now)
+            late = now - message.next_run_at > self.misfire_grace
+            send = not (late and self.catchup_policy == "skip")
+
+            # Reclamar el disparo antes de enviar para que otro proceso no lo repita
+            async with get_session() as session:
+                claimed = await session.execute(
+                    update(ScheduledMessage)
+                    .where(
+                        ScheduledMessage.id == message.id,
+                        ScheduledMessage.next_run_at == message.next_run_at,
+                        ScheduledMessage.is_active == True
+                    )
+                    .values(
+                        next_run_at=next_run_at,
+                        is_active=next_run_at is not None,
+                        last_run_at=now if send else message.last_run_at
+                    )
+                )
+                await session.commit()
+
+            if claimed.rowcount != 1 or not send:
+                continue
+            DISPATCH_LAG_SECONDS.observe((datetime.datetime.utcnow() - message.next_run_at).total_seconds())
+
+            try:
+                with background_priority():
+                    await MessageService.send_content(
+                        self.bot, message.channel_id,
+                        text=message.text,
+                        media_type=message.media_type,
+                        media_id=message.media_id,
+                        is_protected=message.is_protected,
+                        reply_markup=self._build_markup(message)
+                    )
+            except Exception as e:
+                logger.warning("Could not send scheduled message %s: %s", message.id, e)
+
+        return len(messages)
+
+    @staticmethod
+    def _build_markup(message):
+        if not message.has_buttons or not message.buttons_json:
+            return None
+
+        builder = InlineKeyboardBuilder()
+        rows = parse_buttons_json(message.buttons_json)
+        for row in rows:
+            for button in row:
+                builder.button(text=button["text"], url=button["url"])
+        builder.adjust(*[len(row) for row in rows] or [1])
+        return builder.as_markup()
@@ -0,0 +1,40 @@
+# telegram_subscription_bot/services/message_service.py
+from aiogram import Bot
+
+class MessageService:
+    @staticmethod
+    async def send_content(bot: Bot, chat_id, text=None, media_type=None, media_id=None,
+                           is_protected=False, reply_markup=None):
+        """Envía texto o un archivo multimedia con su texto como pie"""
+        if media_type in (None, "none") or not media_id:
+            return await bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                protect_content=is_protected,
+                reply_markup=reply_markup
+            )
+        elif media_type == "photo":
+            return await bot.send_photo(
+                chat_id=chat_id,
+                photo=media_id,
+                caption=text,
+                protect_content=is_protected,
+                reply_markup=reply_markup
+            )
+        elif media_type == "video":
+            return await bot.send_video(
+                chat_id=chat_id,
+                video=media_id,
+                caption=text,
+                protect_content=is_protected,
+                reply_markup=reply_markup
+            )
+        elif media_type == "document":
+            return await bot.send_document(
+                chat_id=chat_id,
+                document=media_id,
+                caption=text,
+                protect_content=is_protected,
+                reply_markup=reply_markup
+            )
+        raise ValueError(f"Unsupported media type: {media_type}")
@@ -0,0 +1,71 @@
+# telegram_subscription_bot/services/metrics_service.py
+import logging
+import time
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from utils.metrics import registry
+from config import METRICS_HOST, METRICS_PORT, METRICS_PATH
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+FSM_STATES = registry.gauge("fsm_states", "Usuarios en cada estado FSM", ("state",))
+UPTIME_SECONDS = registry.gauge("process_uptime_seconds", "Segundos desde que arrancó el bot")
+
+class MetricsService:
+    """Servidor aiohttp local que expone las métricas en formato de texto de Prometheus"""
+
+    def __init__(self, storage: Optional[BaseStorage] = None, host: str = METRICS_HOST,
+                 port: int = METRICS_PORT, path: str = METRICS_PATH):
+        self.storage = storage
+        self.host = host
+        self.port = port
+        self.path = path
+        self.started_at = time.monotonic()
+        self.app = web.Application()
+        self.app.router.add_get(path, self.handle_metrics)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def collect_fsm_states(self):
+        if self.storage is None:
+            return
+        if isinstance(self.storage, MemoryStorage):
+            counts = Counter(record.state for record in self.storage.storage.values() if record.state)
+        elif hasattr(self.storage, "count_states"):
+            counts = await self.storage.count_states()
+        else:
+            return
+
+        # Los estados que ya nadie tiene desaparecen de la serie
+        FSM_STATES.clear()
+        for state, count in counts.items():
+            FSM_STATES.set(count, state=state)
+
+    async def collect_uptime(self):
+        UPTIME_SECONDS.set(round(time.monotonic() - self.started_at, 3))
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        await registry.collect()
+        return web.Response(text=registry.render(), headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self):
+        registry.add_collector(self.collect_fsm_states)
+        registry.add_collector(self.collect_uptime)
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info("Metrics server listening on %s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self):
+        registry.remove_collector(self.collect_fsm_states)
+        registry.remove_collector(self.collect_uptime)
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,216 @@
+# telegram_subscription_bot/services/scheduler_service.py
+import asyncio
+import datetime
+import heapq
+import logging
+from sqlalchemy import select, update, or_, and_, func
+from aiogram import Bot
+
+from database.db import get_session
+from database.models import User, Subscription
+from database.vip_status import refresh_vip_status
+from middlewares.request_scheduler import background_priority
+from services.channel_service import ChannelService
+from services.stats_service import StatsService, vip_active_key
+from utils.metrics import registry
+from config import (
+    VIP_CHANNEL_ID, DEFAULT_CANCELLATION_MESSAGE, EXPIRY_LOAD_HORIZON,
+    EXPIRY_LOAD_CHUNK_SIZE, EXPIRY_BATCH_SIZE, EXPIRY_NOTIFY_USERS,
+    EXPIRY_RETRY_DELAY, EXPIRY_RETRY_MAX_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_LAG_SECONDS = registry.histogram(
+    "scheduler_expiry_lag_seconds", "Retraso entre el end_date y la expiración efectiva"
+)
+EXPIRY_PENDING = registry.gauge("scheduler_expiry_pending", "Vencimientos cargados en el montículo")
+
+class SchedulerService:
+    """
+    Motor de expiración de suscripciones.
+
+    Mantiene un montículo con los end_date próximos, cargado por tramos
+    desde la base de datos, y duerme exactamente hasta el siguiente
+    vencimiento. Las suscripciones nuevas se añaden con track_subscription
+    sin volver a recorrer la tabla.
+    """
+
+    # Instancia en ejecución, para que los servicios puedan notificarle
+    _instance = None
+
+    def __init__(self, bot: Bot, horizon: int = EXPIRY_LOAD_HORIZON,
+                 load_chunk_size: int = EXPIRY_LOAD_CHUNK_SIZE, batch_size: int = EXPIRY_BATCH_SIZE):
+        self.bot = bot
+        self.horizon = datetime.timedelta(seconds=horizon)
+        self.load_chunk_size = load_chunk_size
+        self.batch_size = batch_size
+        self._heap = []  # (end_date, subscription_id)
+        # Todo lo activo con (end_date, id) <= cursor está ya en el montículo
+        self._cursor = (datetime.datetime.min, 0)
+        # Hay más vencimientos dentro del horizonte sin cargar
+        self._more = False
+        # Fallos seguidos al expirar, para espaciar los reintentos
+        self._failures = 0
+        self._wakeup = None
+        self._task = None
+
+    async def start(self):
+        SchedulerService._instance = self
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if SchedulerService._instance is self:
+            SchedulerService._instance = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @staticmethod
+    def track_subscription(subscription):
+        """Registra una suscripción recién creada en el motor en ejecución"""
+        instance = SchedulerService._instance
+        if instance is not None and subscription.end_date is not None:
+            instance.schedule(subscription.id, subscription.end_date)
+
+    def schedule(self, subscription_id: int, end_date: datetime.datetime):
+        # Las posteriores al cursor llegarán con la siguiente carga
+        if (end_date, subscription_id) <= self._cursor:
+            heapq.heappush(self._heap, (end_date, subscription_id))
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def _load_next_chunk(self, now: datetime.datetime):
+        """Carga el siguiente tramo de vencimientos dentro del horizonte"""
+        until = now + self.horizon
+        last_end, last_id = self._cursor
+
+        async with get_session() as session:
+            result = await session.execute(
+                select(Subscription.id, Subscription.end_date)
+                .where(
+                    Subscription.is_active == True,
+                    Subscription.end_date != None,
+                    Subscription.end_date <= until,
+                    or_(
+                        Subscription.end_date > last_end,
+                        and_(Subscription.end_date == last_end, Subscription.id > last_id)
+                    )
+                )
+                .order_by(Subscription.end_date, Subscription.id)
+                .limit(self.load_chunk_size)
+            )
+            rows = result.all()
+
+        for row in rows:
+            heapq.heappush(self._heap, (row.end_date, row.id))
+
+        self._more = len(rows) == self.load_chunk_size
+        if self._more:
+            # Quedan más dentro del horizonte: el cursor avanza hasta la última fila
+            self._cursor = (rows[-1].end_date, rows[-1].id)
+        else:
+            self._cursor = (until, 0)
+
+    async def _run(self):
+        while True:
+            now = datetime.datetime.utcnow()
+
+            # Cargar otro tramo cuando el horizonte se acerca o el montículo se vacía
+            needs_load = self._more and len(self._heap) < self.load_chunk_size
+            if needs_load or (not self._more and self._cursor[0] < now + self.horizon / 2):
+                try:
+                    await self._load_next_chunk(now)
+                except Exception:
+                    logger.exception("Error loading upcoming expirations")
+                    await asyncio.sleep(5)
+                continue
+
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                due.append(heapq.heappop(self._heap))
+            EXPIRY_PENDING.set(len(self._heap))
+
+            if due:
+                try:
+                    await self.expire_subscriptions([subscription_id for _, subscription_id in due])
+                except Exception:
+                    # El cursor ya pasó por ellas: volver a encolarlas o no se cargarían de nuevo
+                    self._failures += 1
+                    delay = min(EXPIRY_RETRY_DELAY * 2 ** (self._failures - 1), EXPIRY_RETRY_MAX_DELAY)
+                    logger.exception("Error expiring subscriptions, retrying %s in %ss", len(due), delay)
+                    retry_at = now + datetime.timedelta(seconds=delay)
+                    for _, subscription_id in due:
+                        heapq.heappush(self._heap, (retry_at, subscription_id))
+                else:
+                    self._failures = 0
+                    for end_date, _ in due:
+                        EXPIRY_LAG_SECONDS.observe((now - end_date).total_seconds())
+                continue
+
+            # Dormir hasta el siguiente vencimiento, la próxima carga o un aviso
+            next_wake = None if self._more else self._cursor[0] - self.horizon / 2
+            if self._heap:
+                next_wake = self._heap[0][0] if next_wake is None else min(next_wake, self._heap[0][0])
+            timeout = max((next_wake - datetime.datetime.utcnow()).total_seconds(), 0)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def expire_subscriptions(self, subscription_ids):
+        """Desactiva las suscripciones vencidas y expulsa a quien se queda sin VIP"""
+        now = datetime.datetime.utcnow()
+
+        async with get_session() as session:
+            # Volver a comprobar la fecha por si la suscripción cambió entretanto
+            expired_filter = and_(
+                Subscription.id.in_(subscription_ids),
+                Subscription.is_active == True,
+                Subscription.end_date != None,
+                Subscription.end_date <= now
+            )
+            result = await session.execute(
+                select(Subscription.user_id).where(expired_filter).distinct()
+            )
+            user_ids = result.scalars().all()
+
+            if not user_ids:
+                return 0
+
+            result = await session.execute(
+                select(Subscription.plan_id, func.count(Subscription.id))
+                .where(expired_filter)
+                .group_by(Subscription.plan_id)
+            )
+            await StatsService.increment_many(
+                session, {vip_active_key(plan_id): -count for plan_id, count in result.all()}
+            )
+            await session.execute(update(Subscription).where(expired_filter).values(is_active=False))
+
+            # Recalcular el estado VIP; solo se expulsa a quien se queda sin plan
+            await session.execute(refresh_vip_status(now, user_ids))
+            result = await session.execute(
+                select(User.telegram_id).where(User.id.in_(user_ids), User.vip_plan_id == None)
+            )
+            telegram_ids = result.scalars().all()
+            await session.commit()
+
+        with background_priority():
+            for telegram_id in telegram_ids:
+                await ChannelService.kick_user_from_channel(self.bot, telegram_id, VIP_CHANNEL_ID)
+                if EXPIRY_NOTIFY_USERS:
+                    try:
+                        await self.bot.send_message(chat_id=telegram_id, text=DEFAULT_CANCELLATION_MESSAGE)
+                    except Exception as e:
+                        logger.info("Could not notify %s about expiry: %s", telegram_id, e)
+
+        logger.info("Expired %s subscriptions, removed %s users from VIP", len(subscription_ids), len(telegram_ids))
+        return len(telegram_ids)
@@ -0,0 +1,187 @@
+# telegram_subscription_bot/services/stats_service.py
+import asyncio
+import datetime
+import logging
+from sqlalchemy import select, func, delete
+
+from database.db import get_session, IS_SQLITE
+from database.models import User, Subscription, Token, Statistic
+from database.vip_status import refresh_vip_status
+from config import STATS_RECONCILE_INTERVAL, STATS_EXPIRING_INTERVAL
+
+if IS_SQLITE:
+    from sqlalchemy.dialects.sqlite import insert
+else:
+    from sqlalchemy.dialects.postgresql import insert
+
+logger = logging.getLogger(__name__)
+
+USERS_TOTAL = "users_total"
+FREE_MEMBERS = "free_members"
+TOKENS_GENERATED = "tokens_generated"
+TOKENS_USED = "tokens_used"
+EXPIRING_24H = "expiring_24h"
+EXPIRING_7D = "expiring_7d"
+VIP_ACTIVE_PREFIX = "vip_active:"
+
+def vip_active_key(plan_id) -> str:
+    return f"{VIP_ACTIVE_PREFIX}{plan_id}"
+
+class StatsService:
+    """
+    Contadores de estadísticas guardados en la tabla statistics.
+
+    Los servicios suman sus cambios con increment dentro de su propia
+    transacción; la reconciliación recalcula los valores exactos de vez en
+    cuando y los contadores de vencimientos, que dependen de la hora.
+    """
+
+    _task = None
+
+    @staticmethod
+    async def increment(session, key: str, delta: int = 1):
+        """Suma delta al contador dentro de la sesión recibida, sin confirmarla"""
+        if delta:
+            await StatsService.increment_many(session, {key: delta})
+
+    @staticmethod
+    async def increment_many(session, deltas: dict):
+        rows = [
+            {"key": key, "value": delta, "updated_at": datetime.datetime.utcnow()}
+            for key, delta in deltas.items() if delta
+        ]
+        if not rows:
+            return
+
+        stmt = insert(Statistic)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Statistic.key],
+                set_={"value": Statistic.value + stmt.excluded.value, "updated_at": stmt.excluded.updated_at}
+            ),
+            rows
+        )
+
+    @staticmethod
+    async def set_values(session, values: dict):
+        rows = [
+            {"key": key, "value": value, "updated_at": datetime.datetime.utcnow()}
+            for key, value in values.items()
+        ]
+        if not rows:
+            return
+
+        stmt = insert(Statistic)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Statistic.key],
+                set_={"value": stmt.excluded.value, "updated_at": stmt.excluded.updated_at}
+            ),
+            rows
+        )
+
+    @staticmethod
+    async def get_all():
+        """Lee todos los contadores: una consulta sobre una tabla de pocas filas"""
+        async with get_session() as session:
+            result = await session.execute(select(Statistic.key, Statistic.value, Statistic.updated_at))
+            rows = result.all()
+
+        counters = {row.key: row.value for row in rows}
+        updated_at = max((row.updated_at for row in rows), default=None)
+        return counters, updated_at
+
+    @staticmethod
+    async def refresh_expiring(session=None):
+        """Recalcula los vencimientos próximos con rangos sobre el índice parcial de vip_until"""
+        if session is None:
+            async with get_session() as session:
+                await StatsService.refresh_expiring(session)
+                await session.commit()
+            return
+
+        now = datetime.datetime.utcnow()
+        values = {}
+        for key, window in ((EXPIRING_24H, datetime.timedelta(days=1)), (EXPIRING_7D, datetime.timedelta(days=7))):
+            result = await session.execute(
+                select(func.count(User.id)).where(
+                    User.vip_plan_id != None,
+                    User.vip_until > now,
+                    User.vip_until <= now + window
+                )
+            )
+            values[key] = result.scalar()
+        await StatsService.set_values(session, values)
+
+    @staticmethod
+    async def reconcile():
+        """Recalcula todos los contadores desde las tablas de origen"""
+        async with get_session() as session:
+            # Reparar el estado VIP desnormalizado antes de contar sobre él
+            repaired = await session.execute(refresh_vip_status())
+            if repaired.rowcount:
+                logger.warning("Repaired VIP status for %s users", repaired.rowcount)
+
+            values = {}
+            values[USERS_TOTAL] = (await session.execute(select(func.count(User.id)))).scalar()
+            values[FREE_MEMBERS] = (await session.execute(
+                select(func.count(User.id)).where(User.is_in_free_channel == True)
+            )).scalar()
+            values[TOKENS_GENERATED] = (await session.execute(select(func.count(Token.id)))).scalar()
+            values[TOKENS_USED] = (await session.execute(
+                select(func.count(Token.id)).where(Token.is_used == True)
+            )).scalar()
+
+            result = await session.execute(
+                select(Subscription.plan_id, func.count(Subscription.id))
+                .where(Subscription.is_active == True)
+                .group_by(Subscription.plan_id)
+            )
+            for plan_id, count in result.all():
+                values[vip_active_key(plan_id)] = count
+
+            # Planes que ya no tienen suscripciones activas
+            await session.execute(
+                delete(Statistic).where(
+                    Statistic.key.startswith(VIP_ACTIVE_PREFIX),
+                    Statistic.key.notin_(list(values))
+                )
+            )
+            await StatsService.set_values(session, values)
+            await StatsService.refresh_expiring(session)
+            await session.commit()
+
+        logger.info("Statistics reconciled")
+        return values
+
+    @staticmethod
+    async def start():
+        StatsService._task = asyncio.create_task(StatsService._run())
+
+    @staticmethod
+    async def stop():
+        task, StatsService._task = StatsService._task, None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    @staticmethod
+    async def _run():
+        # Base de datos sin contadores todavía: reconciliar al arrancar
+        counters, _ = await StatsService.get_all()
+        last_reconcile = None if USERS_TOTAL not in counters else asyncio.get_running_loop().time()
+
+        while True:
+            now = asyncio.get_running_loop().time()
+            try:
+                if last_reconcile is None or now - last_reconcile >= STATS_RECONCILE_INTERVAL:
+                    await StatsService.reconcile()
+                    last_reconcile = now
+                else:
+                    await StatsService.refresh_expiring()
+            except Exception:
+                logger.exception("Error refreshing statistics")
+            await asyncio.sleep(STATS_EXPIRING_INTERVAL)
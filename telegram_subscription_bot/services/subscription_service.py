@@ -1,8 +1,48 @@
 # telegram_subscription_bot/services/subscription_service.py
 import datetime
-from sqlalchemy import select, update
-from database.db import get_session
+import time
+from typing import NamedTuple, Optional
+from sqlalchemy import select, update, func, and_, or_
+from database.db import get_session, on_commit
 from database.models import User, Subscription, SubscriptionPlan
+from database.vip_status import refresh_vip_status
+from services.scheduler_service import SchedulerService
+from services.stats_service import StatsService, vip_active_key
+from utils.helpers import format_plan_duration
+from config import PLAN_CATALOG_TTL, VIP_PAGE_SIZE
+
+class AlreadyPermanentError(Exception):
+    """El usuario ya tiene una suscripción permanente: no hay nada que activar"""
+
+class PlanInfo(NamedTuple):
+    """Copia inmutable de un plan tal como está en el catálogo"""
+    id: int
+    name: str
+    duration_days: int
+    price: float
+    is_permanent: bool
+    duration_text: str
+
+class SubscriptionStatus(NamedTuple):
+    """Estado de suscripción de un usuario, leído en una sola consulta"""
+    user_id: int
+    telegram_id: int
+    is_active: bool
+    plan_id: Optional[int]
+    plan_name: Optional[str]
+    end_date: Optional[datetime.datetime]
+    days_left: Optional[int]
+    
+    @property
+    def is_permanent(self) -> bool:
+        return self.is_active and self.end_date is None
+
+class PlanCatalog:
+    """Catálogo de planes en memoria, versionado en cada recarga"""
+    version = 0
+    plans = ()
+    by_id = {}
+    loaded_at = None
 
 class SubscriptionService:
     @staticmethod
@@ -16,67 +56,319 @@ class SubscriptionService:
             )
             session.add(plan)
             await session.commit()
-            return plan
+        
+        # Cualquier cambio en los planes invalida el catálogo
+        await SubscriptionService.load_plan_catalog()
+        return plan
     
     @staticmethod
-    async def get_subscription_plans():
+    async def load_plan_catalog():
         async with get_session() as session:
-            result = await session.execute(select(SubscriptionPlan))
-            return result.scalars().all()
+            result = await session.execute(select(SubscriptionPlan).order_by(SubscriptionPlan.id))
+            plans = tuple(
+                PlanInfo(
+                    id=plan.id,
+                    name=plan.name,
+                    duration_days=plan.duration_days,
+                    price=plan.price,
+                    is_permanent=bool(plan.is_permanent),
+                    duration_text=format_plan_duration(plan.duration_days, plan.is_permanent)
+                )
+                for plan in result.scalars()
+            )
+        
+        PlanCatalog.plans = plans
+        PlanCatalog.by_id = {plan.id: plan for plan in plans}
+        PlanCatalog.version += 1
+        PlanCatalog.loaded_at = time.monotonic()
+        return plans
     
     @staticmethod
-    async def subscribe_user(user_id, plan_id):
-        async with get_session() as session:
-            # Obtener plan
-            plan_result = await session.execute(select(SubscriptionPlan).where(SubscriptionPlan.id == plan_id))
-            plan = plan_result.scalar_one_or_none()
-            
-            if not plan:
-                return None
-            
-            # Obtener usuario
-            user_result = await session.execute(select(User).where(User.telegram_id == user_id))
-            user = user_result.scalar_one_or_none()
-            
-            if not user:
-                return None
-            
+    async def _ensure_plan_catalog():
+        loaded_at = PlanCatalog.loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > PLAN_CATALOG_TTL:
+            await SubscriptionService.load_plan_catalog()
+    
+    @staticmethod
+    async def get_subscription_plans():
+        await SubscriptionService._ensure_plan_catalog()
+        return PlanCatalog.plans
+    
+    @staticmethod
+    async def get_plan(plan_id):
+        await SubscriptionService._ensure_plan_catalog()
+        return PlanCatalog.by_id.get(plan_id)
+    
+    @staticmethod
+    async def subscribe_user(user_id, plan_id, session=None):
+        if session is None:
+            async with get_session() as session:
+                subscription = await SubscriptionService.subscribe_user(user_id, plan_id, session)
+                if subscription:
+                    await session.commit()
+            return subscription
+        
+        return await SubscriptionService.add_subscription(session, user_id, plan_id)
+    
+    @staticmethod
+    def is_permanent_vip(user) -> bool:
+        """Según las columnas desnormalizadas del usuario"""
+        return user is not None and user.vip_plan_id is not None and user.vip_until is None
+    
+    @staticmethod
+    async def add_subscription(session, user_id, plan_id, user=None):
+        """
+        Activa el plan dentro de la sesión recibida, sin confirmarla.
+        
+        Si el usuario ya es VIP la suscripción vigente se renueva: el plan
+        nuevo se suma al tiempo que le queda (o la vuelve permanente) en
+        lugar de crear otra en paralelo. vip_until y vip_plan_id del usuario
+        se actualizan en la misma transacción. Si ya es permanente lanza
+        AlreadyPermanentError sin tocar nada.
+        """
+        # El plan sale del catálogo; solo se consulta el usuario si no viene cargado
+        plan = await SubscriptionService.get_plan(plan_id)
+        
+        if not plan:
+            return None
+        
+        if user is None:
+            result = await session.execute(select(User).where(User.telegram_id == user_id))
+            user = result.scalar_one_or_none()
+        
+        if user is None:
+            return None
+        
+        if SubscriptionService.is_permanent_vip(user):
+            raise AlreadyPermanentError(user_id)
+        
+        now = datetime.datetime.utcnow()
+        subscription = None
+        if user.vip_plan_id is not None and (user.vip_until is None or user.vip_until > now):
+            result = await session.execute(
+                select(Subscription)
+                .where(
+                    Subscription.user_id == user.id,
+                    Subscription.is_active == True,
+                    or_(Subscription.end_date == None, Subscription.end_date > now)
+                )
+                .order_by(Subscription.end_date.is_(None).desc(), Subscription.end_date.desc())
+                .limit(1)
+            )
+            subscription = result.scalar_one_or_none()
+            if subscription is not None and subscription.end_date is None:
+                # Columnas desfasadas: la suscripción vigente ya es permanente
+                raise AlreadyPermanentError(user_id)
+        
+        if subscription is not None:
+            # Renovación: el tiempo nuevo se suma al que queda
+            previous_plan_id = subscription.plan_id
+            subscription.plan_id = plan.id
+            if plan.is_permanent:
+                subscription.end_date = None
+            else:
+                subscription.end_date = subscription.end_date + datetime.timedelta(days=plan.duration_days)
+            if previous_plan_id != plan.id:
+                await StatsService.increment_many(
+                    session, {vip_active_key(previous_plan_id): -1, vip_active_key(plan.id): 1}
+                )
+        else:
             # Calcular fecha de finalización
-            end_date = None if plan.is_permanent else datetime.datetime.utcnow() + datetime.timedelta(days=plan.duration_days)
+            end_date = None if plan.is_permanent else now + datetime.timedelta(days=plan.duration_days)
             
             # Crear suscripción
             subscription = Subscription(
                 user_id=user.id,
                 plan_id=plan.id,
-                start_date=datetime.datetime.utcnow(),
+                start_date=now,
                 end_date=end_date,
                 is_active=True
             )
-            
             session.add(subscription)
-            await session.commit()
-            return subscription
+            await StatsService.increment(session, vip_active_key(plan.id))
+        
+        user.vip_plan_id = plan.id
+        user.vip_until = subscription.end_date
+        # Avisar al motor de expiración sin recorrer la tabla, una vez confirmada
+        on_commit(session, lambda: SchedulerService.track_subscription(subscription))
+        return subscription
     
     @staticmethod
-    async def get_active_subscription(user_id):
-        async with get_session() as session:
-            # Obtener usuario
+    async def get_active_subscription(user_id, session=None, user=None):
+        if session is None:
+            async with get_session() as session:
+                return await SubscriptionService.get_active_subscription(user_id, session)
+        
+        # Obtener usuario, salvo que ya venga cargado
+        if user is None:
             user_result = await session.execute(select(User).where(User.telegram_id == user_id))
             user = user_result.scalar_one_or_none()
+        
+        if not user:
+            return None
+        
+        # Obtener suscripción activa
+        now = datetime.datetime.utcnow()
+        subscription_query = select(Subscription).where(
+            Subscription.user_id == user.id,
+            Subscription.is_active == True,
+            (Subscription.end_date == None) | (Subscription.end_date > now)
+        )
+        
+        subscription_result = await session.execute(subscription_query)
+        return subscription_result.scalar_one_or_none()
+    
+    @staticmethod
+    async def get_subscription_status(user_id, session=None) -> Optional[SubscriptionStatus]:
+        """
+        Usuario, plan vigente y días restantes leyendo una sola fila.
+        
+        Usa las columnas vip_plan_id y vip_until de users, así que no toca
+        la tabla de suscripciones. Retorna None si el usuario no existe.
+        """
+        if session is None:
+            async with get_session() as session:
+                return await SubscriptionService.get_subscription_status(user_id, session)
+        
+        now = datetime.datetime.utcnow()
+        result = await session.execute(
+            select(User.id, User.telegram_id, User.vip_plan_id, SubscriptionPlan.name, User.vip_until)
+            .outerjoin(SubscriptionPlan, SubscriptionPlan.id == User.vip_plan_id)
+            .where(User.telegram_id == user_id)
+        )
+        row = result.one_or_none()
+        
+        if row is None:
+            return None
+        
+        internal_user_id, telegram_id, plan_id, plan_name, end_date = row
+        # Una fecha ya pasada cuenta como vencida aunque la expiración aún no haya corrido
+        is_active = plan_id is not None and (end_date is None or end_date > now)
+        if not is_active:
+            plan_id = plan_name = end_date = None
+        days_left = (end_date - now).days if end_date is not None else None
+        return SubscriptionStatus(
+            internal_user_id, telegram_id, is_active, plan_id, plan_name, end_date, days_left
+        )
+    
+    @staticmethod
+    def _subscriber_query():
+        return (
+            select(
+                Subscription.id, Subscription.plan_id, Subscription.end_date,
+                User.telegram_id, User.username, User.first_name
+            )
+            .join(User, User.id == Subscription.user_id)
+            .where(Subscription.is_active == True)
+        )
+    
+    @staticmethod
+    async def list_active_subscribers(after_id=0, before_id=None, limit=VIP_PAGE_SIZE):
+        """
+        Página de suscripciones activas paginada por id.
+        
+        Con after_id avanza y con before_id retrocede; cada página es una
+        sola consulta acotada sobre el índice parcial de suscripciones
+        activas. Retorna (filas, hay_más_en_esa_dirección).
+        """
+        query = SubscriptionService._subscriber_query()
+        if before_id is not None:
+            query = query.where(Subscription.id < before_id).order_by(Subscription.id.desc())
+        else:
+            query = query.where(Subscription.id > after_id).order_by(Subscription.id)
+        
+        async with get_session() as session:
+            result = await session.execute(query.limit(limit + 1))
+            rows = result.all()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before_id is not None:
+            rows.reverse()
+        return rows, has_more
+    
+    @staticmethod
+    async def search_subscribers(query_text, limit=VIP_PAGE_SIZE):
+        """Busca suscripciones activas por telegram_id o nombre de usuario exacto"""
+        query_text = query_text.strip().lstrip("@")
+        query = SubscriptionService._subscriber_query()
+        if query_text.isdigit():
+            query = query.where(User.telegram_id == int(query_text))
+        else:
+            query = query.where(func.lower(User.username) == query_text.lower())
+        
+        async with get_session() as session:
+            result = await session.execute(query.order_by(Subscription.id).limit(limit))
+            return result.all()
+    
+    @staticmethod
+    async def get_subscriber(subscription_id):
+        async with get_session() as session:
+            result = await session.execute(
+                SubscriptionService._subscriber_query().where(Subscription.id == subscription_id)
+            )
+            return result.one_or_none()
+    
+    @staticmethod
+    async def extend_subscription(subscription_id, days):
+        """Alarga una suscripción activa; con una permanente lanza AlreadyPermanentError"""
+        async with get_session() as session:
+            result = await session.execute(
+                select(Subscription).where(Subscription.id == subscription_id, Subscription.is_active == True)
+            )
+            subscription = result.scalar_one_or_none()
             
-            if not user:
+            if not subscription:
                 return None
             
-            # Obtener suscripción activa
-            now = datetime.datetime.utcnow()
-            subscription_query = select(Subscription).where(
-                Subscription.user_id == user.id,
-                Subscription.is_active == True,
-                (Subscription.end_date == None) | (Subscription.end_date > now)
+            if subscription.end_date is None:
+                # Sin fecha de fin no hay nada que alargar
+                raise AlreadyPermanentError(subscription.user_id)
+            
+            # Una suscripción vencida pero aún activa se alarga desde ahora
+            base = max(subscription.end_date, datetime.datetime.utcnow())
+            subscription.end_date = base + datetime.timedelta(days=days)
+            await session.flush()
+            await session.execute(refresh_vip_status(user_ids=[subscription.user_id]))
+            await session.commit()
+            SchedulerService.track_subscription(subscription)
+            return subscription
+    
+    @staticmethod
+    async def revoke_subscription(subscription_id):
+        """
+        Desactiva una suscripción. Retorna (desactivada, telegram_id), con
+        telegram_id solo si el usuario se queda sin suscripción vigente.
+        """
+        async with get_session() as session:
+            result = await session.execute(
+                select(Subscription.user_id, Subscription.plan_id).where(
+                    Subscription.id == subscription_id, Subscription.is_active == True
+                )
+            )
+            row = result.one_or_none()
+            
+            if row is None:
+                return False, None
+            
+            revoked = await session.execute(
+                update(Subscription)
+                .where(Subscription.id == subscription_id, Subscription.is_active == True)
+                .values(is_active=False)
             )
+            if revoked.rowcount != 1:
+                await session.rollback()
+                return False, None
+            await StatsService.increment(session, vip_active_key(row.plan_id), -1)
             
-            subscription_result = await session.execute(subscription_query)
-            return subscription_result.scalar_one_or_none()
+            # Solo se devuelve el telegram_id si se queda sin plan vigente
+            await session.execute(refresh_vip_status(user_ids=[row.user_id]))
+            result = await session.execute(
+                select(User.telegram_id).where(User.id == row.user_id, User.vip_plan_id == None)
+            )
+            telegram_id = result.scalar_one_or_none()
+            await session.commit()
+            return True, telegram_id
     
     @staticmethod
     async def get_expiring_subscriptions(days=1):
@@ -98,12 +390,26 @@ class SubscriptionService:
     async def deactivate_expired_subscriptions():
         async with get_session() as session:
             now = datetime.datetime.utcnow()
-            
-            stmt = update(Subscription).where(
+            expired_filter = and_(
                 Subscription.is_active == True,
                 Subscription.end_date != None,
                 Subscription.end_date <= now
-            ).values(is_active=False)
+            )
+            
+            result = await session.execute(select(Subscription.user_id).where(expired_filter).distinct())
+            user_ids = result.scalars().all()
+            
+            result = await session.execute(
+                select(Subscription.plan_id, func.count(Subscription.id))
+                .where(expired_filter)
+                .group_by(Subscription.plan_id)
+            )
+            await StatsService.increment_many(
+                session, {vip_active_key(plan_id): -count for plan_id, count in result.all()}
+            )
+            
+            stmt = update(Subscription).where(expired_filter).values(is_active=False)
             
             await session.execute(stmt)
+            await session.execute(refresh_vip_status(now, user_ids))
             await session.commit()
\ No newline at end of file
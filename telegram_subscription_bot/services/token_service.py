@@ -1,16 +1,23 @@
 # telegram_subscription_bot/services/token_service.py
 import uuid
-from sqlalchemy import select
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+from aiogram import Bot
 from database.db import get_session
 from database.models import Token, SubscriptionPlan, User
+from services.subscription_service import SubscriptionService, AlreadyPermanentError
+from services.stats_service import StatsService, TOKENS_GENERATED, TOKENS_USED
+from config import TOKEN_BATCH_CHUNK_SIZE
 
 class TokenService:
+    # Nombre de usuario de cada bot, para no llamar a get_me() en cada enlace
+    _bot_usernames = {}
+    
     @staticmethod
     async def generate_token(plan_id):
         async with get_session() as session:
             # Verificar que el plan existe
-            plan_result = await session.execute(select(SubscriptionPlan).where(SubscriptionPlan.id == plan_id))
-            plan = plan_result.scalar_one_or_none()
+            plan = await SubscriptionService.get_plan(plan_id)
             
             if not plan:
                 return None
@@ -26,9 +33,51 @@ class TokenService:
             )
             
             session.add(token)
+            await StatsService.increment(session, TOKENS_GENERATED)
             await session.commit()
             return token
     
+    @staticmethod
+    async def generate_tokens(plan_id, count, attempts=3):
+        """Genera count tokens para un plan en una sola transacción"""
+        async with get_session() as session:
+            # Verificar una sola vez que el plan existe
+            if await SubscriptionService.get_plan(plan_id) is None:
+                return None
+            
+            for attempt in range(attempts):
+                values = [str(uuid.uuid4()) for _ in range(count)]
+                try:
+                    for i in range(0, count, TOKEN_BATCH_CHUNK_SIZE):
+                        await session.execute(
+                            insert(Token),
+                            [
+                                {"token": value, "plan_id": plan_id, "is_used": False}
+                                for value in values[i:i + TOKEN_BATCH_CHUNK_SIZE]
+                            ]
+                        )
+                    await StatsService.increment(session, TOKENS_GENERATED, count)
+                    await session.commit()
+                    return values
+                except IntegrityError:
+                    # Colisión con un token existente: repetir el lote completo
+                    await session.rollback()
+                    if attempt == attempts - 1:
+                        raise
+    
+    @staticmethod
+    async def get_bot_username(bot: Bot):
+        username = TokenService._bot_usernames.get(bot.id)
+        if username is None:
+            bot_info = await bot.get_me()
+            username = TokenService._bot_usernames[bot.id] = bot_info.username
+        return username
+    
+    @staticmethod
+    async def build_link(bot: Bot, token_value):
+        bot_username = await TokenService.get_bot_username(bot)
+        return f"https://t.me/{bot_username}?start={token_value}"
+    
     @staticmethod
     async def validate_token(token_value):
         async with get_session() as session:
@@ -64,5 +113,70 @@ class TokenService:
             token.is_used = True
             token.used_by = user_id
             
+            await StatsService.increment(session, TOKENS_USED)
             await session.commit()
-            return token
\ No newline at end of file
+            return token
+    
+    @staticmethod
+    async def redeem_token(token_value, user_id, session=None, user=None):
+        """
+        Canjea un token en una sola transacción.
+
+        El token se reclama con un UPDATE condicionado a is_used = false, así
+        que entre canjes simultáneos del mismo token solo uno lo consigue.
+        Retorna (token_valido, suscripcion); si la suscripción no se puede
+        crear el token no se consume. Con una suscripción permanente lanza
+        AlreadyPermanentError y el token queda libre. Con una sesión recibida
+        no se confirma.
+        """
+        if session is None:
+            async with get_session() as session:
+                token_valid, subscription = await TokenService.redeem_token(token_value, user_id, session)
+                if subscription:
+                    await session.commit()
+            return token_valid, subscription
+        
+        # Recargar el catálogo abre otra conexión: hacerlo antes de tomar el
+        # bloqueo de escritura para no esperarla con el token reclamado
+        await SubscriptionService.get_subscription_plans()
+        
+        # Con el usuario ya cargado un permanente se rechaza sin llegar a reclamar el token
+        if SubscriptionService.is_permanent_vip(user):
+            raise AlreadyPermanentError(user_id)
+        
+        claim = (
+            update(Token)
+            .where(Token.token == token_value, Token.is_used == False)
+            .values(is_used=True, used_by=user_id)
+        )
+        
+        if session.get_bind().dialect.update_returning:
+            result = await session.execute(claim.returning(Token.plan_id))
+            plan_id = result.scalar_one_or_none()
+            claimed = plan_id is not None
+        else:
+            result = await session.execute(claim)
+            claimed = result.rowcount == 1
+            if claimed:
+                plan_result = await session.execute(select(Token.plan_id).where(Token.token == token_value))
+                plan_id = plan_result.scalar_one()
+        
+        if not claimed:
+            # Token inexistente o ya usado
+            return False, None
+        
+        restore = update(Token).where(Token.token == token_value).values(is_used=False, used_by=None)
+        try:
+            subscription = await SubscriptionService.add_subscription(session, user_id, plan_id, user)
+        except AlreadyPermanentError:
+            # Quien capture el error puede confirmar la sesión: devolver antes el token
+            await session.execute(restore)
+            raise
+        
+        if not subscription:
+            # Devolver el token dentro de la misma transacción
+            await session.execute(restore)
+            return True, None
+        
+        await StatsService.increment(session, TOKENS_USED)
+        return True, subscription
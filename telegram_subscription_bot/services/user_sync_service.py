@@ -0,0 +1,167 @@
+# telegram_subscription_bot/services/user_sync_service.py
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from database.db import get_session
+from database.models import User
+from services.stats_service import StatsService, USERS_TOTAL
+from utils.cache import TTLCache
+from config import (
+    USER_CACHE_SIZE, USER_CACHE_TTL,
+    USER_FLUSH_INTERVAL, USER_FLUSH_BATCH_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+# (username, first_name, last_name, is_admin)
+Profile = Tuple[Optional[str], Optional[str], Optional[str], bool]
+
+class UserSyncService:
+    """
+    Sincroniza los perfiles de usuario con la base de datos.
+
+    Los perfiles sin cambios se resuelven en memoria. Los cambios se encolan
+    y un escritor en segundo plano los guarda por lotes en una sola
+    transacción. Los usuarios desconocidos esperan a que su lote se confirme
+    para que los manejadores los encuentren ya en la base de datos.
+    """
+
+    def __init__(self, cache_size: int = USER_CACHE_SIZE, cache_ttl: float = USER_CACHE_TTL,
+                 flush_interval: float = USER_FLUSH_INTERVAL, batch_size: int = USER_FLUSH_BATCH_SIZE):
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending: Dict[int, Profile] = {}
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def sync_user(self, telegram_id: int, username: Optional[str], first_name: Optional[str],
+                        last_name: Optional[str], is_admin: bool) -> None:
+        profile = (username, first_name, last_name, is_admin)
+        cached = self.cache.get(telegram_id)
+
+        if cached == profile:
+            # Perfil sin cambios: no hace falta tocar la base de datos
+            return
+
+        self._ensure_started()
+        self._pending[telegram_id] = profile
+
+        if cached is not None:
+            # Usuario conocido con datos nuevos: escritura diferida
+            self.cache.set(telegram_id, profile)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+            return
+
+        # Usuario desconocido: esperar a que el lote se confirme
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(telegram_id, []).append(future)
+        self._wakeup.set()
+        await future
+
+    def invalidate(self, telegram_id: int) -> None:
+        self.cache.pop(telegram_id)
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, {}
+        waiters, self._waiters = self._waiters, {}
+        ids = list(batch)
+
+        try:
+            async with get_session() as session:
+                existing = {}
+                for i in range(0, len(ids), self.batch_size):
+                    chunk = ids[i:i + self.batch_size]
+                    result = await session.execute(select(User).where(User.telegram_id.in_(chunk)))
+                    existing.update({user.telegram_id: user for user in result.scalars()})
+
+                created = 0
+                for telegram_id, (username, first_name, last_name, is_admin) in batch.items():
+                    user = existing.get(telegram_id)
+                    if user is None:
+                        created += 1
+                        session.add(User(
+                            telegram_id=telegram_id,
+                            username=username,
+                            first_name=first_name,
+                            last_name=last_name,
+                            is_admin=is_admin
+                        ))
+                    elif (user.username, user.first_name, user.last_name, user.is_admin) != batch[telegram_id]:
+                        user.username = username
+                        user.first_name = first_name
+                        user.last_name = last_name
+                        user.is_admin = is_admin
+
+                await StatsService.increment(session, USERS_TOTAL, created)
+                await session.commit()
+        except asyncio.CancelledError:
+            # Devolver el lote a la cola sin pisar perfiles encolados después
+            for telegram_id, profile in batch.items():
+                self._pending.setdefault(telegram_id, profile)
+            for telegram_id, futures in waiters.items():
+                self._waiters.setdefault(telegram_id, [])[:0] = futures
+            raise
+        except Exception as e:
+            logger.exception("Error flushing user profiles")
+            # Olvidar los perfiles para que la próxima actualización los reintente
+            for telegram_id in ids:
+                self.cache.pop(telegram_id)
+            for futures in waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for telegram_id, profile in batch.items():
+            # No pisar un perfil más reciente encolado durante la escritura
+            if telegram_id not in self._pending:
+                self.cache.set(telegram_id, profile)
+        for futures in waiters.values():
+            for future in futures:
+                if not future.done():
+                    future.set_result(None)
+
+    async def start(self) -> None:
+        self._ensure_started()
+
+    async def stop(self) -> None:
+        if self._task:
+            # Dejar que termine la escritura en curso en lugar de cancelarla
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                # Solo se ignora si la cancelada fue la tarea, no quien llama a stop
+                if not self._task.cancelled():
+                    raise
+            finally:
+                self._stopping = False
+                self._task = None
+        await self.flush()
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+# Instancia compartida por todos los AccessMiddleware del proceso
+user_sync = UserSyncService()
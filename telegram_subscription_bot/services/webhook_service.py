@@ -0,0 +1,157 @@
+# telegram_subscription_bot/services/webhook_service.py
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+from middlewares.update_executor import SLOT_HELD_KEY, update_partition_key
+from config import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_STATS_PATH, WEBHOOK_SECRET,
+    UPDATE_QUEUE_SIZE, UPDATE_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+class UpdateQueue:
+    """
+    Cola acotada de updates atendida por un pool de workers.
+
+    El servidor webhook solo encola; si la cola está llena rechaza el update
+    para que Telegram lo reintente más tarde en lugar de acumular memoria.
+    Cada worker pide el turno del usuario en el ejecutor del dispatcher nada
+    más sacar el update, así que los de un mismo usuario se procesan en el
+    orden de la cola y con el estado FSM que dejó el anterior.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, maxsize: int = UPDATE_QUEUE_SIZE,
+                 workers: int = UPDATE_WORKERS):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.maxsize = maxsize
+        self.workers = workers
+        self.stats = {
+            "received": 0, "rejected": 0, "processed": 0, "failed": 0,
+            "max_depth": 0, "busy_workers": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0
+        }
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self.executor = dispatcher.get("update_executor")
+
+    def put(self, update: Update) -> bool:
+        """Encola sin esperar; retorna False si la cola está llena"""
+        self.stats["received"] += 1
+        try:
+            self._queue.put_nowait((time.monotonic(), update))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            return False
+        self.stats["max_depth"] = max(self.stats["max_depth"], self._queue.qsize())
+        return True
+
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def snapshot(self) -> dict:
+        processed = self.stats["processed"] + self.stats["failed"]
+        return {
+            **self.stats,
+            "depth": self.queue_size(),
+            "capacity": self.maxsize,
+            "workers": self.workers,
+            "wait_seconds_avg": self.stats["wait_seconds_total"] / processed if processed else 0.0
+        }
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 10):
+        # Dar a los workers la oportunidad de vaciar la cola antes de cancelarlos
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Update queue stopped with %s pending updates", self.queue_size())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            enqueued_at, update = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self.stats["wait_seconds_total"] += wait
+            self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], wait)
+            self.stats["busy_workers"] += 1
+            try:
+                if self.executor is None:
+                    await self.process(update)
+                else:
+                    # Sin await entre get() y el turno: la partición respeta el orden de la cola
+                    async with self.executor.slot(update_partition_key(update)):
+                        await self.process(update, **{SLOT_HELD_KEY: True})
+                self.stats["processed"] += 1
+            except Exception:
+                self.stats["failed"] += 1
+                logger.exception("Error processing update %s", update.update_id)
+            finally:
+                self.stats["busy_workers"] -= 1
+                self._queue.task_done()
+
+    async def process(self, update: Update, **kwargs):
+        result = await self.dispatcher.feed_update(self.bot, update, **kwargs)
+        if isinstance(result, TelegramMethod):
+            # Respuesta directa del handler, como haría el webhook síncrono
+            await self.dispatcher.silent_call_request(self.bot, result)
+
+class WebhookServer:
+    """Servidor aiohttp que recibe los updates de Telegram y los pasa a la cola"""
+
+    def __init__(self, bot: Bot, update_queue: UpdateQueue, host: str = WEBHOOK_HOST,
+                 port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get(WEBHOOK_STATS_PATH, self.handle_stats)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=401, text="Unauthorized")
+
+        try:
+            data = await request.json(loads=self.bot.session.json_loads)
+            update = Update.model_validate(data, context={"bot": self.bot})
+        except Exception as e:
+            logger.warning("Invalid webhook payload: %s", e)
+            return web.Response(status=400, text="Bad Request")
+
+        if not self.update_queue.put(update):
+            # Cola llena: Telegram reintenta la entrega más tarde
+            return web.Response(status=503, text="Busy")
+        return web.json_response({})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.update_queue.snapshot())
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info("Webhook server listening on %s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
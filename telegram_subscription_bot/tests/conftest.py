@@ -0,0 +1,19 @@
+# telegram_subscription_bot/tests/conftest.py
+import asyncio
+import os
+import sys
+import tempfile
+
+# El motor se crea al importar database.db: la base temporal se fija antes
+_tmpdir = tempfile.mkdtemp(prefix="subscription_bot_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'test.sqlite3')}"
+os.environ.setdefault("ADMIN_IDS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from database.db import init_db
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    asyncio.run(init_db())
@@ -0,0 +1,40 @@
+# telegram_subscription_bot/tests/test_channel_service.py
+import asyncio
+
+from sqlalchemy import select
+
+from database.db import get_session, engine
+from database.models import User
+from services.channel_service import ChannelService
+from services.stats_service import StatsService, FREE_MEMBERS
+
+async def _join_before_register():
+    telegram_id = 3000
+    ChannelService.free_status_cache.clear()
+    
+    # El usuario entra al canal antes de que exista su fila
+    assert await ChannelService.update_free_channel_status(telegram_id, True) is False
+    assert ChannelService.free_status_cache.get(telegram_id) is None
+    
+    async with get_session() as session:
+        session.add(User(telegram_id=telegram_id))
+        await session.commit()
+    free_members = (await StatsService.get_all())[0].get(FREE_MEMBERS, 0)
+    
+    # La siguiente comprobación sí debe escribir la membresía
+    assert await ChannelService.update_free_channel_status(telegram_id, True) is True
+    assert ChannelService.free_status_cache.get(telegram_id) is True
+    
+    async with get_session() as session:
+        stored = (await session.execute(
+            select(User.is_in_free_channel).where(User.telegram_id == telegram_id)
+        )).scalar_one()
+    counters, _ = await StatsService.get_all()
+    await engine.dispose()
+    return stored, counters.get(FREE_MEMBERS, 0) - free_members
+
+def test_join_before_register_is_not_cached():
+    stored, free_members_delta = asyncio.run(_join_before_register())
+    
+    assert stored is True
+    assert free_members_delta == 1
@@ -0,0 +1,40 @@
+# telegram_subscription_bot/tests/test_fsm_storage.py
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import select
+
+from database.db import get_session, engine
+from database.fsm_storage import DatabaseStorage
+from database.models import FSMRecord
+
+def _storage_key(user_id):
+    return StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+
+async def _count_with_pending_writes():
+    storage = DatabaseStorage(flush_interval=60)
+    try:
+        await storage.set_state(_storage_key(1), "Wizard:first")
+        await storage.set_state(_storage_key(2), "Wizard:first")
+        await storage.flush()
+        
+        # Escrituras aún sin guardar: un cambio de estado, un alta y una baja
+        await storage.set_state(_storage_key(1), "Wizard:second")
+        await storage.set_state(_storage_key(3), "Wizard:first")
+        await storage.set_state(_storage_key(2), None)
+        
+        counts = await storage.count_states()
+        pending = len(storage._pending)
+        async with get_session() as session:
+            stored = dict((await session.execute(select(FSMRecord.key, FSMRecord.state))).all())
+        return counts, pending, stored
+    finally:
+        storage._flush_task.cancel()
+        await engine.dispose()
+
+def test_count_states_applies_pending_writes_without_flushing():
+    counts, pending, stored = asyncio.run(_count_with_pending_writes())
+    
+    assert counts == {"Wizard:first": 1, "Wizard:second": 1}
+    assert pending == 3
+    assert sorted(stored.values()) == ["Wizard:first", "Wizard:first"]
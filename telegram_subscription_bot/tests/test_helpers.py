@@ -0,0 +1,36 @@
+# telegram_subscription_bot/tests/test_helpers.py
+import datetime
+
+import pytest
+
+from utils.helpers import recurrence_to_crontab, next_cron_fire_time
+
+# Domingo
+NOW = datetime.datetime(2026, 10, 18, 0, 0)
+
+@pytest.mark.parametrize("pattern, weekdays", [
+    ("0 9 * * 1", {"Mon"}),
+    ("0 9 * * 0", {"Sun"}),
+    ("0 9 * * 7", {"Sun"}),
+    ("0 9 * * 1-5", {"Mon", "Tue", "Wed", "Thu", "Fri"}),
+    ("0 9 * * 0,6", {"Sat", "Sun"}),
+    ("0 9 * * mon-fri", {"Mon", "Tue", "Wed", "Thu", "Fri"}),
+])
+def test_cron_day_of_week_follows_crontab(pattern, weekdays):
+    expression = recurrence_to_crontab(pattern, NOW)
+    fired, after = set(), NOW
+    for _ in range(14):
+        after = next_cron_fire_time(expression, after)
+        fired.add(after.strftime("%a"))
+    assert fired == weekdays
+
+def test_weekly_recurrence_keeps_scheduled_weekday():
+    scheduled = datetime.datetime(2026, 10, 20, 9, 30)  # martes
+    expression = recurrence_to_crontab("weekly", scheduled)
+    assert next_cron_fire_time(expression, scheduled) == scheduled + datetime.timedelta(days=7)
+
+def test_invalid_cron_pattern_is_rejected():
+    with pytest.raises(ValueError):
+        recurrence_to_crontab("0 9 * *", NOW)
+    with pytest.raises(ValueError):
+        recurrence_to_crontab("0 9 * * 8", NOW)
@@ -0,0 +1,87 @@
+# telegram_subscription_bot/tests/test_query_budget.py
+import asyncio
+import datetime
+
+import pytest
+from aiogram import Bot, Dispatcher, Router
+from aiogram.filters import Command
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Message, Update
+from sqlalchemy import select
+
+from database.db import get_session, engine
+from database.models import User
+from middlewares.query_budget import QueryBudgetMiddleware, QueryBudgetExceeded, query_budget
+
+def _build_dispatcher(middleware):
+    router = Router()
+
+    @router.message(Command("few"))
+    @query_budget(2)
+    async def few(message: Message):
+        await _run_queries(2)
+
+    @router.message(Command("many"))
+    @query_budget(2)
+    async def many(message: Message):
+        await _run_queries(3)
+
+    @router.message(Command("unbudgeted"))
+    async def unbudgeted(message: Message):
+        await _run_queries(2)
+
+    dp = Dispatcher(storage=MemoryStorage())
+    middleware.setup(dp)
+    dp.include_router(router)
+    return dp
+
+async def _run_queries(count):
+    # La misma sentencia cada vez, como en un N+1
+    async with get_session() as session:
+        for telegram_id in range(count):
+            await session.execute(select(User.id).where(User.telegram_id == telegram_id))
+
+def _message_update(text):
+    return Update.model_validate({
+        "update_id": 1,
+        "message": {
+            "message_id": 1,
+            "date": datetime.datetime.now(datetime.timezone.utc),
+            "chat": {"id": 7, "type": "private"},
+            "from": {"id": 7, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    })
+
+def _feed(middleware, text):
+    dp = _build_dispatcher(middleware)
+    bot = Bot("42:TEST")
+
+    async def run():
+        try:
+            await dp.feed_update(bot, _message_update(text))
+        finally:
+            await bot.session.close()
+            await engine.dispose()
+
+    asyncio.run(run())
+
+def test_strict_mode_raises_when_handler_exceeds_budget():
+    middleware = QueryBudgetMiddleware(default_budget=10, budgets={}, strict=True, repeat_threshold=3)
+
+    with pytest.raises(QueryBudgetExceeded, match=r"\(many\) ran 3 queries .* budget is 2"):
+        _feed(middleware, "/many")
+    assert middleware.stats["over_budget"] == 1
+    assert middleware.stats["repeated"] == 1
+
+def test_handler_within_budget_passes_in_strict_mode():
+    middleware = QueryBudgetMiddleware(default_budget=10, budgets={}, strict=True, repeat_threshold=3)
+
+    _feed(middleware, "/few")
+    assert middleware.stats == {"updates": 1, "queries": 2, "over_budget": 0, "repeated": 0}
+
+def test_configured_budget_applies_to_handlers_without_decorator():
+    middleware = QueryBudgetMiddleware(default_budget=10, budgets={"unbudgeted": 1}, strict=True)
+
+    with pytest.raises(QueryBudgetExceeded, match=r"\(unbudgeted\) ran 2 queries"):
+        _feed(middleware, "/unbudgeted")
@@ -0,0 +1,47 @@
+# telegram_subscription_bot/tests/test_subscription_handlers.py
+import asyncio
+import datetime
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+from handlers import subscription_handlers
+from services.stats_service import StatsService
+
+NON_ADMIN_ID = 555
+
+def _callback_update(user_id, data):
+    return Update.model_validate({
+        "update_id": 1,
+        "callback_query": {
+            "id": "1",
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "chat_instance": "1",
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": datetime.datetime.now(datetime.timezone.utc),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "Panel de Administración",
+            },
+        },
+    })
+
+def test_statistics_rejects_non_admins(monkeypatch):
+    async def get_all():
+        raise AssertionError("non-admins must not read the statistics")
+    monkeypatch.setattr(StatsService, "get_all", get_all)
+
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(subscription_handlers.router)
+    bot = Bot("42:TEST")
+
+    async def run():
+        try:
+            return await dp.feed_update(bot, _callback_update(NON_ADMIN_ID, "statistics"))
+        finally:
+            await bot.session.close()
+
+    assert asyncio.run(run()) is UNHANDLED
@@ -0,0 +1,45 @@
+# telegram_subscription_bot/tests/test_subscription_service.py
+import asyncio
+import datetime
+
+from database.db import get_session, engine
+from database.models import User, Subscription, SubscriptionPlan
+from services.subscription_service import SubscriptionService, AlreadyPermanentError
+
+async def _create_subscription(telegram_id, end_date, is_permanent):
+    async with get_session() as session:
+        plan = SubscriptionPlan(name="Plan", duration_days=30, price=10, is_permanent=is_permanent)
+        user = User(telegram_id=telegram_id)
+        session.add_all([plan, user])
+        await session.flush()
+        subscription = Subscription(user_id=user.id, plan_id=plan.id, end_date=end_date, is_active=True)
+        session.add(subscription)
+        await session.commit()
+    return subscription.id
+
+async def _extend(telegram_id, end_date, is_permanent):
+    subscription_id = await _create_subscription(telegram_id, end_date, is_permanent)
+    try:
+        try:
+            await SubscriptionService.extend_subscription(subscription_id, 7)
+            extended = True
+        except AlreadyPermanentError:
+            extended = False
+        async with get_session() as session:
+            subscription = await session.get(Subscription, subscription_id)
+        return extended, subscription.end_date
+    finally:
+        await engine.dispose()
+
+def test_extend_subscription_adds_days():
+    end_date = datetime.datetime.utcnow() + datetime.timedelta(days=3)
+    extended, new_end_date = asyncio.run(_extend(4000, end_date, False))
+    
+    assert extended is True
+    assert new_end_date == end_date + datetime.timedelta(days=7)
+
+def test_extend_permanent_subscription_is_rejected():
+    extended, end_date = asyncio.run(_extend(4001, None, True))
+    
+    assert extended is False
+    assert end_date is None
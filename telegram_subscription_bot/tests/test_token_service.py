@@ -0,0 +1,78 @@
+# telegram_subscription_bot/tests/test_token_service.py
+import asyncio
+
+import pytest
+from sqlalchemy import select, func
+
+from database.db import get_session, engine
+from database.models import User, Subscription, SubscriptionPlan, Token
+from services.subscription_service import SubscriptionService, AlreadyPermanentError
+from services.token_service import TokenService
+
+CONCURRENT_REDEMPTIONS = 20
+
+async def _create_token(telegram_ids, token_value="concurrent-token", is_permanent=False):
+    async with get_session() as session:
+        plan = SubscriptionPlan(name="Mensual", duration_days=30, price=10, is_permanent=is_permanent)
+        session.add(plan)
+        session.add_all([User(telegram_id=telegram_id) for telegram_id in telegram_ids])
+        await session.flush()
+        token = Token(token=token_value, plan_id=plan.id, is_used=False)
+        session.add(token)
+        await session.commit()
+    # Como create_subscription_plan: el catálogo en memoria incluye el plan nuevo
+    await SubscriptionService.load_plan_catalog()
+    return token.token
+
+async def _redeem_concurrently():
+    telegram_ids = list(range(1000, 1000 + CONCURRENT_REDEMPTIONS))
+    token_value = await _create_token(telegram_ids)
+
+    results = await asyncio.gather(*(
+        TokenService.redeem_token(token_value, telegram_id) for telegram_id in telegram_ids
+    ))
+
+    async with get_session() as session:
+        subscriptions = (await session.execute(
+            select(func.count(Subscription.id)).join(User).where(User.telegram_id.in_(telegram_ids))
+        )).scalar()
+        used = (await session.execute(
+            select(func.count(Token.id)).where(Token.token == token_value, Token.is_used == True)
+        )).scalar()
+    await engine.dispose()
+    return results, subscriptions, used
+
+def test_concurrent_redemptions_consume_token_once():
+    results, subscriptions, used = asyncio.run(_redeem_concurrently())
+
+    successes = [result for result in results if result[1] is not None]
+    assert len(successes) == 1
+    assert all(result == (False, None) for result in results if result[1] is None)
+    assert subscriptions == 1
+    assert used == 1
+
+async def _redeem_as_permanent_subscriber():
+    telegram_id = 2000
+    permanent_token = await _create_token([telegram_id], "permanent-token", is_permanent=True)
+    assert (await TokenService.redeem_token(permanent_token, telegram_id))[1] is not None
+
+    async with get_session() as session:
+        plan_id = (await session.execute(
+            select(Token.plan_id).where(Token.token == permanent_token)
+        )).scalar()
+        session.add(Token(token="unused-token", plan_id=plan_id, is_used=False))
+        await session.commit()
+
+    try:
+        with pytest.raises(AlreadyPermanentError):
+            await TokenService.redeem_token("unused-token", telegram_id)
+        async with get_session() as session:
+            token = (await session.execute(select(Token).where(Token.token == "unused-token"))).scalar_one()
+        return token
+    finally:
+        await engine.dispose()
+
+def test_permanent_subscriber_does_not_consume_token():
+    token = asyncio.run(_redeem_as_permanent_subscriber())
+    assert token.is_used is False
+    assert token.used_by is None
@@ -0,0 +1,103 @@
+# telegram_subscription_bot/tests/test_update_executor.py
+import asyncio
+import datetime
+
+from aiogram import Bot, Dispatcher, Router, F
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Message, Update
+
+from middlewares.update_executor import UpdateExecutorMiddleware
+from services.webhook_service import UpdateQueue
+
+class Wizard(StatesGroup):
+    entering_price = State()
+
+def _build_dispatcher(calls):
+    router = Router()
+
+    @router.message(Command("go"))
+    async def go(message: Message, state: FSMContext):
+        # Un handler lento: el siguiente update del usuario ya está en cola
+        await asyncio.sleep(0.05)
+        await state.set_state(Wizard.entering_price)
+        calls.append("go")
+
+    @router.message(StateFilter(Wizard.entering_price))
+    async def price(message: Message, state: FSMContext):
+        await state.clear()
+        calls.append(f"price:{message.text}")
+
+    @router.message(F.text)
+    async def fallback(message: Message):
+        calls.append(f"fallback:{message.text}")
+
+    dp = Dispatcher(storage=MemoryStorage())
+    UpdateExecutorMiddleware().setup(dp)
+    dp.include_router(router)
+    return dp
+
+def _message_update(update_id, user_id, text):
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": datetime.datetime.now(datetime.timezone.utc),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    })
+
+async def _feed_back_to_back(dp, bot, user_id, first_update_id):
+    await asyncio.gather(
+        dp.feed_update(bot, _message_update(first_update_id, user_id, "/go")),
+        dp.feed_update(bot, _message_update(first_update_id + 1, user_id, "9.99")),
+    )
+
+def test_wizard_step_sees_state_set_by_previous_update():
+    calls = []
+    dp = _build_dispatcher(calls)
+    bot = Bot("42:TEST")
+
+    async def run():
+        await _feed_back_to_back(dp, bot, 7, 1)
+        await bot.session.close()
+
+    asyncio.run(run())
+    assert calls == ["go", "price:9.99"]
+
+def test_back_to_back_wizard_steps_stay_in_order_per_user():
+    calls = []
+    dp = _build_dispatcher(calls)
+    bot = Bot("42:TEST")
+
+    async def run():
+        await asyncio.gather(*(
+            _feed_back_to_back(dp, bot, user_id, user_id * 10) for user_id in range(1, 6)
+        ))
+        await bot.session.close()
+
+    asyncio.run(run())
+    assert sorted(calls) == sorted(["go"] * 5 + ["price:9.99"] * 5)
+    assert not [call for call in calls if call.startswith("fallback")]
+
+def test_webhook_queue_keeps_wizard_steps_in_order():
+    calls = []
+    dp = _build_dispatcher(calls)
+    bot = Bot("42:TEST")
+    queue = UpdateQueue(dp, bot, maxsize=100, workers=8)
+
+    async def run():
+        await queue.start()
+        for user_id in range(1, 6):
+            assert queue.put(_message_update(user_id * 10, user_id, "/go"))
+            assert queue.put(_message_update(user_id * 10 + 1, user_id, "9.99"))
+        await queue.stop()
+        await bot.session.close()
+
+    asyncio.run(run())
+    assert queue.stats["processed"] == 10
+    assert sorted(calls) == sorted(["go"] * 5 + ["price:9.99"] * 5)
@@ -1,2 +1,4 @@
 # telegram_subscription_bot/utils/__init__.py
-from . import helpers
\ No newline at end of file
+from . import helpers
+from . import cache
+from . import metrics
\ No newline at end of file
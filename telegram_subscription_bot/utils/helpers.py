@@ -1,12 +1,28 @@
 # telegram_subscription_bot/utils/helpers.py
 import datetime
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from apscheduler.triggers.cron import CronTrigger
 
 def format_datetime(dt: datetime.datetime) -> str:
     """Formatea una fecha y hora en un formato legible"""
     return dt.strftime("%d/%m/%Y %H:%M")
 
+def format_plan_duration(duration_days: int, is_permanent: bool = False) -> str:
+    """Retorna el texto de duración de un plan de suscripción"""
+    if is_permanent or duration_days == -1:
+        return "Permanente"
+    elif duration_days == 1:
+        return "1 día"
+    elif duration_days == 7:
+        return "1 semana"
+    elif duration_days == 14:
+        return "2 semanas"
+    elif duration_days == 30:
+        return "1 mes"
+    else:
+        return f"{duration_days} días"
+
 def parse_buttons_json(buttons_json: str) -> List[List[Dict[str, Any]]]:
     """Convierte un JSON de botones en una estructura utilizable por aiogram"""
     try:
@@ -32,4 +48,61 @@ def generate_crontab_from_recurrence(recurrence_type: str, day_of_week: int = No
         return f"{minute} {hour} 1 * *"
     else:
         # Predeterminado: diario a medianoche
-        return "0 0 * * *"
\ No newline at end of file
+        return "0 0 * * *"
+
+def _crontab_day_of_week(field: str) -> str:
+    """Traduce el día de la semana de crontab (0 o 7 = domingo) a lunes=0"""
+    items = []
+    for item in field.split(","):
+        expr, _, step = item.partition("/")
+        if expr == "*" and not step:
+            items.append(item)
+            continue
+        if expr == "*":
+            start, end = 0, 6
+        elif expr.replace("-", "", 1).isdigit():
+            start, _, end = expr.partition("-")
+            start = int(start)
+            # "a/n" recorre desde a hasta el sábado, como en cron
+            end = int(end) if end else (6 if step else start)
+        else:
+            # Nombres (mon-fri): ya significan lo mismo en ambos formatos
+            items.append(item)
+            continue
+        if not 0 <= start <= end <= 7:
+            raise ValueError(f"Invalid day of week: {item}")
+        days = range(start, end + 1, int(step) if step else 1)
+        items.extend(str((day - 1) % 7) for day in days)
+    return ",".join(dict.fromkeys(items))
+
+def recurrence_to_crontab(pattern: str, scheduled_time: datetime.datetime) -> str:
+    """
+    Convierte un patrón (daily, weekly, monthly o cron) en expresión crontab.
+    
+    Las expresiones guardadas numeran los días desde lunes=0, como
+    APScheduler; un patrón cron estándar (domingo=0) se traduce al guardarlo.
+    """
+    if pattern in ("daily", "weekly", "monthly"):
+        return generate_crontab_from_recurrence(
+            pattern,
+            day_of_week=scheduled_time.weekday(),
+            hour=scheduled_time.hour,
+            minute=scheduled_time.minute
+        )
+    fields = pattern.split()
+    if len(fields) != 5:
+        raise ValueError(f"Invalid cron pattern: {pattern}")
+    fields[4] = _crontab_day_of_week(fields[4])
+    return " ".join(fields)
+
+def next_cron_fire_time(expression: str, after: datetime.datetime) -> Optional[datetime.datetime]:
+    """Retorna el siguiente disparo (UTC, sin zona) estrictamente posterior a after"""
+    # Días de la semana desde lunes=0, como en generate_crontab_from_recurrence
+    fields = expression.split()
+    trigger = CronTrigger(
+        minute=fields[0], hour=fields[1], day=fields[2], month=fields[3],
+        day_of_week=fields[4], timezone=datetime.timezone.utc
+    )
+    after = after.replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=1)
+    next_time = trigger.get_next_fire_time(None, after)
+    return next_time.replace(tzinfo=None) if next_time else None
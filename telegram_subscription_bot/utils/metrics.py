@@ -0,0 +1,165 @@
+# telegram_subscription_bot/utils/metrics.py
+import bisect
+import logging
+import math
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+logger = logging.getLogger(__name__)
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, object] = {}
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._values.items()):
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key: Tuple, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    """Valor que solo crece"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels) -> None:
+        """Copia un total llevado en otro sitio (p. ej. las estadísticas del pool)"""
+        self._values[self._key(labels)] = value
+
+class Gauge(_Metric):
+    """Valor instantáneo que sube y baja"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class _HistogramValue:
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.count = 0
+        self.sum = 0.0
+
+class Histogram(_Metric):
+    """Distribución de observaciones en cubetas acumulativas"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        sample = self._values.get(key)
+        if sample is None:
+            sample = self._values[key] = _HistogramValue(len(self.buckets))
+        sample.buckets[bisect.bisect_left(self.buckets, value)] += 1
+        sample.count += 1
+        sample.sum += value
+
+    def _render_sample(self, key: Tuple, value: _HistogramValue) -> List[str]:
+        names = self.labelnames + ("le",)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, value.buckets):
+            cumulative += count
+            labels = _format_labels(names, key + (_format_value(bound),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(value.sum)}")
+        lines.append(f"{self.name}_count{labels} {value.count}")
+        return lines
+
+class Registry:
+    """
+    Métricas del proceso en formato de texto de Prometheus.
+
+    Los valores que ya se llevan en otros objetos (pool, planificadores) se
+    copian en cada lectura mediante colectores registrados con add_collector.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Awaitable[None]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]) -> None:
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], Awaitable[None]]) -> None:
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    async def collect(self) -> None:
+        for collector in list(self._collectors):
+            try:
+                await collector()
+            except Exception:
+                # Un colector roto no debe dejar sin el resto de métricas
+                logger.exception("Error collecting metrics in %s", getattr(collector, "__name__", collector))
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()